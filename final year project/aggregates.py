@@ -0,0 +1,112 @@
+import os
+import pandas as pd
+from storage import find_partition, read_partition, write_partition
+from grouped_stats import MomentAccumulator
+
+AGGREGATE_FOLDER = "aggregates"
+MONTH_KEYS = ['year', 'month']
+EMOTION_PREFIX = "emotion_"
+
+
+def aggregate_partition(processed_folder, year):
+    return os.path.join(processed_folder, AGGREGATE_FOLDER, str(year))
+
+
+def build_aggregates(stats, emotion_counts, subreddit, topic):
+    """
+    The compact per (subreddit, topic, year, month) table written next to the processed comments.
+    stats is a group_stats (or MomentAccumulator.result) frame indexed by year and month, emotion_counts
+    the number of comments per primary emotion with the same index.
+    """
+    aggregates = pd.DataFrame({
+        'count': stats['count'],
+        'sentiment_sum': stats['mean'] * stats['count'],
+        'weight_sum': stats['weight_sum'],
+        'weighted_sentiment_sum': stats['weighted_mean'] * stats['weight_sum'],
+        'weighted_sentiment_sq_sum': (stats['weighted_var'] + stats['weighted_mean'] ** 2) * stats['weight_sum'],
+        'unweighted_std': stats['unweighted_std'],
+        'weighted_std': stats['weighted_std'],
+    })
+    emotion_counts = emotion_counts.reindex(aggregates.index, fill_value=0)
+    for emotion in emotion_counts.columns:
+        aggregates[f"{EMOTION_PREFIX}{emotion}"] = emotion_counts[emotion].astype(int)
+    aggregates = aggregates.reset_index()
+    aggregates.insert(0, 'topic', topic)
+    aggregates.insert(0, 'subreddit', subreddit)
+    return aggregates
+
+
+class MonthlyAggregator:
+    """
+    Builds the aggregate table from scored comments (score, created_utc, sentiment_score and
+    primary_emotion columns), either all at once or one batch at a time.
+    """
+
+    def __init__(self):
+        self.moments = MomentAccumulator(MONTH_KEYS)
+        self.emotion_counts = None
+
+    def update(self, df):
+        if df.empty:
+            return
+        month_df = pd.DataFrame({
+            'year': df['created_utc'].dt.year,
+            'month': df['created_utc'].dt.month,
+            'sentiment_score': df['sentiment_score'],
+            'score': df['score'],
+        })
+        self.moments.update(month_df)
+        counts = pd.crosstab([month_df['year'], month_df['month']], df['primary_emotion'])
+        self.emotion_counts = counts if self.emotion_counts is None else self.emotion_counts.add(counts, fill_value=0)
+
+    def result(self, subreddit, topic):
+        stats = self.moments.result()
+        # Without any comment there are no emotions to count either
+        emotion_counts = self.emotion_counts if self.emotion_counts is not None else pd.DataFrame(index=stats.index)
+        return build_aggregates(stats, emotion_counts, subreddit, topic)
+
+
+def monthly_aggregates(df, subreddit, topic):
+    aggregator = MonthlyAggregator()
+    aggregator.update(df)
+    return aggregator.result(subreddit, topic)
+
+
+def emotion_columns(aggregates):
+    return [column for column in aggregates.columns if column.startswith(EMOTION_PREFIX)]
+
+
+def emotion_totals(aggregates):
+    """
+    Total comments per primary emotion, indexed by emotion name.
+    """
+    columns = emotion_columns(aggregates)
+    totals = aggregates[columns].sum()
+    totals.index = [column[len(EMOTION_PREFIX):] for column in columns]
+    return totals[totals > 0].sort_values(ascending=False, kind='stable')
+
+
+def monthly_measure(aggregates, measure):
+    """
+    Monthly value of a processed output column as graph.py and to_excel.py compute it, the mean of
+    that column over the month's comments.
+    """
+    if measure == 'Sentiment_Score':
+        return aggregates['sentiment_sum'] / aggregates['count']
+    if measure == 'Weighted_Monthly_Std':
+        return aggregates['weighted_std']
+    if measure == 'Unweighted_Monthly_Std':
+        return aggregates['unweighted_std']
+    raise ValueError(f"No aggregate for column {measure}")
+
+
+def has_aggregates(processed_folder, year):
+    return find_partition(aggregate_partition(processed_folder, year))[0] is not None
+
+
+def read_aggregates(processed_folder, year):
+    return read_partition(aggregate_partition(processed_folder, year))
+
+
+def write_aggregates(aggregates, processed_folder, year, fmt):
+    return write_partition(aggregates, aggregate_partition(processed_folder, year), fmt)
@@ -1,110 +1,307 @@
 import pandas as pd
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from nrclex import NRCLex
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import numpy as np
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-from nltk.corpus import stopwords
-import re
-import nltk
+from storage import write_partition, find_partition, partition_file, PartitionWriter
+from schema import read_comments, iter_comments, apply_schema
+from text_preprocessing import get_preprocessor
+from keyword_matcher import get_matcher
+from scoring import score_comments, create_pool, get_analyzer
+from warmup import warm_up, worker_context
+from grouped_stats import add_group_keys, attach_group_stats, GRANULARITY_NAMES, MomentAccumulator
+from cache import ResultCache, code_version, package_versions
+from instrumentation import get_instrumentation, start_run
+from aggregates import MonthlyAggregator, monthly_aggregates, write_aggregates, aggregate_partition
+import aggregates
+import schema
+import text_preprocessing
+import keyword_matcher
+import scoring
+import emotion_index
+import grouped_stats
+
+# Raw columns carried over to the processed output, with their output names
+ID_COLUMNS = {'id': 'Comment_ID', 'link_id': 'Thread_ID', 'parent_id': 'Parent_ID', 'subreddit': 'Subreddit'}
 
 
 def preprocess_text(text):
-    text = str(text)
-    text = re.sub(r"http\S+|www\S+|https\S+|@\w+", '', text)
-    text = re.sub(r"[^\w\s]", '', text)
-    stop_words = set(stopwords.words('english'))
-    word_tokens = word_tokenize(text.lower())
-    filtered_text = [word for word in word_tokens if word not in stop_words]
-    ps = PorterStemmer()
-    stemmed_text = [ps.stem(word) for word in filtered_text]
-    return ' '.join(stemmed_text)
-
-def contains_keywords(text, keywords):
-    word_tokens = word_tokenize(preprocess_text(text).lower())
-    return any(keyword.lower() in word_tokens for keyword in keywords)
-
-def weighted_std(values, weights):
+    return ' '.join(get_preprocessor().tokenize(text))
+
+def contains_keywords(text, keywords, preprocessed=False):
+    # A keyword has to equal one token of the preprocessed text, so keywords of several words never match.
+    # Like the original analysis the processed text is preprocessed once more first, stemming is not
+    # idempotent ('accidental' -> 'accident' -> 'accid') so this changes which comments are kept
+    if not preprocessed:
+        text = preprocess_text(text)
+    return get_matcher(keywords, exact_token=True).search(get_preprocessor().tokenize(text))
+
+def output_frame(df, period):
+    """
+    The processed output columns of scored comments. The comment, thread and parent ids and the subreddit
+    are carried over when the raw data has them, so the output can be indexed by author and thread.
     """
-    Compute the weighted standard deviation.
+    id_columns = [column for column in ID_COLUMNS if column in df.columns]
+    output_df = df[['score', 'created_utc', 'author', 'body', 'sentiment_score', 'unweighted_std', 'weighted_std', 'primary_emotion'] + id_columns]
+    output_df.columns = ['Score', 'Created_UTC', 'Author', 'Comment', 'Sentiment_Score', f'Unweighted_{period}_Std', f'Weighted_{period}_Std', 'Primary_Emotion'] + [ID_COLUMNS[column] for column in id_columns]
+    return apply_schema(output_df.copy())
+
+def empty_output(df, period):
+    """
+    The processed output of a year where no comment passed the filters, with the columns output_frame
+    gives the cleaned comments in df.
     """
-    average = np.average(values, weights=weights)
-    variance = np.average((values-average)**2, weights=weights) 
-    return np.sqrt(variance)
-
-def primary_emotion(text, threshold=0.3):
-    text = preprocess_text(text) 
-    emotion = NRCLex(text)
-    total_emotion_freq = sum(freq for emotion, freq in emotion.affect_frequencies.items() if emotion not in ['positive', 'negative'])
-    emotions = {key: value for key, value in emotion.affect_frequencies.items() if key not in ['positive', 'negative']}
-    if emotions and total_emotion_freq > 0:
-        primary, score = max(emotions.items(), key=lambda item: item[1])
-        if score / total_emotion_freq >= threshold:
-            return primary
-    return "No emotion"
-
-def analyze_reddit_comments_in_folder(input_folder, output_folder, analyzer, keywords):
+    df = df.iloc[:0].assign(sentiment_score=np.float32(0), unweighted_std=np.float32(0), weighted_std=np.float32(0), primary_emotion='')
+    return output_frame(df, period)
+
+def load_comments(input_partition, min_score=1):
+    return clean_comments(read_comments(input_partition), min_score)
+
+def clean_comments(df, min_score=1):
+    if 'body' not in df.columns or 'score' not in df.columns or 'author' not in df.columns:
+        return None
+    
+    df = df.dropna(subset=['body'])
+    df = df[~df['body'].isin(['[deleted]', '[removed]'])]
+    df = apply_schema(df)
+    df = df.dropna(subset=['score'])
+    df = df[df['score'] >= min_score]
+    df['score'] = df['score'].astype('int32')
+
+    # Tokenized once here, the keyword, sentiment and emotion stages all reuse processed_body
+    df['processed_body'] = get_preprocessor().tokenize_series(df['body']).str.join(' ')
+    return df
+
+def analyze_year(input_partition, output_partition, analyzer, keywords, output_format='parquet', export_excel=False, workers=1, granularity='month',
+                 cache=None, min_score=1, threshold=0.3, subreddit=None, topic=None):
+    input_path, _ = find_partition(input_partition)
+    if input_path is None:
+        return
+    cache = cache or ResultCache(None)
+    code = code_version if cache.root is not None else lambda *sources: None
+    # Each stage key covers its inputs, configuration and code, so a change only reruns the stages after it.
+    # The column schema and the text and scoring libraries shape every stage and go into the first key
+    base = [code(schema), package_versions('nltk', 'vaderSentiment', 'nrclex')]
+    preprocess_key = cache.key('preprocess', cache.file_digest(input_path), min_score, base, code(load_comments, clean_comments, text_preprocessing))
+    keywords_key = cache.key('keywords', preprocess_key, sorted(keywords or []), code(contains_keywords, keyword_matcher))
+    sentiment_key = cache.key('sentiment', keywords_key, code(scoring.score_texts))
+    emotion_key = cache.key('emotion', keywords_key, threshold, code(scoring.score_texts, emotion_index))
+    aggregates_key = cache.key('aggregates', sentiment_key, granularity, code(grouped_stats))
+    output_key = cache.key('output', aggregates_key, emotion_key, output_format, export_excel, subreddit, topic, code(aggregates, output_frame))
+    output_path = partition_file(output_partition, output_format)
+    processed_folder, year = os.path.split(output_partition)
+    aggregate_path = partition_file(aggregate_partition(processed_folder, year), output_format)
+    instrumentation = get_instrumentation()
+    # The .xlsx copy is checked too, a deleted or stale copy reruns the year
+    excel_path = partition_file(output_partition, 'xlsx') if export_excel and output_format != 'xlsx' else None
+    if all(cache.is_current(path, output_key) for path in (output_path, aggregate_path, excel_path) if path is not None):
+        print(f"Skipping {input_path}, {output_path} is up to date")
+        instrumentation.count('years_skipped')
+        return
+
+    with instrumentation.stage('preprocess'):
+        df = cache.cached('preprocess', preprocess_key, lambda: load_comments(input_partition, min_score), source=input_path)
+    if df is None:
+        return
+    instrumentation.count('rows_loaded', len(df))
+
+    if keywords:
+        with instrumentation.stage('keywords'):
+            kept = cache.cached('keywords', keywords_key, lambda: df.index[df['processed_body'].apply(lambda x: contains_keywords(x, keywords, preprocessed=True))], source=input_path)
+        df = df.loc[kept]
+    instrumentation.count('rows_kept', len(df))
+    period = GRANULARITY_NAMES[granularity]
+    if df.empty:
+        output_df = empty_output(df, period)
+    else:
+        with instrumentation.stage('sentiment'):
+            df['sentiment_score'] = cache.cached('sentiment', sentiment_key, lambda: score_comments(df['processed_body'], analyzer, workers, emotion=False)['sentiment_score'], source=input_path)
+        with instrumentation.stage('emotion'):
+            df['primary_emotion'] = cache.cached('emotion', emotion_key, lambda: score_comments(df['processed_body'], analyzer, workers, threshold=threshold, sentiment=False)['primary_emotion'], source=input_path)
+        instrumentation.count('rows_scored', len(df))
+
+        def aggregate():
+            group_keys = add_group_keys(df, granularity)
+            attach_group_stats(df, group_keys)
+            return df[['unweighted_std', 'weighted_std']]
+
+        with instrumentation.stage('aggregates'):
+            df[['unweighted_std', 'weighted_std']] = cache.cached('aggregates', aggregates_key, aggregate, source=input_path)
+
+        output_df = output_frame(df, period)
+
+    with instrumentation.stage('write'):
+        write_partition(output_df, output_partition, output_format)
+        if export_excel and output_format != 'xlsx':
+            write_partition(output_df, output_partition, 'xlsx')
+        # Monthly totals for reporting, so graphs, exports and regressions never reload the comments
+        write_aggregates(monthly_aggregates(df, subreddit, topic), processed_folder, year, output_format)
+    for path in (output_path, aggregate_path, excel_path):
+        if path is not None:
+            cache.mark_current(path, output_key)
+    instrumentation.count('rows_written', len(output_df))
+    instrumentation.count('years_analyzed')
+
+def analyze_year_streaming(input_partition, output_partition, analyzer, keywords, output_format='parquet', export_excel=False, workers=1, granularity='month',
+                           min_score=1, threshold=0.3, batch_rows=100000, subreddit=None, topic=None):
+    """
+    Out of core version of analyze_year. The input is read in batches of batch_rows, each batch is cleaned,
+    scored and folded into running per-period moments, and the scored rows are spilled to a temporary
+    partition. A second pass attaches the final standard deviations batch by batch, so memory stays bounded
+    by the batch size however large the year is. output_format has to be parquet, arrow or csv.
+    Excel cannot be written in batches, so the export_excel copy is made from the finished output.
+    """
+    if find_partition(input_partition)[0] is None:
+        return
+    spill_partition = f"{output_partition}.scored"
+    spill_path = partition_file(spill_partition, output_format)
+    spill = PartitionWriter(spill_partition, output_format)
+    accumulator = None
+    monthly = MonthlyAggregator()
+    # Columns of the cleaned comments, for the empty output written when no comment is kept
+    cleaned = pd.DataFrame(columns=['score', 'created_utc', 'author', 'body'])
+    instrumentation = get_instrumentation()
+    period = GRANULARITY_NAMES[granularity]
+    processed_folder, year = os.path.split(output_partition)
+    try:
+        pool = create_pool(workers) if workers > 1 else None
+        try:
+            for batch in iter_comments(input_partition, batch_rows):
+                instrumentation.count('rows_loaded', len(batch))
+                with instrumentation.stage('preprocess'):
+                    batch = clean_comments(batch, min_score)
+                if batch is None:
+                    return
+                cleaned = batch.iloc[:0]
+                if keywords:
+                    with instrumentation.stage('keywords'):
+                        batch = batch[batch['processed_body'].apply(lambda x: contains_keywords(x, keywords, preprocessed=True))]
+                instrumentation.count('rows_kept', len(batch))
+                if batch.empty:
+                    continue
+                with instrumentation.stage('score'):
+                    scores = score_comments(batch['processed_body'], analyzer, workers, threshold=threshold, pool=pool)
+                batch['sentiment_score'] = scores['sentiment_score']
+                batch['primary_emotion'] = scores['primary_emotion']
+                instrumentation.count('rows_scored', len(batch))
+                with instrumentation.stage('aggregates'):
+                    group_keys = add_group_keys(batch, granularity)
+                    if accumulator is None:
+                        accumulator = MomentAccumulator(group_keys)
+                    accumulator.update(batch)
+                    monthly.update(batch)
+                with instrumentation.stage('spill'):
+                    spill.write(batch[['score', 'created_utc', 'author', 'body', 'sentiment_score', 'primary_emotion'] + [column for column in ID_COLUMNS if column in batch.columns]])
+        finally:
+            spill.close()
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        with instrumentation.stage('write'):
+            if accumulator is None:
+                write_partition(empty_output(cleaned, period), output_partition, output_format)
+            else:
+                stats = accumulator.result()
+                output = PartitionWriter(output_partition, output_format)
+                for batch in iter_comments(spill_partition, batch_rows):
+                    write_output_batch(output, batch, stats, granularity, period)
+                output.close()
+            write_aggregates(monthly.result(subreddit, topic), processed_folder, year, output_format)
+            if export_excel:
+                write_partition(read_comments(output_partition), output_partition, 'xlsx')
+        instrumentation.count('years_analyzed')
+    finally:
+        # The scored rows are only needed until the output is written, whatever way the year ends
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+
+def write_output_batch(output, batch, stats, granularity, period):
+    group_keys = add_group_keys(batch, granularity)
+    batch_stats = stats.reindex(pd.MultiIndex.from_frame(batch[group_keys]) if len(group_keys) > 1 else pd.Index(batch[group_keys[0]]))
+    batch['unweighted_std'] = batch_stats['unweighted_std'].to_numpy()
+    batch['weighted_std'] = batch_stats['weighted_std'].to_numpy()
+    output_df = output_frame(batch, period)
+    output.write(output_df)
+    get_instrumentation().count('rows_written', len(output_df))
+
+def run_year_instrumented(run_year, *args, **kwargs):
+    """
+    Runs one year in a worker process and returns the worker's stage timers and counters for the parent.
+    """
+    instrumentation = start_run('analyze_year')
+    run_year(*args, **kwargs)
+    return instrumentation.state()
+
+def analyze_reddit_comments_in_folder(input_folder, output_folder, analyzer, keywords, output_format='parquet', export_excel=False, workers=1, year_workers=1, granularity='month',
+                                      cache_folder=None, min_score=1, threshold=0.3, streaming=False, batch_rows=100000, subreddit=None, topic=None):
+    """
+    Analyzes every year folder. workers is the total number of scoring processes, with year_workers > 1
+    several years are analyzed at once and the scoring processes are shared out between them.
+    With a cache_folder, stage results are reused across runs and up to date years are skipped.
+    streaming analyzes each year in bounded batches with analyze_year_streaming instead, without the cache.
+    """
+    cache = ResultCache(cache_folder)
     os.makedirs(output_folder, exist_ok=True)
+    jobs = []
     for year_folder in sorted(os.listdir(input_folder)):
         year_folder_path = os.path.join(input_folder, year_folder)
         if os.path.isdir(year_folder_path):
-            input_file_path = os.path.join(year_folder_path, f"{year_folder}.csv")
-            df = pd.read_csv(input_file_path, low_memory=False)
-            
-            if 'body' not in df.columns or 'score' not in df.columns or 'author' not in df.columns:
-                continue
-            
-            df = df.dropna(subset=['body'])
-            df = df[~df['body'].isin(['[deleted]', '[removed]'])]
-            df['score'] = pd.to_numeric(df['score'], errors='coerce')
-            df = df.dropna(subset=['score'])
-            df['score'] = pd.to_numeric(df['score'], errors='coerce')
-            df = df.dropna(subset=['score'])
-            df = df[df['score'] >= 1]
-
-            df['processed_body'] = df['body'].apply(preprocess_text)
-            
-
-            if keywords:
-                df = df[df['processed_body'].apply(lambda x: contains_keywords(x, keywords))]
-            if not df.empty:
-
-                df['sentiment_score'] = df['processed_body'].apply(lambda x: analyzer.polarity_scores(x)['compound'])
-            
-
-                df['primary_emotion'] = df['processed_body'].apply(lambda x: primary_emotion(x))
-                
-                df['created_utc'] = pd.to_datetime(df['created_utc'], format='%Y-%m-%d')
-                
-                df['year'] = df['created_utc'].dt.year
-                df['month'] = df['created_utc'].dt.month
-                
-                grouped = df.groupby(['year', 'month'])
-                unweighted_stds = grouped['sentiment_score'].std().reset_index(name='unweighted_std')
-                weighted_stds = grouped.apply(lambda x: weighted_std(x['sentiment_score'], x['score'])).reset_index(name='weighted_std')
-
-                df = df.merge(unweighted_stds, on=['year', 'month'], how='left')
-                df = df.merge(weighted_stds, on=['year', 'month'], how='left')
-
-                output_df = df[['score', 'created_utc', 'author', 'body', 'sentiment_score', 'unweighted_std', 'weighted_std', 'primary_emotion']]
-                
-                output_df.columns = ['Score', 'Created_UTC', 'Author', 'Comment', 'Sentiment_Score', 'Unweighted_Monthly_Std', 'Weighted_Monthly_Std', 'Primary_Emotion']
-                
-                output_file_path = os.path.join(output_folder, f"{year_folder}.xlsx")
-                
-                output_df.to_excel(output_file_path, index=False)
-
-analyzer = SentimentIntensityAnalyzer()
-
-# Configuration
-keywords = ['economy', 'inflation', 'recession', 'GDP', 'unemployment', 'markets', 'stocks', 
-            'bonds', 'interest rates', 'exchange rate', 'trade', 'investment', 'savings', 'debt', 'deficit', 
-            'taxation', 'budget', 'financial market', 'real estate', 'commodities', 'agriculture', 'manufacturing', 
-            'services sector', 'tech sector', 'energy market']
-
-input_folder = r"worldnews\worldnews_raw_economics"
-output_folder = r"worldnews\worldnews_processed_economics"
-
-
-analyze_reddit_comments_in_folder(input_folder, output_folder, analyzer, keywords)
\ No newline at end of file
+            jobs.append((os.path.join(year_folder_path, year_folder), os.path.join(output_folder, year_folder)))
+    if streaming:
+        run_year = partial(analyze_year_streaming, keywords=keywords, output_format=output_format, export_excel=export_excel, granularity=granularity,
+                           min_score=min_score, threshold=threshold, batch_rows=batch_rows, subreddit=subreddit, topic=topic)
+    else:
+        run_year = partial(analyze_year, keywords=keywords, output_format=output_format, export_excel=export_excel, granularity=granularity,
+                           cache=cache, min_score=min_score, threshold=threshold, subreddit=subreddit, topic=topic)
+    if year_workers <= 1:
+        for input_partition, output_partition in jobs:
+            run_year(input_partition, output_partition, analyzer, workers=workers)
+        return
+    workers_per_year = max(1, workers // year_workers)
+    warm_up()
+    with ProcessPoolExecutor(max_workers=year_workers, mp_context=worker_context()) as executor:
+        futures = [executor.submit(run_year_instrumented, run_year, input_partition, output_partition, None, workers=workers_per_year)
+                   for input_partition, output_partition in jobs]
+        for future in futures:
+            get_instrumentation().merge(future.result())
+
+if __name__ == "__main__":
+    analyzer = get_analyzer()
+
+    # Configuration
+    keywords = ['economy', 'inflation', 'recession', 'GDP', 'unemployment', 'markets', 'stocks', 
+                'bonds', 'interest rates', 'exchange rate', 'trade', 'investment', 'savings', 'debt', 'deficit', 
+                'taxation', 'budget', 'financial market', 'real estate', 'commodities', 'agriculture', 'manufacturing', 
+                'services sector', 'tech sector', 'energy market']
+
+    input_folder = r"worldnews\worldnews_raw_economics"
+    output_folder = r"worldnews\worldnews_processed_economics"
+    # Labels stored in the monthly aggregate tables
+    subreddit = "worldnews"
+    topic = "economics"
+    # Processed results are stored as "parquet", "arrow", "csv" or "xlsx", export_excel also writes an .xlsx copy
+    output_format = "parquet"
+    export_excel = False
+    # Scoring processes in total, and how many year folders are analyzed at the same time
+    workers = os.cpu_count() or 1
+    year_workers = 1
+    # Period the standard deviations are computed over: "month", "week", "day" or "author"
+    granularity = "month"
+    # Comments below min_score are dropped, threshold is the share an emotion needs to count as primary
+    min_score = 1
+    threshold = 0.3
+    # Stage results are cached here between runs, None disables caching
+    cache_folder = ".analysis_cache"
+    # Streaming keeps memory flat for years too large to load at once, batch_rows comments at a time
+    streaming = False
+    batch_rows = 100000
+    # Stage to run under cProfile, e.g. "preprocess", "sentiment" or "emotion", the run report is written to report_folder
+    profile_stage = None
+    report_folder = "logs"
+
+    instrumentation = start_run("analyze", profile_stage)
+    analyze_reddit_comments_in_folder(input_folder, output_folder, analyzer, keywords, output_format, export_excel, workers, year_workers, granularity,
+                                      cache_folder, min_score, threshold, streaming, batch_rows, subreddit, topic)
+    print(instrumentation.summary())
+    print(f"Run report saved: {instrumentation.write_report(report_folder)}")
\ No newline at end of file
@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import platform
+import logging
+import multiprocessing
+from datetime import datetime
+import pandas as pd
+from synthetic_dump import generate_dump, DEFAULT_KEYWORDS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def peak_rss_mb(children=False):
+    """
+    Peak resident memory of this process, or of its largest finished child process, in MB.
+    None when it cannot be measured on this platform.
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    if psutil is not None and not children:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) / 2**20
+    return None
+
+
+class StageTimer:
+    """
+    Times the measured part of a stage, loading its inputs and saving its outputs are left out.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+
+
+def _paths(workdir):
+    return {
+        'dump': os.path.join(workdir, 'dump.zst'),
+        'raw': os.path.join(workdir, 'raw'),
+        'raw_parallel': os.path.join(workdir, 'raw_parallel'),
+        'preprocessed': os.path.join(workdir, 'preprocessed.pkl'),
+        'scored': os.path.join(workdir, 'scored.pkl'),
+        'processed': os.path.join(workdir, 'processed'),
+        'output': os.path.join(workdir, 'output'),
+        'graphs': os.path.join(workdir, 'graphs'),
+    }
+
+
+def _raw_partitions(folder):
+    partitions = []
+    for year in sorted(os.listdir(folder)):
+        if year.isdigit():
+            partitions.append(os.path.join(folder, year, year))
+    return partitions
+
+
+def bench_decompress(workdir, config):
+    from gather_raw import read_blocks_zst
+    timer = StageTimer()
+    lines = 0
+    size = 0
+    with timer:
+        for block, _ in read_blocks_zst(_paths(workdir)['dump'], 2**24):
+            lines += block.count(b"\n")
+            size += len(block)
+    return timer.seconds, lines, size
+
+
+def _bench_extract(workdir, config, workers):
+    import gather_raw
+    logging.getLogger("bot").setLevel(logging.WARNING)
+    paths = _paths(workdir)
+    output = paths['raw'] if workers == 1 else paths['raw_parallel']
+    topics = {'benchmark': (output, config['keywords'])}
+    years = list(config['years'])
+    timer = StageTimer()
+    with timer:
+        if workers == 1:
+            gather_raw.process_file_multi(paths['dump'], topics, years, 'body', False, output_format='csv')
+        else:
+            gather_raw.process_file_parallel(paths['dump'], topics, years, 'body', False, workers, output_format='csv')
+    return timer.seconds, config['dump_lines'], config['dump_bytes']
+
+
+def bench_extract(workdir, config):
+    return _bench_extract(workdir, config, 1)
+
+
+def bench_extract_parallel(workdir, config):
+    return _bench_extract(workdir, config, config['workers'])
+
+
+def bench_preprocess(workdir, config):
+    from schema import read_comments
+    from analyze import clean_comments
+    frames = [read_comments(partition) for partition in _raw_partitions(_paths(workdir)['raw'])]
+    df = pd.concat(frames, ignore_index=True)
+    timer = StageTimer()
+    with timer:
+        df = clean_comments(df)
+    df.to_pickle(_paths(workdir)['preprocessed'])
+    return timer.seconds, sum(len(frame) for frame in frames), int(sum(frame['body'].str.len().sum() for frame in frames))
+
+
+def _bench_scoring(workdir, config, input_file, sentiment, emotion):
+    from scoring import score_comments
+    df = pd.read_pickle(input_file)
+    timer = StageTimer()
+    with timer:
+        scores = score_comments(df['processed_body'], workers=config['workers'], sentiment=sentiment, emotion=emotion)
+    for column in scores.columns:
+        df[column] = scores[column]
+    df.to_pickle(_paths(workdir)['scored'])
+    return timer.seconds, len(df), int(df['processed_body'].str.len().sum())
+
+
+def bench_sentiment(workdir, config):
+    return _bench_scoring(workdir, config, _paths(workdir)['preprocessed'], True, False)
+
+
+def bench_emotion(workdir, config):
+    return _bench_scoring(workdir, config, _paths(workdir)['scored'], False, True)
+
+
+def bench_grouped_std(workdir, config):
+    from grouped_stats import add_group_keys, attach_group_stats
+    df = pd.read_pickle(_paths(workdir)['scored'])
+    timer = StageTimer()
+    with timer:
+        keys = add_group_keys(df, 'month')
+        attach_group_stats(df, keys)
+    df.to_pickle(_paths(workdir)['scored'])
+    return timer.seconds, len(df), int(df.memory_usage(index=False).sum())
+
+
+def _processed_output(workdir):
+    df = pd.read_pickle(_paths(workdir)['scored'])
+    output_df = df[['score', 'created_utc', 'author', 'body', 'sentiment_score', 'unweighted_std', 'weighted_std', 'primary_emotion']]
+    output_df.columns = ['Score', 'Created_UTC', 'Author', 'Comment', 'Sentiment_Score', 'Unweighted_Monthly_Std', 'Weighted_Monthly_Std', 'Primary_Emotion']
+    return output_df
+
+
+def _bench_output(workdir, config, fmt, max_rows=None):
+    from storage import write_partition
+    output_df = _processed_output(workdir)
+    if max_rows is not None:
+        output_df = output_df.iloc[:max_rows]
+    timer = StageTimer()
+    with timer:
+        path = write_partition(output_df, os.path.join(_paths(workdir)['output'], 'benchmark'), fmt)
+    return timer.seconds, len(output_df), os.path.getsize(path)
+
+
+def bench_output_parquet(workdir, config):
+    return _bench_output(workdir, config, 'parquet')
+
+
+def bench_output_csv(workdir, config):
+    return _bench_output(workdir, config, 'csv')
+
+
+def bench_output_excel(workdir, config):
+    return _bench_output(workdir, config, 'xlsx', config['excel_rows'])
+
+
+def bench_plots(workdir, config):
+    from storage import write_partition
+    from graph import generate_graphs
+    paths = _paths(workdir)
+    output_df = _processed_output(workdir)
+    size = 0
+    for year, year_df in output_df.groupby(output_df['Created_UTC'].dt.year):
+        size += os.path.getsize(write_partition(year_df, os.path.join(paths['processed'], str(year)), 'parquet'))
+    timer = StageTimer()
+    with timer:
+        generate_graphs(paths['processed'], paths['graphs'], config['workers'], force=True)
+    return timer.seconds, len(output_df), size
+
+
+# In pipeline order, each stage reads what the ones before it wrote to the work folder
+STAGES = {
+    'decompress': bench_decompress,
+    'extract': bench_extract,
+    'extract_parallel': bench_extract_parallel,
+    'preprocess': bench_preprocess,
+    'sentiment': bench_sentiment,
+    'emotion': bench_emotion,
+    'grouped_std': bench_grouped_std,
+    'output_parquet': bench_output_parquet,
+    'output_csv': bench_output_csv,
+    'output_excel': bench_output_excel,
+    'plots': bench_plots,
+}
+
+
+def _run_stage(name, workdir, config, connection):
+    seconds, lines, size = STAGES[name](workdir, config)
+    connection.send({
+        'seconds': seconds,
+        'lines': lines,
+        'mb': size / 2**20,
+        'lines_per_sec': lines / seconds if seconds else None,
+        'mb_per_sec': size / 2**20 / seconds if seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_child_rss_mb': peak_rss_mb(children=True),
+    })
+    connection.close()
+
+
+def run_stage(name, workdir, config):
+    """
+    Runs one stage in a fresh process so its peak memory is measured on its own.
+    """
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_stage, args=(name, workdir, config, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if process.exitcode != 0 or result is None:
+        raise RuntimeError(f"Benchmark stage {name} failed with exit code {process.exitcode}")
+    return result
+
+
+def run_benchmarks(workdir, stages=None, lines=100000, keyword_density=0.1, years=range(2018, 2023), keywords=DEFAULT_KEYWORDS,
+                   workers=None, excel_rows=20000, seed=0):
+    """
+    Generates a synthetic dump in workdir and benchmarks the selected stages on it, all of them by default.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    stages = list(STAGES) if stages is None else stages
+    dump = _paths(workdir)['dump']
+    dump_lines, dump_bytes = generate_dump(dump, lines=lines, keyword_density=keyword_density, years=years, keywords=keywords, seed=seed)
+    config = {
+        'lines': lines,
+        'keyword_density': keyword_density,
+        'years': list(years),
+        'keywords': list(keywords),
+        'workers': workers or os.cpu_count() or 1,
+        'excel_rows': excel_rows,
+        'seed': seed,
+        'dump_lines': dump_lines,
+        'dump_bytes': dump_bytes,
+        'dump_compressed_bytes': os.path.getsize(dump),
+    }
+    results = {}
+    for name in stages:
+        print(f"Running benchmark {name}...")
+        results[name] = run_stage(name, workdir, config)
+        print(format_result(name, results[name]))
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': config,
+        'stages': results,
+    }
+
+
+def format_result(name, result):
+    rss = result['peak_rss_mb']
+    rss = f"{rss:.0f} MB" if rss is not None else "n/a"
+    return f"{name:>16}: {result['seconds']:8.2f} s {result['lines_per_sec'] or 0:12,.0f} lines/s {result['mb_per_sec'] or 0:8.2f} MB/s  peak RSS {rss}"
+
+
+def compare_runs(baseline, current):
+    """
+    Prints the throughput of each stage against a previous run, above 1.0 is faster.
+    """
+    if baseline['config'] != current['config']:
+        print("Warning: the runs used different benchmark configurations")
+    for name, result in current['stages'].items():
+        previous = baseline['stages'].get(name)
+        if previous is None or not previous['lines_per_sec'] or not result['lines_per_sec']:
+            continue
+        print(f"{name:>16}: {result['lines_per_sec'] / previous['lines_per_sec']:6.2f}x lines/s")
+
+
+def save_results(results, results_folder):
+    os.makedirs(results_folder, exist_ok=True)
+    path = os.path.join(results_folder, f"benchmark_{results['created'].replace(':', '-')}.json")
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    return path
+
+
+if __name__ == "__main__":
+    # Configuration
+    workdir = "benchmark_data"
+    results_folder = "benchmarks"
+    # Size and shape of the synthetic dump
+    lines = 100000
+    keyword_density = 0.1
+    years = range(2018, 2023)
+    # Stages to run, None runs all of STAGES in order
+    stages = None
+    workers = None
+    # Previous results file to compare against, None to skip
+    baseline_file = None
+
+    results = run_benchmarks(workdir, stages, lines, keyword_density, years, workers=workers)
+    print(f"Results saved: {save_results(results, results_folder)}")
+    if baseline_file is not None:
+        with open(baseline_file, 'r') as handle:
+            compare_runs(json.load(handle), results)
@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import inspect
+import pandas as pd
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def code_version(*sources):
+    """
+    Hash of the source code of the modules or functions a stage depends on, editing any of them
+    invalidates the stage.
+    """
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(inspect.getsource(source).encode())
+    return digest.hexdigest()
+
+
+def package_versions(*packages):
+    """
+    Installed versions of the packages a stage depends on, upgrading any of them invalidates the stage.
+    """
+    from importlib.metadata import version, PackageNotFoundError
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+class ResultCache:
+    """
+    Content addressed store for the output of each analysis stage. A stage result is keyed by a hash of
+    its inputs (file content hashes or the keys of earlier stages), its configuration and the code version,
+    so unchanged stages are loaded instead of recomputed. Results stored with a source are pruned to the
+    latest key per stage and source, so the cache does not grow with every change. With root None caching
+    is disabled.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, 'file_digests.json') if root else None
+
+    def file_digest(self, path, block_size=2**24):
+        """
+        Content hash of a file, remembered by path, size and modification time to avoid rereading large inputs.
+        """
+        if self.root is None:
+            return None
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as handle:
+                index = json.load(handle)
+        entry = index.get(os.path.abspath(path))
+        if entry and entry['signature'] == signature:
+            return entry['digest']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(block_size), b''):
+                digest.update(block)
+        index[os.path.abspath(path)] = {'signature': signature, 'digest': digest.hexdigest()}
+        self._write_json(self.index_path, index)
+        return digest.hexdigest()
+
+    def key(self, stage, *parts):
+        return _digest(stage, *parts) if self.root is not None else None
+
+    def _stage_path(self, stage, key):
+        return os.path.join(self.root, stage, f"{key}.pkl")
+
+    def cached(self, stage, key, compute, source=None):
+        """
+        Returns the stored result for key, or computes, stores and returns it. With a source, e.g. the input
+        file the stage reads, only the latest result of the stage for that source is kept, older ones are removed.
+        """
+        if self.root is None:
+            return compute()
+        path = self._stage_path(stage, key)
+        if os.path.exists(path):
+            result = pd.read_pickle(path)
+        else:
+            result = compute()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            pd.to_pickle(result, temporary_path)
+            os.replace(temporary_path, path)
+        if source is not None:
+            self._keep_latest(stage, key, source)
+        return result
+
+    def _keep_latest(self, stage, key, source):
+        latest_path = os.path.join(self.root, stage, 'latest', f"{_digest(os.path.abspath(source))}.json")
+        previous = None
+        if os.path.exists(latest_path):
+            with open(latest_path, 'r') as handle:
+                previous = json.load(handle).get('key')
+        # The new key is recorded before the old result is removed, so a stop in between only leaves a stale file
+        self._write_json(latest_path, {'source': os.path.abspath(source), 'key': key})
+        if previous is not None and previous != key and os.path.exists(self._stage_path(stage, previous)):
+            os.remove(self._stage_path(stage, previous))
+
+    def _marker_path(self, output_path):
+        return os.path.join(self.root, 'outputs', f"{_digest(os.path.abspath(output_path))}.json")
+
+    def is_current(self, output_path, key):
+        """
+        True when output_path exists and was last written from a result with this key.
+        """
+        if self.root is None or not os.path.exists(output_path):
+            return False
+        marker_path = self._marker_path(output_path)
+        if not os.path.exists(marker_path):
+            return False
+        with open(marker_path, 'r') as handle:
+            return json.load(handle).get('key') == key
+
+    def mark_current(self, output_path, key):
+        if self.root is not None:
+            self._write_json(self._marker_path(output_path), {'output': os.path.abspath(output_path), 'key': key})
+
+    def _write_json(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as handle:
+            json.dump(data, handle)
+        os.replace(temporary_path, path)
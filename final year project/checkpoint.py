@@ -0,0 +1,55 @@
+import os
+import json
+
+
+class ExtractionCheckpoint:
+    """
+    Progress of an extraction run over one dump, saved as JSON so an interrupted run can continue where
+    it stopped: the decompressed offset of the first unprocessed line (and the compressed offset at that
+    point, for reference), the line and match counts so far and the resume position of every output.
+    closing is set once the whole input is read and the outputs are being moved to their final names, a
+    run stopped then only has to finish closing them. A checkpoint only applies to the same input file
+    and settings it was written for.
+    """
+
+    def __init__(self, path, input_file, settings):
+        stat = os.stat(input_file)
+        self.path = path
+        self.identity = {
+            'input_file': os.path.abspath(input_file),
+            'input_size': stat.st_size,
+            'input_mtime_ns': stat.st_mtime_ns,
+            # Round tripped so tuples compare equal to the lists read back from the file
+            'settings': json.loads(json.dumps(settings)),
+        }
+
+    def load(self):
+        """
+        The saved state, or None when there is no checkpoint for this input and these settings.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as handle:
+            state = json.load(handle)
+        if state.get('identity') != self.identity:
+            return None
+        return state
+
+    def save(self, decompressed_offset, compressed_offset, line_count, matched_lines, positions, complete=False, closing=False):
+        state = {
+            'identity': self.identity,
+            'decompressed_offset': decompressed_offset,
+            'compressed_offset': compressed_offset,
+            'line_count': line_count,
+            'matched_lines': matched_lines,
+            'positions': positions,
+            'complete': complete,
+            'closing': closing,
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as handle:
+            json.dump(state, handle, indent=2)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary_path, self.path)
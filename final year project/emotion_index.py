@@ -0,0 +1,86 @@
+import os
+import json
+from itertools import chain
+import numpy as np
+
+AFFECTS = ['fear', 'anger', 'trust', 'surprise', 'positive', 'negative', 'sadness', 'disgust', 'joy', 'anticipation']
+# Order of the emotions in NRCLex.affect_frequencies, the first one wins when two are tied
+EMOTION_ORDER = ['fear', 'anger', 'trust', 'surprise', 'sadness', 'disgust', 'joy', 'anticipation']
+
+
+def load_nrc_lexicon(lexicon_file=None):
+    if lexicon_file is None:
+        import nrclex
+        # NRCLex 3.x keeps the lexicon on the class, later releases ship it as nrc_en.json
+        lexicon = getattr(nrclex.NRCLex, 'lexicon', None)
+        if isinstance(lexicon, dict):
+            return lexicon
+        package_folder = os.path.dirname(nrclex.__file__)
+        lexicon_file = os.path.join(package_folder, 'nrc_en.json')
+        if not os.path.exists(lexicon_file):
+            lexicon_file = os.path.join(package_folder, 'data', 'nrc_en.json')
+    with open(lexicon_file, 'r') as json_file:
+        return json.load(json_file)
+
+
+class EmotionIndex:
+    """
+    The NRC word to emotion lexicon as a token -> row lookup into a (words x affects) count matrix.
+    Scores batches of tokenized comments with the same rule as scoring.primary_emotion, which builds an
+    NRCLex object per comment.
+    """
+
+    def __init__(self, lexicon=None):
+        lexicon = load_nrc_lexicon() if lexicon is None else lexicon
+        affect_columns = {affect: column for column, affect in enumerate(AFFECTS)}
+        self.rows = {}
+        self.counts = np.zeros((len(lexicon) + 1, len(AFFECTS)), dtype=np.int32)
+        # Row 0 stays empty and stands in for every token outside the lexicon
+        for row, (word, affects) in enumerate(lexicon.items(), start=1):
+            self.rows[word] = row
+            for affect in affects:
+                if affect in affect_columns:
+                    self.counts[row, affect_columns[affect]] += 1
+        self.emotion_columns = [affect_columns[emotion] for emotion in EMOTION_ORDER]
+
+    def affect_counts(self, token_lists):
+        """
+        Returns a (comments x affects) array with how often each affect occurs in each comment.
+        """
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        get_row = self.rows.get
+        rows = np.fromiter((get_row(token, 0) for token in chain.from_iterable(token_lists)), dtype=np.int64, count=int(lengths.sum()))
+        comment_ids = np.repeat(np.arange(len(token_lists)), lengths)
+        token_counts = self.counts[rows]
+        return np.column_stack([
+            np.bincount(comment_ids, weights=token_counts[:, column], minlength=len(token_lists))
+            for column in range(len(AFFECTS))
+        ])
+
+    def primary_emotions(self, token_lists, threshold=0.3):
+        counts = self.affect_counts(token_lists)
+        total_counts = counts.sum(axis=1)
+        # Frequencies are computed and summed in the same order as NRCLex so the threshold test
+        # rounds exactly like the per-comment version
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frequencies = counts[:, self.emotion_columns] / total_counts[:, None]
+        frequencies[total_counts == 0] = 0.0
+        total_emotion_freq = np.zeros(len(token_lists))
+        for column in range(len(EMOTION_ORDER)):
+            total_emotion_freq = total_emotion_freq + frequencies[:, column]
+        primary = np.argmax(frequencies, axis=1) if len(token_lists) else np.zeros(0, dtype=np.int64)
+        primary_freq = frequencies[np.arange(len(token_lists)), primary]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_emotion = (total_emotion_freq > 0) & (primary_freq / total_emotion_freq >= threshold)
+        names = np.array(EMOTION_ORDER, dtype=object)[primary]
+        return np.where(has_emotion, names, "No emotion").tolist()
+
+
+_emotion_index = None
+
+
+def get_emotion_index():
+    global _emotion_index
+    if _emotion_index is None:
+        _emotion_index = EmotionIndex()
+    return _emotion_index
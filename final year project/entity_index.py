@@ -0,0 +1,168 @@
+import os
+import numpy as np
+import pandas as pd
+from storage import list_partitions, partition_columns, read_partition, write_partition
+from schema import read_comments, apply_schema
+from grouped_stats import add_group_keys, group_stats, stats_from_sums
+
+# Processed output column each kind of index groups the comments by
+ENTITY_COLUMNS = {
+    'author': 'Author',
+    'thread': 'Thread_ID',
+}
+# Keys that do not identify a real entity and are left out of the index
+EXCLUDED_KEYS = {
+    'author': ['[deleted]'],
+}
+# Comment columns stored with the index in key order, the key column itself is left out
+ROW_COLUMNS = ['Created_UTC', 'Sentiment_Score', 'Score', 'Author', 'Thread_ID', 'Comment_ID', 'Parent_ID']
+
+
+class EntityIndex:
+    """
+    Comments grouped by author or thread. keys is the sorted dictionary of entity ids and a key's position
+    in it is the entity's integer code. The comments of code k are rows[offsets[k]:offsets[k + 1]], in time
+    order, so looking up an entity is a binary search in keys and per entity statistics are one pass over
+    the rows, however many comments the corpus has.
+    """
+
+    def __init__(self, kind, keys, offsets, rows):
+        self.kind = kind
+        self.keys = keys
+        self.offsets = offsets
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.keys)
+
+    def code(self, key):
+        position = np.searchsorted(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            raise KeyError(key)
+        return position
+
+    def comments(self, key):
+        code = self.code(key)
+        return self.rows.iloc[self.offsets[code]:self.offsets[code + 1]]
+
+    def trajectory(self, key, granularity='month'):
+        """
+        group_stats of an entity's sentiment per period, the per author or per thread counterpart of the
+        monthly statistics in the processed output.
+        """
+        comments = self.comments(key)
+        df = pd.DataFrame({'created_utc': comments['Created_UTC'], 'sentiment_score': comments['Sentiment_Score'], 'score': comments['Score']})
+        return group_stats(df, add_group_keys(df, granularity))
+
+    def stats(self, value_column='Sentiment_Score', weight_column='Score'):
+        """
+        Comment count, weighted and unweighted sentiment mean and std and first and last comment time of
+        every entity, with the same statistics columns as group_stats. The sums are taken over the
+        contiguous row ranges with np.add.reduceat instead of grouping by key.
+        """
+        index = pd.Index(self.keys, name=self.kind)
+        if not len(self):
+            stats = stats_from_sums(pd.DataFrame(columns=['n', 'x', 'xx', 'w', 'wx', 'wxx'], index=index, dtype=float), 0.0)
+            return stats.assign(first_comment=pd.Series(index=index, dtype='datetime64[ns]'), last_comment=pd.Series(index=index, dtype='datetime64[ns]'))
+        values = self.rows[value_column].to_numpy(dtype=float)
+        weights = self.rows[weight_column].to_numpy(dtype=float)
+        # Shifted by the overall mean like group_sums, to keep the variances precise
+        shift = float(values.mean())
+        x = values - shift
+        starts = self.offsets[:-1]
+        parts = {'n': np.ones(len(x)), 'x': x, 'xx': x * x, 'w': weights, 'wx': weights * x, 'wxx': weights * x * x}
+        sums = pd.DataFrame({name: np.add.reduceat(part, starts) for name, part in parts.items()}, index=index)
+        stats = stats_from_sums(sums, shift)
+        created = self.rows['Created_UTC'].to_numpy()
+        stats['first_comment'] = created[starts]
+        stats['last_comment'] = created[self.offsets[1:] - 1]
+        return stats
+
+    def write(self, index_folder, fmt='parquet'):
+        folder = os.path.join(index_folder, self.kind)
+        keys = pd.DataFrame({'key': self.keys, 'offset': self.offsets[:-1], 'count': np.diff(self.offsets)})
+        write_partition(keys, os.path.join(folder, 'keys'), fmt)
+        write_partition(self.rows, os.path.join(folder, 'rows'), fmt)
+        # Stored so reports can use the per entity statistics without loading the rows
+        write_partition(self.stats().reset_index(), os.path.join(folder, 'stats'), fmt)
+        return folder
+
+
+def read_entity_index(index_folder, kind):
+    folder = os.path.join(index_folder, kind)
+    keys = read_partition(os.path.join(folder, 'keys'))
+    rows = apply_schema(read_partition(os.path.join(folder, 'rows')))
+    offsets = np.append(keys['offset'].to_numpy(dtype=np.int64), len(rows))
+    return EntityIndex(kind, keys['key'].astype(str).to_numpy(dtype=object), offsets, rows)
+
+
+def read_entity_stats(index_folder, kind):
+    return read_partition(os.path.join(index_folder, kind, 'stats'))
+
+
+def encode_partitions(processed_folder, column, exclude=()):
+    """
+    Reads the key and row columns of every year of a processed folder and dictionary encodes the keys
+    against one sorted dictionary. Only the per year dictionaries are matched against it, the rows are
+    then mapped with a single array lookup. Returns the dictionary, the code of every row (-1 for missing
+    or excluded keys) and the rows.
+    """
+    categories = []
+    codes = []
+    frames = []
+    for _, partition in list_partitions(processed_folder):
+        available = partition_columns(partition)
+        if column not in available:
+            raise ValueError(f"{partition} has no {column} column, extract and analyze the data again to add it")
+        df = read_comments(partition, columns=[column] + [name for name in ROW_COLUMNS if name != column and name in available])
+        keys = df.pop(column).astype('category')
+        categories.append(keys.cat.categories.astype(str).to_numpy(dtype=object))
+        codes.append(keys.cat.codes.to_numpy())
+        frames.append(df)
+    if not frames:
+        return np.array([], dtype=object), np.array([], dtype=np.int64), pd.DataFrame(columns=[name for name in ROW_COLUMNS if name != column])
+    dictionary = np.unique(np.concatenate(categories))
+    dictionary = dictionary[~np.isin(dictionary, list(exclude))]
+    row_codes = []
+    for year_categories, year_codes in zip(categories, codes):
+        position = np.searchsorted(dictionary, year_categories)
+        found = position < len(dictionary)
+        found[found] = dictionary[position[found]] == year_categories[found]
+        # The extra -1 at the end maps the -1 code of missing keys
+        mapping = np.append(np.where(found, position, -1), -1)
+        row_codes.append(mapping[year_codes])
+    return dictionary, np.concatenate(row_codes), pd.concat(frames, ignore_index=True)
+
+
+def build_entity_index(processed_folder, kind):
+    """
+    Builds the author or thread index of a processed folder. The key, time, sentiment, score and id
+    columns of every year are held in memory while the index is built, the comment text is not read.
+    """
+    dictionary, codes, rows = encode_partitions(processed_folder, ENTITY_COLUMNS[kind], EXCLUDED_KEYS.get(kind, ()))
+    kept = codes >= 0
+    codes = codes[kept]
+    rows = apply_schema(rows[kept].reset_index(drop=True))
+    # Keys left without comments, e.g. unused categories, are dropped and the codes renumbered
+    counts = np.bincount(codes, minlength=len(dictionary))
+    used = counts > 0
+    codes = (np.cumsum(used) - 1)[codes]
+    order = np.lexsort((rows['Created_UTC'].to_numpy(), codes))
+    offsets = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+    return EntityIndex(kind, dictionary[used], offsets, rows.take(order).reset_index(drop=True))
+
+
+def build_entity_indexes(processed_folder, index_folder, kinds=('author', 'thread'), fmt='parquet'):
+    for kind in kinds:
+        index = build_entity_index(processed_folder, kind)
+        print(f"Index saved: {index.write(index_folder, fmt)} ({len(index)} {kind}s, {len(index.rows)} comments)")
+
+
+if __name__ == "__main__":
+    # Configuration
+    processed_folder = r"worldnews\worldnews_processed_economics"
+    index_folder = r"worldnews\worldnews_index_economics"
+    kinds = ['author', 'thread']
+    output_format = "parquet"
+
+    build_entity_indexes(processed_folder, index_folder, kinds, output_format)
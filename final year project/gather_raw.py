@@ -1,9 +1,22 @@
 import zstandard
 import os
+import re
 import json
-import csv
+import calendar
 from datetime import datetime
 import logging.handlers
+from collections import deque
+from keyword_matcher import KeywordMatcher, get_matcher
+from storage import RawWriter, RAW_COLUMNS
+from checkpoint import ExtractionCheckpoint
+from instrumentation import get_instrumentation, start_run
+from warmup import worker_context
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configuration
 input_file = r"zst_input\worldnews_comments.zst"
@@ -14,80 +27,531 @@ keywords = ['economy', 'inflation', 'recession', 'GDP', 'unemployment', 'markets
              'exchange rate', 'trade', 'investment', 'savings', 'debt', 'deficit', 'taxation', 'budget', 'financial market', 'real estate', 
              'commodities', 'agriculture', 'manufacturing', 'services sector', 'tech sector', 'energy market'
              ]
+# Format of the extracted files: "parquet", "arrow" or "csv"
+output_format = "parquet"
+# Every topic is extracted in the same pass over the dump, add further topics here as (output path, keywords)
+topics = {
+    "economics": (base_output_path, keywords),
+}
 
 years_to_process = list(range(int(start_year), int(end_year) + 1))  
 
 log = logging.getLogger("bot")
 log.setLevel(logging.INFO)
-log_formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
-log_str_handler = logging.StreamHandler()
-log_str_handler.setFormatter(log_formatter)
-log.addHandler(log_str_handler)
-if not os.path.exists("logs"):
-    os.makedirs("logs")
-log_file_handler = logging.handlers.RotatingFileHandler(os.path.join("logs", "bot.log"), maxBytes=1024*1024*16, backupCount=5)
-log_file_handler.setFormatter(log_formatter)
-log.addHandler(log_file_handler)
-
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-    chunk = reader.read(chunk_size)
-    bytes_read += chunk_size
-    if previous_chunk is not None:
-        chunk = previous_chunk + chunk
-    try:
-        return chunk.decode()
-    except UnicodeDecodeError:
-        if bytes_read > max_window_size:
-            raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-        log.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-        return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
-
-def read_lines_zst(file_name):
+
+def setup_logging(log_folder="logs"):
+    """
+    Adds the console and rotating file handlers to the bot logger. Called by the entry points rather
+    than on import, so importing this module does not create files. Calling it again does nothing.
+    """
+    if log.handlers:
+        return
+    log_formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s')
+    log_str_handler = logging.StreamHandler()
+    log_str_handler.setFormatter(log_formatter)
+    log.addHandler(log_str_handler)
+    os.makedirs(log_folder, exist_ok=True)
+    log_file_handler = logging.handlers.RotatingFileHandler(os.path.join(log_folder, "bot.log"), maxBytes=1024*1024*16, backupCount=5)
+    log_file_handler.setFormatter(log_formatter)
+    log.addHandler(log_file_handler)
+
+def read_lines_zst(file_name, chunk_size=2**24, max_line_size=2**30):
+    """
+    Yields the lines of a zstd compressed file as bytes, without the line break. The file is decompressed
+    into one reusable buffer and lines are cut out of it at b"\n", which never occurs inside a multi-byte
+    UTF-8 character, so nothing is decoded here and json.loads decodes each line. The buffer only grows
+    when a single line is longer than it, up to max_line_size.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    filled = 0
     with open(file_name, 'rb') as file_handle:
-        buffer = ''
         reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
         while True:
-            chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-            if not chunk:
+            read = reader.readinto(view[filled:])
+            if not read:
                 break
-            lines = (buffer + chunk).split("\n")
-            for line in lines[:-1]:
-                yield line.strip()
-            buffer = lines[-1]
+            start = 0
+            end = buffer.find(b"\n", filled, filled + read)
+            filled += read
+            while end != -1:
+                yield bytes(view[start:end])
+                start = end + 1
+                end = buffer.find(b"\n", start, filled)
+            # Move the unfinished line to the front, or make room for it when it fills the whole buffer
+            if start:
+                view[:filled - start] = view[start:filled]
+                filled -= start
+            elif filled == len(buffer):
+                if len(buffer) >= max_line_size:
+                    raise ValueError(f"Line longer than {max_line_size:,} bytes in {file_name}")
+                view.release()
+                buffer.extend(bytes(len(buffer)))
+                view = memoryview(buffer)
         reader.close()
+    if filled:
+        yield bytes(view[:filled])
 
 def process_file(input_file, output_base_path, year, field, values, exact_match):
     log.info(f"Starting processing for year {year}.")
     line_count = 0
     matched_lines = 0
-    output_file_name = os.path.join(output_base_path, f"{year}.csv")
-    os.makedirs(os.path.dirname(output_file_name), exist_ok=True)
-    handle = open(output_file_name, 'a', encoding='UTF-8', newline='')
-    writer = csv.writer(handle)
-    writer.writerow(["score", "created_utc", "author", "body"]) 
+    writer = RawWriter(os.path.join(output_base_path, str(year)), 'csv')
+    matcher = get_matcher(values or [], exact_match=exact_match)
+    instrumentation = get_instrumentation()
     for line in read_lines_zst(input_file):
         line_count += 1
+        instrumentation.count('lines_read')
         if line_count % 10000 == 0:
             log.info(f"Processed {line_count} lines so far...")
         try:
             obj = json.loads(line)
+            instrumentation.count('lines_parsed')
             created = datetime.utcfromtimestamp(int(obj['created_utc']))
             if created.year != year:
                 continue
-            if not values or (field in obj and any(val.lower() in obj[field].lower() for val in values)):
-                writer.writerow([obj.get("score"), created.strftime("%Y-%m-%d"), obj.get("author"), obj.get("body")])
+            if not values or (field in obj and matcher.search(obj[field])):
+                writer.writerow(raw_row(obj, created))
                 matched_lines += 1
+                instrumentation.count('lines_matched')
         except Exception as e:
             log.error(f"Failed to process line: {e}")
-    handle.close()
+    writer.close()
     log.info(f"Completed processing for year {year}. Total lines processed: {line_count}. Total matched lines: {matched_lines}.")
 
+def raw_row(obj, created):
+    """
+    The RAW_COLUMNS values of a decoded comment.
+    """
+    return [obj.get("score"), created.strftime("%Y-%m-%d"), obj.get("author"), obj.get("body"),
+            obj.get("id"), obj.get("link_id"), obj.get("parent_id"), obj.get("subreddit")]
+
+SURROGATES = re.compile('[\ud800-\udfff]')
+
+def replace_surrogates(obj):
+    """
+    json decodes escaped unpaired surrogates such as \\ud800 into strings UTF-8 cannot encode, they are
+    replaced with U+FFFD in the comment's string fields so the comment can still be written.
+    """
+    for key, value in obj.items():
+        if isinstance(value, str) and not value.isascii():
+            obj[key] = SURROGATES.sub('\ufffd', value)
+    return obj
+
+def json_loads(line):
+    return replace_surrogates(json.loads(line))
+
+def orjson_loads(line):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        # orjson rejects unpaired surrogate escapes that json accepts, so both decode the same lines
+        return json_loads(line)
+
+def get_json_loads(use_orjson):
+    if use_orjson and orjson is not None:
+        return orjson_loads
+    return json_loads
+
+# Non-ASCII characters re.IGNORECASE treats as equal to an ASCII letter, such as the long s 'ſ' for 's'
+ASCII_CASE_VARIANTS = {'i': '\u0130\u0131', 'k': '\u212a', 's': '\u017f'}
+
+def raw_keyword_source_of(keyword):
+    """
+    Pattern for an ASCII keyword in a raw JSON line, to be compiled with re.IGNORECASE. Each character
+    also matches the case variants KeywordMatcher matches and any of them written as a \\u escape.
+    """
+    parts = []
+    for char in keyword:
+        variants = dict.fromkeys([char.lower(), char.upper(), *ASCII_CASE_VARIANTS.get(char.lower(), '')])
+        forms = [form for variant in variants for form in (variant, f"\\u{ord(variant):04x}")]
+        parts.append('(?:' + '|'.join(re.escape(form) for form in forms) + ')')
+    return ''.join(parts)
+
+def year_ranges(years):
+    ranges = []
+    for year in sorted(set(years)):
+        start = calendar.timegm((year, 1, 1, 0, 0, 0))
+        end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+class TopicRouter:
+    """
+    Decides which (year, topic) outputs a raw comment line belongs to.
+    With prefilter on, lines are first checked on their raw text for a created_utc inside the
+    requested years and for any keyword, only the candidates go through full JSON decoding.
+    """
+
+    def __init__(self, topics, years, field, exact_match, prefilter=True, use_orjson=True):
+        self.field = field
+        self.years = set(years)
+        self.loads = get_json_loads(use_orjson)
+        self.prefilter = prefilter
+        self.year_ranges = year_ranges(years)
+        # One matcher over the keywords of every topic, each hit is mapped back to the topics that list it
+        self.matcher = KeywordMatcher([val for _, values in topics.values() for val in values], exact_match=exact_match)
+        self.keyword_topics = {}
+        for topic, (_, values) in topics.items():
+            for val in values:
+                self.keyword_topics.setdefault(val.lower(), []).append(topic)
+        self.unfiltered_topics = [topic for topic, (_, values) in topics.items() if not values]
+        # The raw scan is only a superset of the real match when every keyword survives JSON encoding unchanged
+        raw_keywords = sorted(set(val for _, values in topics.values() for val in values), key=len, reverse=True)
+        raw_keyword_source = raw_variant_source = None
+        if raw_keywords and not self.unfiltered_topics and all(re.fullmatch(r"[\w ]+", val, re.ASCII) for val in raw_keywords):
+            raw_keyword_source = '|'.join(re.escape(val) for val in raw_keywords)
+            raw_variant_source = '|'.join(raw_keyword_source_of(val) for val in raw_keywords)
+        created_source = r'"created_utc"\s*:\s*"?(\d+)'
+        # Lines that passed the prefilter and lines that were JSON decoded, collected with take_counts
+        self.counts = {'lines_candidate': 0, 'lines_parsed': 0}
+        self.raw_patterns = {}
+        for kind, encode in ((str, str), (bytes, lambda source: source.encode('utf-8'))):
+            self.raw_patterns[kind] = (
+                re.compile(encode(created_source)),
+                re.compile(encode(raw_keyword_source), re.IGNORECASE) if raw_keyword_source else None,
+                re.compile(encode(raw_variant_source), re.IGNORECASE) if raw_variant_source else None,
+                encode('\\u'),
+            )
+
+    def is_candidate(self, line):
+        created_pattern, keyword_pattern, variant_pattern, escape = self.raw_patterns[type(line)]
+        match = created_pattern.search(line)
+        if match is not None:
+            created_utc = int(match.group(1))
+            if not any(start <= created_utc < end for start, end in self.year_ranges):
+                return False
+        if keyword_pattern is None or keyword_pattern.search(line) is not None:
+            return True
+        # A keyword written with a Unicode case variant or a \u escape is only possible in lines that have them,
+        # only those go through the slower pattern
+        return (not line.isascii() or escape in line) and variant_pattern.search(line) is not None
+
+    def take_counts(self):
+        counts = self.counts
+        self.counts = dict.fromkeys(counts, 0)
+        return counts
+
+    def match(self, line):
+        """
+        The decoded comment, its creation time, the keywords found in it and the topics it belongs to,
+        or None when it belongs to no topic.
+        """
+        if self.prefilter and not self.is_candidate(line):
+            return None
+        self.counts['lines_candidate'] += 1
+        obj = self.loads(line)
+        self.counts['lines_parsed'] += 1
+        created = datetime.utcfromtimestamp(int(obj['created_utc']))
+        if created.year not in self.years:
+            return None
+        keywords = self.matcher.find_all(obj[self.field]) if self.matcher and self.field in obj else set()
+        matched_topics = set(self.unfiltered_topics)
+        for keyword in keywords:
+            matched_topics.update(self.keyword_topics[keyword])
+        if not matched_topics:
+            return None
+        return obj, created, keywords, matched_topics
+
+    def route(self, line):
+        matched = self.match(line)
+        if matched is None:
+            return None
+        obj, created, _, matched_topics = matched
+        return created.year, sorted(matched_topics), raw_row(obj, created)
+
+def writer_key(year, topic):
+    return f"{year}/{topic}"
+
+def open_topic_writers(topics, years, output_format, state=None):
+    writers = {}
+    positions = state['positions'] if state else {}
+    for topic, (topic_output_path, _) in topics.items():
+        for year in years:
+            partition_path = os.path.join(topic_output_path, str(year), str(year))
+            resume = positions.get(writer_key(year, topic))
+            # A run stopped while closing its outputs may have closed some of them already
+            if state and state.get('closing') and RawWriter.is_closed(partition_path, output_format, resume):
+                continue
+            writers[(year, topic)] = RawWriter(partition_path, output_format, resume=resume)
+    return writers
+
+def write_routed(writers, matched_lines, routed):
+    year, matched_topics, row = routed
+    for topic in matched_topics:
+        writers[(year, topic)].writerow(row)
+        matched_lines[(year, topic)] += 1
+
+def write_block(writers, matched_lines, block_lines, block_size, errors, results, counts):
+    instrumentation = get_instrumentation()
+    with instrumentation.stage('write'):
+        for error in errors:
+            log.error(f"Failed to process line: {error}")
+        for routed in results:
+            write_routed(writers, matched_lines, routed)
+    if 'seconds' in counts:
+        instrumentation.add_time('route', counts.pop('seconds'))
+    instrumentation.count('lines_read', block_lines)
+    instrumentation.count('bytes_decompressed', block_size)
+    instrumentation.count('lines_matched', len(results))
+    instrumentation.count('rows_written', sum(len(matched_topics) for _, matched_topics, _ in results))
+    instrumentation.count('errors', len(errors))
+    for name, amount in counts.items():
+        instrumentation.count(name, amount)
+
+def save_checkpoint(checkpoint, writers, matched_lines, decompressed_offset, compressed_offset, line_count, complete=False, closing=False):
+    with get_instrumentation().stage('checkpoint'):
+        _save_checkpoint(checkpoint, writers, matched_lines, decompressed_offset, compressed_offset, line_count, complete, closing)
+
+def _save_checkpoint(checkpoint, writers, matched_lines, decompressed_offset, compressed_offset, line_count, complete, closing):
+    positions = {} if complete else {writer_key(*key): writer.position() for key, writer in writers.items()}
+    counts = {writer_key(*key): count for key, count in matched_lines.items()}
+    checkpoint.save(decompressed_offset, compressed_offset, line_count, counts, positions, complete, closing)
+
+def close_topic_writers(writers, matched_lines, line_count):
+    with get_instrumentation().stage('close'):
+        for writer in writers.values():
+            writer.close()
+    for (year, topic), count in matched_lines.items():
+        log.info(f"Matched lines for {topic} in {year}: {count}.")
+    log.info(f"Completed single pass processing. Total lines processed: {line_count}. Total matched lines: {sum(matched_lines.values())}.")
+
+def start_extraction(input_file, topics, years, field, exact_match, output_format, checkpoint_path):
+    """
+    Loads the checkpoint for this input and these settings when checkpoint_path is set and opens the
+    writers at their saved positions. Returns the checkpoint, the saved state (None for a fresh run),
+    the writers and the matched line counts.
+    """
+    checkpoint = None
+    state = None
+    if checkpoint_path is not None:
+        checkpoint = ExtractionCheckpoint(checkpoint_path, input_file, [topics, sorted(years), field, exact_match, output_format, RAW_COLUMNS])
+        state = checkpoint.load()
+    if state is not None and state['complete']:
+        log.info(f"{input_file} was already fully processed according to {checkpoint_path}, remove it to extract again.")
+        return checkpoint, state, None, None
+    if state is not None:
+        log.info(f"Resuming from {checkpoint_path} at line {state['line_count']} (decompressed offset {state['decompressed_offset']:,}).")
+    writers = open_topic_writers(topics, years, output_format, state)
+    matched_lines = {(year, topic): 0 for topic in topics for year in years}
+    if state is not None:
+        for key in matched_lines:
+            matched_lines[key] = state['matched_lines'].get(writer_key(*key), 0)
+    if state is not None and state.get('closing'):
+        log.info("The whole input was already read, closing the remaining outputs.")
+        finish_extraction(checkpoint, writers, matched_lines, state['decompressed_offset'], state['line_count'])
+        return checkpoint, state, None, None
+    return checkpoint, state, writers, matched_lines
+
+def finish_extraction(checkpoint, writers, matched_lines, offset, line_count):
+    """
+    Closes the outputs once the whole input is read. The checkpoint is marked closing first, so a run
+    stopped while the outputs are moved to their final names resumes by closing the rest, not by reading again.
+    """
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, writers, matched_lines, offset, None, line_count, closing=True)
+    close_topic_writers(writers, matched_lines, line_count)
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, writers, matched_lines, offset, None, line_count, complete=True)
+
+def process_file_multi(input_file, topics, years, field, exact_match, prefilter=True, use_orjson=True, output_format='csv',
+                       checkpoint_path=None, checkpoint_lines=1000000, block_size=2**24):
+    """
+    Extracts every topic and year in one sequential pass. With checkpoint_path set, progress is saved
+    about every checkpoint_lines lines and a later call with the same arguments resumes from it.
+    """
+    log.info(f"Starting single pass processing for years {years[0]}-{years[-1]} and topics {', '.join(topics)}.")
+    checkpoint, state, writers, matched_lines = start_extraction(input_file, topics, years, field, exact_match, output_format, checkpoint_path)
+    if writers is None:
+        return
+    offset = state['decompressed_offset'] if state else 0
+    line_count = state['line_count'] if state else 0
+    checkpoint_count = line_count
+    router = TopicRouter(topics, years, field, exact_match, prefilter, use_orjson)
+    try:
+        for block, compressed_offset in read_blocks_zst(input_file, block_size, offset):
+            with get_instrumentation().stage('route'):
+                block_lines, errors, results, counts = route_block(router, block)
+            write_block(writers, matched_lines, block_lines, len(block), errors, results, counts)
+            offset += len(block)
+            previous_count = line_count
+            line_count += block_lines
+            if line_count // 100000 != previous_count // 100000:
+                log_progress(line_count)
+            if checkpoint is not None and line_count - checkpoint_count >= checkpoint_lines:
+                save_checkpoint(checkpoint, writers, matched_lines, offset, compressed_offset, line_count)
+                checkpoint_count = line_count
+    except KeyboardInterrupt:
+        if checkpoint is not None:
+            log.info(f"Stopped, the next run resumes from line {checkpoint_count}.")
+        raise
+    finish_extraction(checkpoint, writers, matched_lines, offset, line_count)
+
+def read_blocks_zst(file_name, block_size, start_offset=0, max_line_size=2**30):
+    """
+    Yields the decompressed file as (block, compressed offset) pairs, each block ending on a line break,
+    starting start_offset bytes into the decompressed data. The blocks are contiguous, so the sum of their
+    lengths is the offset to resume from. Like read_lines_zst the file is decompressed into one reusable
+    buffer, the unfinished last line is moved to its front and the buffer only grows for a line longer than it.
+    """
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    filled = 0
+    with open(file_name, 'rb') as file_handle:
+        reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+        # zstd frames cannot be entered in the middle, so a resumed run decompresses and drops the processed part
+        skipped = 0
+        while skipped < start_offset:
+            with get_instrumentation().stage('skip'):
+                read = reader.readinto(view[:min(block_size, start_offset - skipped)])
+            if not read:
+                raise ValueError(f"{file_name} is shorter than the resume offset {start_offset:,}")
+            skipped += read
+        while True:
+            with get_instrumentation().stage('decompress'):
+                read = reader.readinto(view[filled:])
+            if not read:
+                break
+            filled += read
+            end = buffer.rfind(b"\n", 0, filled)
+            if end != -1:
+                yield bytes(view[:end + 1]), file_handle.tell()
+                view[:filled - end - 1] = view[end + 1:filled]
+                filled -= end + 1
+            elif filled == len(buffer):
+                if len(buffer) >= max_line_size:
+                    raise ValueError(f"Line longer than {max_line_size:,} bytes in {file_name}")
+                view.release()
+                buffer.extend(bytes(len(buffer)))
+                view = memoryview(buffer)
+        tail = bytes(view[:filled])
+        if tail.strip():
+            yield tail, file_handle.tell()
+        reader.close()
+
+def iter_lines(block):
+    """
+    Yields the non-empty lines of a block, stripped, one at a time instead of splitting the whole block into a list.
+    """
+    start = 0
+    end = block.find(b"\n")
+    while end != -1:
+        line = block[start:end].strip()
+        if line:
+            yield line
+        start = end + 1
+        end = block.find(b"\n", start)
+    line = block[start:].strip()
+    if line:
+        yield line
+
+def log_progress(line_count):
+    instrumentation = get_instrumentation()
+    log.info(f"Processed {line_count} lines so far ({instrumentation.rate('lines_read'):,.0f} lines/s, "
+             f"{instrumentation.rate('bytes_decompressed') / 2**20:,.1f} MB/s)...")
+
+def route_block(router, block):
+    """
+    Routes every line of a block. Returns the line count, the error messages, the routed lines and the
+    router counters for the block.
+    """
+    line_count = 0
+    errors = []
+    results = []
+    for line in iter_lines(block):
+        line_count += 1
+        try:
+            routed = router.route(line)
+            if routed is not None:
+                results.append(routed)
+        except Exception as e:
+            errors.append(str(e))
+    return line_count, errors, results, router.take_counts()
+
+_worker_router = None
+
+def _init_worker(topics, years, field, exact_match, prefilter, use_orjson):
+    global _worker_router
+    _worker_router = TopicRouter(topics, years, field, exact_match, prefilter, use_orjson)
+
+def _process_block(block):
+    start = time.perf_counter()
+    line_count, errors, results, counts = route_block(_worker_router, block)
+    # Worker time is reported back so the parent can add it to the route stage
+    counts['seconds'] = time.perf_counter() - start
+    return line_count, errors, results, counts
+
+def process_file_parallel(input_file, topics, years, field, exact_match, workers, block_size=2**24, prefilter=True, use_orjson=True, output_format='csv',
+                          checkpoint_path=None, checkpoint_lines=1000000):
+    log.info(f"Starting parallel processing with {workers} workers for years {years[0]}-{years[-1]} and topics {', '.join(topics)}.")
+    checkpoint, state, writers, matched_lines = start_extraction(input_file, topics, years, field, exact_match, output_format, checkpoint_path)
+    if writers is None:
+        return
+    offset = state['decompressed_offset'] if state else 0
+    line_count = state['line_count'] if state else 0
+    checkpoint_count = line_count
+    # Blocks are collected in submission order so the output matches the sequential run,
+    # and at most a few blocks per worker are in flight to keep memory bounded
+    pending = deque()
+    try:
+        with worker_context().Pool(workers, initializer=_init_worker, initargs=(topics, years, field, exact_match, prefilter, use_orjson)) as pool:
+            blocks = read_blocks_zst(input_file, block_size, offset)
+            while True:
+                for block, compressed_offset in blocks:
+                    pending.append((pool.apply_async(_process_block, (block,)), len(block), compressed_offset))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                result, block_length, compressed_offset = pending.popleft()
+                with get_instrumentation().stage('wait'):
+                    block_lines, errors, results, counts = result.get()
+                write_block(writers, matched_lines, block_lines, block_length, errors, results, counts)
+                offset += block_length
+                previous_count = line_count
+                line_count += block_lines
+                if line_count // 100000 != previous_count // 100000:
+                    log_progress(line_count)
+                if checkpoint is not None and line_count - checkpoint_count >= checkpoint_lines:
+                    save_checkpoint(checkpoint, writers, matched_lines, offset, compressed_offset, line_count)
+                    checkpoint_count = line_count
+    except KeyboardInterrupt:
+        if checkpoint is not None:
+            log.info(f"Stopped, the next run resumes from line {checkpoint_count}.")
+        raise
+    finish_extraction(checkpoint, writers, matched_lines, offset, line_count)
+
 if __name__ == "__main__":
     field = "body"
     
     exact_match = False
+    single_pass = True
+    # Worker processes for single pass extraction, 1 keeps everything in this process
+    workers = os.cpu_count() or 1
+    # Skip full JSON decoding of lines whose raw text cannot match, and use orjson when it is installed
+    prefilter = True
+    use_orjson = True
+    # Progress is saved here about every checkpoint_lines lines, rerunning after a crash or Ctrl+C resumes
+    # from it. Set to None to always start from the beginning.
+    checkpoint_path = os.path.join("logs", "extraction_checkpoint.json")
+    checkpoint_lines = 1000000
+    # Stage to run under cProfile, e.g. "route" (sequential runs only, workers are not profiled), "write" or "decompress"
+    profile_stage = None
 
-    for year in years_to_process:
-        year_output_path = os.path.join(base_output_path, str(year))
-        os.makedirs(year_output_path, exist_ok=True) 
-        process_file(input_file, year_output_path, year, field, keywords, exact_match)
\ No newline at end of file
+    setup_logging()
+    instrumentation = start_run("extract", profile_stage)
+    if single_pass and workers > 1:
+        process_file_parallel(input_file, topics, years_to_process, field, exact_match, workers, prefilter=prefilter, use_orjson=use_orjson, output_format=output_format,
+                              checkpoint_path=checkpoint_path, checkpoint_lines=checkpoint_lines)
+    elif single_pass:
+        process_file_multi(input_file, topics, years_to_process, field, exact_match, prefilter, use_orjson, output_format, checkpoint_path, checkpoint_lines)
+    else:
+        for year in years_to_process:
+            year_output_path = os.path.join(base_output_path, str(year))
+            os.makedirs(year_output_path, exist_ok=True) 
+            process_file(input_file, year_output_path, year, field, keywords, exact_match)
+    log.info(instrumentation.summary())
+    log.info(f"Run report saved: {instrumentation.write_report('logs')}")
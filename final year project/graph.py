@@ -1,27 +1,15 @@
-import matplotlib
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import os
-from pathlib import Path
-from pandas import to_datetime
-from matplotlib.dates import MonthLocator, DateFormatter, date2num
-import matplotlib.dates as mdates
-matplotlib.use('Agg')
-
-
-# Configuration
-input_folder = r"worldnews\worldnews_processed_economics"
-output_folder = os.path.join("graphs", f"{input_folder}_graphs")
-
-Path(output_folder).mkdir(parents=True, exist_ok=True)
-combined_output_folder = os.path.join(output_folder, "combined")
-emotion_pie_folder = os.path.join(output_folder, "emotion_pie")
-sentiment_output_folder = os.path.join(output_folder, "sentiment")
-Path(sentiment_output_folder).mkdir(parents=True, exist_ok=True)
-Path(emotion_pie_folder).mkdir(parents=True, exist_ok=True)
-Path(combined_output_folder).mkdir(parents=True, exist_ok=True)
-print(f"Directory '{combined_output_folder}' exists after creation: {Path(combined_output_folder).exists()}")
+import json
+import hashlib
+import inspect
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from storage import list_partitions, find_partition
+from schema import read_comments, require_monthly_std
+from instrumentation import get_instrumentation, start_run
+from warmup import worker_context
+from aggregates import aggregate_partition, has_aggregates, read_aggregates, emotion_totals, monthly_measure
+
 
 emotion_colors = {
     'trust': '#1f77b4',
@@ -32,74 +20,122 @@ emotion_colors = {
     'joy': '#8c564b',
     'surprise': '#e377c2',
     'disgust': '#7f7f7f',
-    'other': '#bcbd22',  
-    'No emotion': '#c7c7c7'    
+    'other': '#bcbd22',
+    'No emotion': '#c7c7c7'
 }
 
-all_years_data = pd.DataFrame()
-all_years_weighted_data = pd.DataFrame()
-all_years_non_weighted_data = pd.DataFrame()
+STD_COLUMNS = {True: 'weighted_monthly_std', False: 'unweighted_monthly_std'}
+
+
+def summarize_aggregates(year, aggregates):
+    """
+    The summarize_year result built from a year's monthly aggregate table instead of its comments.
+    """
+    month = aggregates['year'].map('{:04d}'.format).astype(str) + '-' + aggregates['month'].map('{:02d}'.format).astype(str)
+    monthly = pd.DataFrame({
+        'month': month,
+        'weighted_monthly_std': monthly_measure(aggregates, 'Weighted_Monthly_Std'),
+        'unweighted_monthly_std': monthly_measure(aggregates, 'Unweighted_Monthly_Std'),
+        'sentiment_score': monthly_measure(aggregates, 'Sentiment_Score'),
+    }).sort_values('month', ignore_index=True)
+    emotions = emotion_totals(aggregates)
+    return {
+        'year': year,
+        'comments': int(aggregates['count'].sum()),
+        'sentiment_year': str(aggregates['year'].min()) if len(aggregates) else str(year),
+        'monthly': monthly,
+        'emotions': emotions / emotions.sum() * 100,
+    }
+
+
+def year_source(partition):
+    """
+    The file a year's figures are drawn from, its monthly aggregate table when analyze.py wrote one.
+    """
+    processed_folder, year = os.path.split(partition)
+    if has_aggregates(processed_folder, year):
+        return find_partition(aggregate_partition(processed_folder, year))[0]
+    return find_partition(partition)[0]
+
+
+def has_comments(partition):
+    """
+    Whether any comment of a processed year passed the filters, years without one have nothing to draw.
+    """
+    processed_folder, year = os.path.split(partition)
+    if has_aggregates(processed_folder, year):
+        return len(read_aggregates(processed_folder, year)) > 0
+    return len(read_comments(partition, columns=['Created_UTC'])) > 0
+
+
+def summarize_year(year, partition):
+    """
+    Reads one processed year once and computes every aggregate the figures need from it.
+    """
+    processed_folder, _ = os.path.split(partition)
+    if has_aggregates(processed_folder, year):
+        return summarize_aggregates(year, read_aggregates(processed_folder, year))
+    require_monthly_std(partition)
+    df = read_comments(partition, columns=['Created_UTC', 'Sentiment_Score', 'Weighted_Monthly_Std', 'Unweighted_Monthly_Std', 'Primary_Emotion'])
+    df.columns = [x.lower() for x in df.columns]
+    created = df['created_utc']
+    month = created.dt.to_period('M').dt.strftime('%Y-%m')
+    monthly = df.groupby(month)[['weighted_monthly_std', 'unweighted_monthly_std', 'sentiment_score']].mean()
+    monthly.index.name = 'month'
+    return {
+        'year': year,
+        'comments': len(df),
+        'sentiment_year': str(created.dt.year.iloc[0]) if len(df) else str(year),
+        'monthly': monthly.reset_index(),
+        'emotions': df['primary_emotion'].value_counts(normalize=True) * 100,
+    }
+
+
+def new_figure(figsize):
+    # matplotlib is only imported in the processes that actually render
+    from matplotlib.figure import Figure
+    return Figure(figsize=figsize)
 
 
-def plot_standard_deviation_over_time(input_folder, output_folder, weighted=True):
-    global all_years_weighted_data
-    global all_years_non_weighted_data
-    
-    previous_year_avg_std = None
-    
-    print("Starting plot generation...")
-    for file in sorted(os.listdir(input_folder)):
-        if file.endswith(".xlsx"):
-            print(f"Processing file: {file}")
-            try:
-                df = pd.read_excel(os.path.join(input_folder, file))
-            except Exception as e:
-                print(f"Error reading file {file}: {e}. Skipping...")
-                continue
-            year = file.split(".")[0]
-            df.columns = [x.lower() for x in df.columns]
-            std_col = 'weighted_monthly_std' if weighted else 'unweighted_monthly_std'
-            if 'created_utc' in df.columns and std_col in df.columns:
-                df['created_utc'] = pd.to_datetime(df['created_utc'])
-                df['month'] = df['created_utc'].dt.to_period('M').dt.strftime('%Y-%m')
-                monthly_std = df.groupby('month')[std_col].mean().reset_index()
-                monthly_std['year'] = year
-                if weighted:
-                    all_years_weighted_data = pd.concat([all_years_weighted_data, monthly_std], ignore_index=True)
-                else:
-                    all_years_non_weighted_data = pd.concat([all_years_non_weighted_data, monthly_std], ignore_index=True)
-
-                plt.figure(figsize=(10, 6))
-                plt.plot(monthly_std['month'], monthly_std[std_col], marker='o', linestyle='-')
-                
-                plt.ylim(0, 1)
-                title = f'Weighted Standard Deviation Over Time in {year}' if weighted else f'Non-Weighted Standard Deviation Over Time in {year}'
-                plt.title(title)
-                plt.xlabel('Month')
-                plt.xticks(rotation=90)
-                plt.ylabel(std_col.replace('_', ' ').title())
-                plt.tight_layout()
-                plot_filename = os.path.join(output_folder, f"{year}_{std_col}.png")
-                plt.savefig(plot_filename)
-                plt.close()
-                print(f"Graph saved: {plot_filename}")
-            else:
-                print(f"Required columns missing in {file}")
-    
-    combined_data = all_years_weighted_data if weighted else all_years_non_weighted_data
+def calculate_percentage_change(current_distribution, previous_distribution):
+    percentage_change = {}
+    emotions = set(current_distribution.index).union(previous_distribution.index)
+    for emotion in emotions:
+        current = current_distribution.get(emotion, 0)
+        previous = previous_distribution.get(emotion, 0)
+        change = current - previous
+        percentage_change[emotion] = change
+    return percentage_change
+
+
+def render_year_std(monthly_std, year, weighted, plot_filename):
+    std_col = STD_COLUMNS[weighted]
+    fig = new_figure((10, 6))
+    ax = fig.subplots()
+    ax.plot(monthly_std['month'], monthly_std[std_col], marker='o', linestyle='-')
+    ax.set_ylim(0, 1)
+    title = f'Weighted Standard Deviation Over Time in {year}' if weighted else f'Non-Weighted Standard Deviation Over Time in {year}'
+    ax.set_title(title)
+    ax.set_xlabel('Month')
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_ylabel(std_col.replace('_', ' ').title())
+    fig.tight_layout()
+    fig.savefig(plot_filename)
+    return plot_filename
+
+
+def render_combined_std(combined_data, weighted, combined_plot_filename):
+    std_col = STD_COLUMNS[weighted]
+    fig = new_figure((12, 7))
+    ax = fig.subplots()
     if not combined_data.empty:
         yearly_averages = combined_data.groupby('year')[std_col].mean()
         yearly_changes = yearly_averages.pct_change() * 100
-
-        plt.figure(figsize=(12, 7))
-        ax = plt.gca()
         legend_labels_with_colors = {}
 
         for year in combined_data['year'].unique():
             yearly_data = combined_data[combined_data['year'] == year]
-            plt.plot(yearly_data['month'],
-                    yearly_data[std_col],
-                    marker='o', linestyle='-', label=f"{year}")
+            ax.plot(yearly_data['month'], yearly_data[std_col], marker='o', linestyle='-', label=f"{year}")
 
             avg_std = yearly_averages[year]
             if year != combined_data['year'].min():
@@ -112,37 +148,23 @@ def plot_standard_deviation_over_time(input_folder, output_folder, weighted=True
         handles, labels = ax.get_legend_handles_labels()
         new_labels = [legend_labels_with_colors[label][0] for label in labels]
         new_label_colors = [legend_labels_with_colors[label][1] for label in labels]
-        new_legend = plt.legend(handles, new_labels, title='Yearly Average Standard Deviation (Change)')
+        new_legend = ax.legend(handles, new_labels, title='Yearly Average Standard Deviation (Change)')
 
         for text, color in zip(new_legend.get_texts(), new_label_colors):
             text.set_color(color)
-            
-    plt.ylim(0, 1) 
-    title = 'Combined Weighted Monthly Standard Deviation Over All Years' if weighted else 'Combined Non-Weighted Monthly Standard Deviation Over All Years'
-    plt.title(title)
-    plt.xlabel('Month')
-    plt.xticks(rotation=90)
-    plt.ylabel(std_col.replace('_', ' ').title())
-    plt.tight_layout()
-    combined_plot_filename = os.path.join(combined_output_folder, f"combined_{std_col}.png")
-    plt.savefig(combined_plot_filename)
-    plt.close()
-    print(f"Combined graph saved: {combined_plot_filename}")
 
-def calculate_percentage_change(current_distribution, previous_distribution):
-    percentage_change = {}
-    emotions = set(current_distribution.index).union(previous_distribution.index)
-    for emotion in emotions:
-        current = current_distribution.get(emotion, 0)
-        previous = previous_distribution.get(emotion, 0)
-        change = current - previous
-        percentage_change[emotion] = change
-    return percentage_change
+    ax.set_ylim(0, 1)
+    title = 'Combined Weighted Monthly Standard Deviation Over All Years' if weighted else 'Combined Non-Weighted Monthly Standard Deviation Over All Years'
+    ax.set_title(title)
+    ax.set_xlabel('Month')
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_ylabel(std_col.replace('_', ' ').title())
+    fig.tight_layout()
+    fig.savefig(combined_plot_filename)
+    return combined_plot_filename
 
-def plot_pie_chart(data, emotion_pie_folder, year, percentage_change=None):
-    print(data['Primary_Emotion'].value_counts()) 
 
-    emotion_counts = data['Primary_Emotion'].value_counts(normalize=True) * 100
+def render_pie_chart(emotion_counts, pie_chart_filename, percentage_change=None):
     labels = []
     label_colors = []
     for emotion, count in emotion_counts.items():
@@ -157,99 +179,184 @@ def plot_pie_chart(data, emotion_pie_folder, year, percentage_change=None):
 
     colors = [emotion_colors.get(emotion, emotion_colors['other']) for emotion in emotion_counts.index]
 
-    plt.figure(figsize=(10, 8))
-    wedges, texts = plt.pie(emotion_counts, labels=None, colors=colors, startangle=140, counterclock=False)
-    plt.axis('equal') 
+    fig = new_figure((10, 8))
+    ax = fig.subplots()
+    wedges, texts = ax.pie(emotion_counts, labels=None, colors=colors, startangle=140, counterclock=False)
+    ax.axis('equal')
+
+    legend = ax.legend(wedges, labels, title="Emotions", loc="best")
 
-    legend = plt.legend(wedges, labels, title="Emotions", loc="best")
-    
     for i, text in enumerate(legend.get_texts()):
         text.set_color(label_colors[i])
 
-    pie_chart_filename = os.path.join(emotion_pie_folder, f"{year}_emotion_pie.png")
-    plt.savefig(pie_chart_filename, bbox_inches='tight')
-    plt.close()
-
-def plot_emotion_pie_charts(input_folder, emotion_pie_folder):
-    previous_distribution = None
-    files = sorted([f for f in os.listdir(input_folder) if f.endswith('.xlsx')])
-
-    for file in files:
-        year = file.split('.')[0]
-        df = pd.read_excel(os.path.join(input_folder, file))
-        
-        current_distribution = df['Primary_Emotion'].value_counts(normalize=True) * 100
-
-        if previous_distribution is not None:
-            percentage_change = calculate_percentage_change(current_distribution, previous_distribution)
-            plot_pie_chart(df, emotion_pie_folder, year, percentage_change)
-        else:
-            plot_pie_chart(df, emotion_pie_folder, year)
-
-        previous_distribution = current_distribution
-
+    fig.savefig(pie_chart_filename, bbox_inches='tight')
+    return pie_chart_filename
 
-def plot_average_sentiment_over_time(input_folder, sentiment_output_folder):
-    yearly_avg_sentiment_data = {}
-    all_monthly_data = pd.DataFrame() 
-    print("Starting average sentiment score plot generation...")
-    for file in sorted(os.listdir(input_folder)):
-        if file.endswith(".xlsx"):
-            df = pd.read_excel(os.path.join(input_folder, file))
-            df.columns = [x.lower() for x in df.columns]
-            
-            if 'created_utc' not in df.columns or 'sentiment_score' not in df.columns:
-                print(f"Required columns are missing in the file: {file}")
-                continue
-            
-            df['month'] = pd.to_datetime(df['created_utc']).dt.to_period('M').dt.strftime('%Y-%m')
-            df['year'] = pd.to_datetime(df['created_utc']).dt.year
-
-            monthly_avg_sentiment = df.groupby('month')['sentiment_score'].mean().reset_index()
-            yearly_avg_sentiment = monthly_avg_sentiment['sentiment_score'].mean()
-            year = str(df['year'].iloc[0])
-            yearly_avg_sentiment_data[year] = yearly_avg_sentiment
-
-            all_monthly_data = pd.concat([all_monthly_data, monthly_avg_sentiment.assign(year=year)])
 
+def render_average_sentiment(all_monthly_data, yearly_avg_sentiment_data, combined_plot_filename):
+    import matplotlib.dates as mdates
     years = sorted(yearly_avg_sentiment_data.keys())
-    yearly_changes = {}
-    previous_year_sentiment = None
-    for year in years:
-        if previous_year_sentiment is not None:
-            yearly_changes[year] = (yearly_avg_sentiment_data[year] - previous_year_sentiment) / previous_year_sentiment
-        previous_year_sentiment = yearly_avg_sentiment_data[year]
+    min_date = pd.to_datetime(all_monthly_data['month']).min()
 
-    min_date = to_datetime(all_monthly_data['month']).min()
-
-    plt.figure(figsize=(12, 7))
+    fig = new_figure((12, 7))
+    ax = fig.subplots()
     for year in years:
         monthly_data = all_monthly_data[all_monthly_data['year'] == year]
         if not monthly_data.empty:
             dates = pd.to_datetime(monthly_data['month'])
-            plt.plot(dates, monthly_data['sentiment_score'],
+            ax.plot(dates, monthly_data['sentiment_score'],
                     marker='o', linestyle='-', label=f"{year} - Avg: {yearly_avg_sentiment_data[year]:.3f}")
 
-    plt.legend(title='Yearly Average Sentiment (Change)', loc='upper right')
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator(interval=1)) 
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-    plt.gca().set_xlim([min_date, None]) 
-    plt.xticks(rotation=90) 
-
-    plt.title('Average Monthly Sentiment Over Time')
-    plt.xlabel('Month')
-    plt.ylabel('Average Sentiment Score')
-    plt.ylim([-0.5, 0.5]) 
-    plt.tick_params(axis='x', labelsize='small')
-    plt.tight_layout()
-    combined_plot_filename = os.path.join(sentiment_output_folder, "combined_average_sentiment.png")
-    plt.savefig(combined_plot_filename)
-    plt.close()
-    print(f"Combined average sentiment score plot saved: {combined_plot_filename}")
-          
-plot_standard_deviation_over_time(input_folder, output_folder, weighted=True)
-plot_standard_deviation_over_time(input_folder, output_folder, weighted=False)
-
-plot_emotion_pie_charts(input_folder, emotion_pie_folder)
-
-plot_average_sentiment_over_time(input_folder, sentiment_output_folder)
\ No newline at end of file
+    ax.legend(title='Yearly Average Sentiment (Change)', loc='upper right')
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=1))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    ax.set_xlim([min_date, None])
+    ax.tick_params(axis='x', labelrotation=90)
+
+    ax.set_title('Average Monthly Sentiment Over Time')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Average Sentiment Score')
+    ax.set_ylim([-0.5, 0.5])
+    ax.tick_params(axis='x', labelsize='small')
+    fig.tight_layout()
+    fig.savefig(combined_plot_filename)
+    return combined_plot_filename
+
+
+def figure_jobs(summaries, output_folder):
+    """
+    Turns the per-year summaries into (render function, arguments) pairs, one per figure.
+    """
+    combined_output_folder = os.path.join(output_folder, "combined")
+    emotion_pie_folder = os.path.join(output_folder, "emotion_pie")
+    sentiment_output_folder = os.path.join(output_folder, "sentiment")
+    years = sorted(summaries)
+    jobs = {}
+
+    for weighted in (True, False):
+        std_col = STD_COLUMNS[weighted]
+        combined = []
+        for year in years:
+            monthly_std = summaries[year]['monthly'][['month', std_col]].assign(year=year)
+            combined.append(monthly_std)
+            path = os.path.join(output_folder, f"{year}_{std_col}.png")
+            jobs[path] = (render_year_std, (monthly_std, year, weighted, path))
+        combined_data = pd.concat(combined, ignore_index=True) if combined else pd.DataFrame(columns=['month', std_col, 'year'])
+        path = os.path.join(combined_output_folder, f"combined_{std_col}.png")
+        jobs[path] = (render_combined_std, (combined_data, weighted, path))
+
+    previous_distribution = None
+    for year in years:
+        current_distribution = summaries[year]['emotions']
+        percentage_change = None
+        if previous_distribution is not None:
+            percentage_change = calculate_percentage_change(current_distribution, previous_distribution)
+        path = os.path.join(emotion_pie_folder, f"{year}_emotion_pie.png")
+        jobs[path] = (render_pie_chart, (current_distribution, path, percentage_change))
+        previous_distribution = current_distribution
+
+    if years:
+        yearly_avg_sentiment_data = {}
+        monthly_sentiment = []
+        for year in years:
+            sentiment_year = summaries[year]['sentiment_year']
+            monthly = summaries[year]['monthly'][['month', 'sentiment_score']]
+            yearly_avg_sentiment_data[sentiment_year] = monthly['sentiment_score'].mean()
+            monthly_sentiment.append(monthly.assign(year=sentiment_year))
+        path = os.path.join(sentiment_output_folder, "combined_average_sentiment.png")
+        jobs[path] = (render_average_sentiment, (pd.concat(monthly_sentiment), yearly_avg_sentiment_data, path))
+    return jobs
+
+
+def figure_inputs(partitions, output_folder):
+    """
+    Maps every figure to the years it is drawn from, so a figure is only redrawn when one of them changes.
+    """
+    years = [year for year, _ in partitions]
+    inputs = {}
+    for weighted in (True, False):
+        std_col = STD_COLUMNS[weighted]
+        for year in years:
+            inputs[os.path.join(output_folder, f"{year}_{std_col}.png")] = [year]
+        inputs[os.path.join(output_folder, "combined", f"combined_{std_col}.png")] = years
+    for index, year in enumerate(years):
+        inputs[os.path.join(output_folder, "emotion_pie", f"{year}_emotion_pie.png")] = years[max(0, index - 1):index + 1]
+    if years:
+        inputs[os.path.join(output_folder, "sentiment", "combined_average_sentiment.png")] = years
+    return inputs
+
+
+def _render(job):
+    render, args = job
+    return render(*args)
+
+
+def generate_graphs(input_folder, output_folder, workers=None, force=False):
+    """
+    Loads each processed year once, builds every figure from the per-year summaries and renders the
+    figures in worker processes. Figures whose input files and drawing code are unchanged since the last
+    run are skipped, tracked in a manifest in output_folder.
+    """
+    for folder in (output_folder, os.path.join(output_folder, "combined"), os.path.join(output_folder, "emotion_pie"), os.path.join(output_folder, "sentiment")):
+        os.makedirs(folder, exist_ok=True)
+    # The figures and the years they are drawn from both come from this list, so years without comments are
+    # neither drawn nor expected in the manifest
+    partitions = [(year, partition) for year, partition in list_partitions(input_folder) if has_comments(partition)]
+    signatures = {}
+    for year, partition in partitions:
+        path = year_source(partition)
+        stat = os.stat(path)
+        signatures[year] = [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+    code_version = hashlib.sha256(inspect.getsource(inspect.getmodule(generate_graphs)).encode()).hexdigest()
+
+    manifest_path = os.path.join(output_folder, ".figures.json")
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r') as handle:
+            manifest = json.load(handle)
+    inputs = figure_inputs(partitions, output_folder)
+    figure_keys = {
+        path: hashlib.sha256(json.dumps([code_version, [signatures[year] for year in years]]).encode()).hexdigest()
+        for path, years in inputs.items()
+    }
+    stale = [path for path, key in figure_keys.items() if manifest.get(path) != key or not os.path.exists(path)]
+    instrumentation = get_instrumentation()
+    instrumentation.count('figures_skipped', len(figure_keys) - len(stale))
+    if not stale:
+        print("All graphs are up to date")
+        return
+    needed_years = {year for path in stale for year in inputs[path]}
+
+    print("Starting plot generation...")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+        summaries = {}
+        needed = [(year, partition) for year, partition in partitions if year in needed_years]
+        with instrumentation.stage('summarize'):
+            for summary in executor.map(summarize_year, *zip(*needed)):
+                summaries[summary['year']] = summary
+                instrumentation.count('years_summarized')
+                instrumentation.count('comments_summarized', summary['comments'])
+        jobs = figure_jobs(summaries, output_folder)
+        with instrumentation.stage('render'):
+            for plot_filename in executor.map(_render, [jobs[path] for path in stale if path in jobs]):
+                print(f"Graph saved: {plot_filename}")
+                instrumentation.count('figures_rendered')
+    manifest.update({path: figure_keys[path] for path in stale if path in jobs})
+    with open(manifest_path, 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+
+
+if __name__ == "__main__":
+    # Configuration
+    input_folder = r"worldnews\worldnews_processed_economics"
+    output_folder = os.path.join("graphs", f"{input_folder}_graphs")
+    # Processes used to load years and render figures, None uses every core
+    workers = None
+    # Stage to run under cProfile, "summarize" or "render" (only the parent process is profiled)
+    profile_stage = None
+    report_folder = "logs"
+
+    instrumentation = start_run("graph", profile_stage)
+    generate_graphs(input_folder, output_folder, workers)
+    print(instrumentation.summary())
+    print(f"Run report saved: {instrumentation.write_report(report_folder)}")
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# Column name suffix used for each grouping granularity in the processed output
+GRANULARITY_NAMES = {
+    'month': 'Monthly',
+    'week': 'Weekly',
+    'day': 'Daily',
+    'author': 'Author',
+}
+
+
+def add_group_keys(df, granularity='month', date_column='created_utc'):
+    """
+    Adds the grouping columns for a granularity to df and returns their names.
+    """
+    if granularity == 'author':
+        return ['author']
+    dates = df[date_column]
+    df['year'] = dates.dt.year
+    if granularity == 'month':
+        df['month'] = dates.dt.month
+        return ['year', 'month']
+    if granularity == 'week':
+        iso = dates.dt.isocalendar()
+        df['year'] = iso['year'].astype(int)
+        df['week'] = iso['week'].astype(int)
+        return ['year', 'week']
+    if granularity == 'day':
+        df['day'] = dates.dt.normalize()
+        return ['day']
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def group_sums(values, weights, keys):
+    """
+    Sums of 1, x, x², w, w·x and w·x² per group in one grouped pass. x is shifted by the overall mean
+    first so the variance formulas below do not lose precision to cancellation.
+    """
+    shift = float(values.mean()) if len(values) else 0.0
+    x = values.astype(float) - shift
+    w = weights.astype(float)
+    parts = pd.DataFrame({'n': 1.0, 'x': x, 'xx': x * x, 'w': w, 'wx': w * x, 'wxx': w * x * x}, index=values.index)
+    grouped = parts.groupby(keys, sort=True, observed=True)
+    return grouped.sum(), grouped.ngroup(), shift
+
+
+def stats_from_sums(sums, shift):
+    n = sums['n']
+    unweighted_var = (sums['xx'] - sums['x'] ** 2 / n) / (n - 1)
+    unweighted_var = unweighted_var.where(n > 1).clip(lower=0)
+    weighted_mean = sums['wx'] / sums['w']
+    weighted_var = (sums['wxx'] / sums['w'] - weighted_mean ** 2).clip(lower=0)
+    return pd.DataFrame({
+        'count': n.astype(int),
+        'mean': sums['x'] / n + shift,
+        'unweighted_var': unweighted_var,
+        'unweighted_std': np.sqrt(unweighted_var),
+        'weight_sum': sums['w'],
+        'weighted_mean': weighted_mean + shift,
+        'weighted_var': weighted_var,
+        'weighted_std': np.sqrt(weighted_var),
+    })
+
+
+def group_stats(df, keys, value_column='sentiment_score', weight_column='score'):
+    """
+    Weighted and unweighted mean, variance and standard deviation of value_column per group.
+    The unweighted std matches pandas' std (ddof=1), the weighted one np.average of the squared deviations
+    with the score weights, as the per-group apply in analyze used to compute it.
+    """
+    sums, _, shift = group_sums(df[value_column], df[weight_column], [df[key] for key in keys])
+    return stats_from_sums(sums, shift)
+
+
+def attach_group_stats(df, keys, value_column='sentiment_score', weight_column='score', columns=('unweighted_std', 'weighted_std')):
+    """
+    Computes group_stats and broadcasts the requested columns back onto every row of df.
+    """
+    sums, codes, shift = group_sums(df[value_column], df[weight_column], [df[key] for key in keys])
+    stats = stats_from_sums(sums, shift)
+    codes = codes.to_numpy()
+    for column in columns:
+        broadcast = stats[column].to_numpy()[codes]
+        broadcast[codes < 0] = np.nan
+        df[column] = broadcast
+    return stats
+
+
+class MomentAccumulator:
+    """
+    Running per-group count, mean and sum of squared deviations, weighted and unweighted, for data that
+    arrives in batches. Batches are reduced with group_sums and folded in with Chan's parallel update,
+    so accumulators can also be merged with each other and the result equals group_stats on all rows.
+    """
+
+    STATE_COLUMNS = ['n', 'mean', 'm2', 'w', 'weighted_mean', 'weighted_m2']
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.state = None
+
+    def update(self, df, value_column='sentiment_score', weight_column='score'):
+        if df.empty:
+            return
+        sums, _, shift = group_sums(df[value_column], df[weight_column], [df[key] for key in self.keys])
+        batch = pd.DataFrame({
+            'n': sums['n'],
+            'mean': sums['x'] / sums['n'] + shift,
+            'm2': (sums['xx'] - sums['x'] ** 2 / sums['n']).clip(lower=0),
+            'w': sums['w'],
+            'weighted_mean': sums['wx'] / sums['w'] + shift,
+            'weighted_m2': (sums['wxx'] - sums['wx'] ** 2 / sums['w']).clip(lower=0),
+        })
+        self.merge_state(batch)
+
+    def merge(self, other):
+        if other.state is not None:
+            self.merge_state(other.state)
+
+    def merge_state(self, batch):
+        if self.state is None:
+            self.state = batch
+            return
+        index = self.state.index.union(batch.index)
+        a = self.state.reindex(index)
+        b = batch.reindex(index)
+        merged = pd.DataFrame(index=index)
+        for count, mean, m2 in (('n', 'mean', 'm2'), ('w', 'weighted_mean', 'weighted_m2')):
+            count_a = a[count].fillna(0)
+            count_b = b[count].fillna(0)
+            total = count_a + count_b
+            delta = b[mean].fillna(0) - a[mean].fillna(0)
+            merged[count] = total
+            merged[mean] = a[mean].fillna(0) + delta * count_b / total
+            merged[m2] = a[m2].fillna(0) + b[m2].fillna(0) + delta ** 2 * count_a * count_b / total
+            # Groups only present on one side keep that side's values unchanged
+            merged.loc[count_a == 0, [mean, m2]] = b.loc[count_a == 0, [mean, m2]].to_numpy()
+            merged.loc[count_b == 0, [mean, m2]] = a.loc[count_b == 0, [mean, m2]].to_numpy()
+        self.state = merged[self.STATE_COLUMNS]
+
+    def result(self):
+        """
+        The accumulated statistics with the same columns as group_stats.
+        """
+        state = self.state
+        if state is None:
+            index = pd.MultiIndex.from_arrays([np.array([], dtype=np.int64)] * len(self.keys), names=self.keys)
+            state = pd.DataFrame(columns=self.STATE_COLUMNS, index=index, dtype=float)
+        unweighted_var = (state['m2'] / (state['n'] - 1)).where(state['n'] > 1)
+        weighted_var = state['weighted_m2'] / state['w']
+        return pd.DataFrame({
+            'count': state['n'].astype(int),
+            'mean': state['mean'],
+            'unweighted_var': unweighted_var,
+            'unweighted_std': np.sqrt(unweighted_var),
+            'weight_sum': state['w'],
+            'weighted_mean': state['weighted_mean'],
+            'weighted_var': weighted_var,
+            'weighted_std': np.sqrt(weighted_var),
+        })
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import cProfile
+import platform
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Instrumentation:
+    """
+    Stage timers and counters for one run. Stages are timed with the stage context manager and their
+    times add up over repeated calls, counters are plain running totals. Setting profile_stage runs that
+    stage under cProfile and saves the stats next to the run report for snakeviz or pstats.
+    """
+
+    def __init__(self, run_name, profile_stage=None):
+        self.run_name = run_name
+        self.profile_stage = profile_stage
+        self.started = datetime.now()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+
+    @contextmanager
+    def stage(self, name):
+        profiler = None
+        if name == self.profile_stage:
+            self.profiler = self.profiler or cProfile.Profile()
+            profiler = self.profiler
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+            if profiler is not None:
+                profiler.disable()
+
+    def add_time(self, name, seconds, calls=1):
+        """
+        Adds time measured elsewhere, for example by a worker process, to a stage.
+        """
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += calls
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def rate(self, name):
+        elapsed = self.elapsed()
+        return self.counters.get(name, 0) / elapsed if elapsed else 0.0
+
+    def state(self):
+        return {'stages': self.stages, 'counters': self.counters}
+
+    def merge(self, state):
+        """
+        Folds in the state() of an Instrumentation from another process.
+        """
+        for name, stage in state['stages'].items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, amount in state['counters'].items():
+            self.count(name, amount)
+
+    def report(self):
+        elapsed = self.elapsed()
+        return {
+            'run': self.run_name,
+            'started': self.started.isoformat(timespec='seconds'),
+            'wall_seconds': elapsed,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'stages': {name: dict(stage, share=stage['seconds'] / elapsed if elapsed else 0.0) for name, stage in self.stages.items()},
+            'counters': self.counters,
+            'rates_per_second': {name: amount / elapsed if elapsed else 0.0 for name, amount in self.counters.items()},
+        }
+
+    def write_report(self, report_folder):
+        """
+        Writes the run report as JSON, plus the profile of profile_stage if one was collected.
+        Returns the report path.
+        """
+        os.makedirs(report_folder, exist_ok=True)
+        base_name = os.path.join(report_folder, f"{self.run_name}_{self.started.strftime('%Y%m%d_%H%M%S')}")
+        report = self.report()
+        if self.profiler is not None:
+            report['profile'] = f"{base_name}_{self.profile_stage}.prof"
+            self.profiler.dump_stats(report['profile'])
+        with open(f"{base_name}.json", 'w') as handle:
+            json.dump(report, handle, indent=2)
+        return f"{base_name}.json"
+
+    def summary(self):
+        lines = [f"Run {self.run_name} took {self.elapsed():.1f} s"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"  {name}: {stage['seconds']:.2f} s over {stage['calls']} calls")
+        for name, amount in self.counters.items():
+            lines.append(f"  {name}: {amount:,} ({self.rate(name):,.0f}/s)")
+        return '\n'.join(lines)
+
+
+_instrumentation = None
+
+
+def get_instrumentation():
+    """
+    The instrumentation of the current run, a default one until start_run is called.
+    """
+    global _instrumentation
+    if _instrumentation is None:
+        _instrumentation = Instrumentation('run')
+    return _instrumentation
+
+
+def start_run(run_name, profile_stage=None):
+    global _instrumentation
+    _instrumentation = Instrumentation(run_name, profile_stage)
+    return _instrumentation
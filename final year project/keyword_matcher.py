@@ -0,0 +1,98 @@
+import re
+from functools import lru_cache
+
+
+class KeywordMatcher:
+    """
+    Matches a list of keywords against text in a single pass of one compiled regex.
+    Substring mode (default) matches a keyword anywhere in the text, whole_word only at word
+    boundaries and exact_match only when the whole text equals a keyword. exact_token takes tokenized
+    text, a list of tokens or a space separated string, and matches keywords equal to one token with a
+    set lookup instead of the regex, so a keyword of several words never matches. Matching ignores case.
+    """
+
+    def __init__(self, keywords, whole_word=False, exact_match=False, exact_token=False):
+        self.keywords = list(dict.fromkeys(keyword.lower() for keyword in keywords if keyword))
+        self.whole_word = whole_word
+        self.exact_match = exact_match
+        self.exact_token = exact_token
+        self.keyword_set = frozenset(self.keywords)
+        # Longest first so the alternation prefers the longest keyword starting at a position
+        ordered = sorted(self.keywords, key=len, reverse=True)
+        alternation = '|'.join(re.escape(keyword) for keyword in ordered)
+        if whole_word and not exact_match:
+            source = rf"\b(?:{alternation})\b"
+        else:
+            source = f"(?:{alternation})"
+        self.pattern = re.compile(source, re.IGNORECASE) if self.keywords else None
+        # The lookahead finds every start position, including overlapping matches
+        lookahead = rf"(?=(\b(?:{alternation})\b))" if whole_word else f"(?=({alternation}))"
+        self.all_pattern = re.compile(lookahead, re.IGNORECASE) if self.keywords else None
+        # IGNORECASE also matches Unicode case variants such as 'ſ' for 's', hits are mapped back through casefold
+        self.canonical = {keyword.casefold(): keyword for keyword in self.keywords}
+        # Shorter keywords that are prefixes of a longer one match wherever the longer one does
+        self.prefixes = {
+            keyword: [other for other in ordered if other != keyword and keyword.startswith(other)]
+            for keyword in self.keywords
+        }
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    def search(self, text):
+        if self.pattern is None or text is None:
+            return False
+        if self.exact_token:
+            return not self.keyword_set.isdisjoint(_lower_tokens(text))
+        if self.exact_match:
+            return self.pattern.fullmatch(text) is not None
+        return self.pattern.search(text) is not None
+
+    def find_all(self, text):
+        """
+        Returns the set of keywords found in text.
+        """
+        if self.pattern is None or text is None:
+            return set()
+        if self.exact_token:
+            return self.keyword_set.intersection(_lower_tokens(text))
+        if self.exact_match:
+            match = self.pattern.fullmatch(text)
+            return {self.keyword_of(text)} if match else set()
+        found = set()
+        for match in self.all_pattern.finditer(text):
+            keyword = self.keyword_of(match.group(1))
+            found.add(keyword)
+            start = match.start()
+            for other in self.prefixes[keyword]:
+                if other in found:
+                    continue
+                if not self.whole_word or not _is_word_char(text, start + len(other)):
+                    found.add(other)
+        return found
+
+    def keyword_of(self, matched):
+        """
+        The keyword as listed in keywords for text the pattern matched, whatever its case.
+        """
+        keyword = self.canonical.get(matched.casefold())
+        if keyword is None:
+            keyword = next(keyword for keyword in self.keywords if re.fullmatch(re.escape(keyword), matched, re.IGNORECASE))
+        return keyword
+
+
+def _lower_tokens(text):
+    return text.lower().split() if isinstance(text, str) else [token.lower() for token in text]
+
+
+def _is_word_char(text, index):
+    return index < len(text) and (text[index].isalnum() or text[index] == '_')
+
+
+@lru_cache(maxsize=32)
+def _cached_matcher(keywords, whole_word, exact_match, exact_token):
+    return KeywordMatcher(keywords, whole_word, exact_match, exact_token)
+
+
+def get_matcher(keywords, whole_word=False, exact_match=False, exact_token=False):
+    return _cached_matcher(tuple(keywords), whole_word, exact_match, exact_token)
@@ -1,11 +1,177 @@
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
-import numpy as np
-from scipy.stats import linregress
 import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from storage import list_partitions, write_partition
+from schema import read_comments, require_monthly_std
+from warmup import worker_context
+from aggregates import has_aggregates, read_aggregates, monthly_measure
+
+# Processed output column fitted for each metric, the plot folder it is saved in and its axis label
+METRICS = {
+    'Sentiment_Score': ('sentiment', 'Sentiment Score'),
+    'Weighted_Monthly_Std': ('wtd_std_deviation', 'Weighted Monthly Std'),
+    'Unweighted_Monthly_Std': ('std_deviation', 'Unweighted Monthly Std'),
+}
+
+
+def monthly_table(processed_folder):
+    """
+    One row per month of a processed folder with a column per metric, read from the aggregate tables
+    when analyze.py wrote them and averaged from the processed comments otherwise.
+    """
+    months = []
+    for year, partition in list_partitions(processed_folder):
+        if has_aggregates(processed_folder, year):
+            aggregates = read_aggregates(processed_folder, year)
+            month_df = aggregates[['subreddit', 'topic', 'year', 'month']].copy()
+            for metric in METRICS:
+                month_df[metric] = monthly_measure(aggregates, metric)
+        else:
+            require_monthly_std(partition)
+            df = read_comments(partition, columns=['Created_UTC'] + list(METRICS))
+            created = df['Created_UTC']
+            month_df = df[list(METRICS)].groupby([created.dt.year.rename('year'), created.dt.month.rename('month')]).mean().reset_index()
+            month_df.insert(0, 'topic', None)
+            month_df.insert(0, 'subreddit', None)
+        months.append(month_df)
+    if not months:
+        return pd.DataFrame(columns=['subreddit', 'topic', 'year', 'month'] + list(METRICS))
+    table = pd.concat(months, ignore_index=True)
+    # Folders written before the aggregate tables are labelled by their folder name
+    table['subreddit'] = table['subreddit'].fillna(os.path.basename(os.path.normpath(processed_folder)))
+    return table
+
+
+def load_series(processed_folders):
+    """
+    Every (subreddit, topic, metric) monthly series in the processed folders, in month order.
+    """
+    tables = [table for table in (monthly_table(folder) for folder in processed_folders) if not table.empty]
+    if not tables:
+        return []
+    table = pd.concat(tables, ignore_index=True)
+    table['topic'] = table['topic'].fillna('')
+    table = table.sort_values(['subreddit', 'topic', 'year', 'month'], kind='stable')
+    series = []
+    for (subreddit, topic), group in table.groupby(['subreddit', 'topic'], sort=True):
+        for metric in METRICS:
+            series.append({'subreddit': subreddit, 'topic': topic, 'metric': metric, 'values': group[metric].to_numpy(dtype=float)})
+    return series
+
+
+def fit_trends(series_values):
+    """
+    Least squares trend of each series against its month number 0, 1, 2, ..., all series at once.
+    Returns slope, intercept, r_squared, p_value and std_err arrays matching scipy.stats.linregress,
+    NaN for series with fewer than three values.
+    """
+    from scipy import stats
+    length = max((len(values) for values in series_values), default=0)
+    y = np.full((len(series_values), length), np.nan)
+    for row, values in enumerate(series_values):
+        y[row, :len(values)] = values
+    valid = ~np.isnan(y)
+    x = np.where(valid, np.arange(length, dtype=float), np.nan)
+    n = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.nansum(x, axis=1) / n
+        y_mean = np.nansum(y, axis=1) / n
+        dx = x - x_mean[:, None]
+        dy = y - y_mean[:, None]
+        ssx = np.nansum(dx * dx, axis=1)
+        ssy = np.nansum(dy * dy, axis=1)
+        sxy = np.nansum(dx * dy, axis=1)
+        slope = sxy / ssx
+        intercept = y_mean - slope * x_mean
+        r = np.clip(sxy / np.sqrt(ssx * ssy), -1.0, 1.0)
+        r = np.where(ssy == 0, 0.0, r)
+        df = n - 2
+        t = r * np.sqrt(df / ((1.0 - r) * (1.0 + r)))
+        p_value = 2 * stats.t.sf(np.abs(t), df)
+        std_err = np.sqrt((1 - r ** 2) * ssy / ssx / df)
+    fitted = n > 2
+    results = {'slope': slope, 'intercept': intercept, 'r_squared': r ** 2, 'p_value': p_value, 'std_err': std_err}
+    return {name: np.where(fitted, values, np.nan) for name, values in results.items()}
+
+
+def render_trend(values, fit, title, ylabel, plot_filename):
+    from matplotlib.figure import Figure
+    X = np.arange(len(values))
+    fig = Figure(figsize=(14, 8))
+    ax = fig.subplots()
+    ax.scatter(X, values, color='blue', label=f'{ylabel} Values')
+    ax.plot(X, fit['intercept'] + fit['slope'] * X, color='red', label='Trend Line')
+    ax.set_title(title)
+    ax.set_xlabel('Time (Months)')
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    ax.grid(True)
+
+    stats_text = f"Slope: {fit['slope']:.5f}\nIntercept: {fit['intercept']:.5f}\nR-squared: {fit['r_squared']:.5f}\nP-value: {fit['p_value']:.5f}\nStd Error: {fit['std_err']:.5f}"
+    ax.annotate(stats_text, xy=(0.05, 0.95), xycoords='axes fraction',
+                verticalalignment='top', fontsize=10, bbox=dict(boxstyle="round,pad=0.3", edgecolor='black', facecolor='white'))
+
+    fig.savefig(plot_filename, bbox_inches='tight')
+    return plot_filename
 
-# Configuration
-data_str = """
+
+def _render(job):
+    return render_trend(*job)
+
+
+def series_title(series):
+    label = ' '.join(part for part in (series['subreddit'], series['topic']) if part)
+    return f"{label} {METRICS[series['metric']][1]} Trend"
+
+
+def regress_all(processed_folders, output_folder='plots', results_file='trend_results', results_format='csv', workers=None):
+    """
+    Fits a trend line to every monthly series in the processed folders in one vectorized pass, writes the
+    results table and renders one plot per series in worker processes.
+    """
+    series = load_series(processed_folders)
+    fits = fit_trends([item['values'] for item in series])
+    results = pd.DataFrame({
+        'subreddit': [item['subreddit'] for item in series],
+        'topic': [item['topic'] for item in series],
+        'metric': [item['metric'] for item in series],
+        'months': [len(item['values']) for item in series],
+        **fits,
+    })
+    print(f"Results saved: {write_partition(results, os.path.join(output_folder, results_file), results_format)}")
+
+    jobs = []
+    for index, item in enumerate(series):
+        if np.isnan(fits['slope'][index]):
+            continue
+        plot_folder = os.path.join(output_folder, METRICS[item['metric']][0])
+        os.makedirs(plot_folder, exist_ok=True)
+        title = series_title(item)
+        fit = {name: values[index] for name, values in fits.items()}
+        jobs.append((item['values'], fit, title, METRICS[item['metric']][1], os.path.join(plot_folder, title + '.png')))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+        for plot_filename in executor.map(_render, jobs):
+            print(f"Plot saved: {plot_filename}")
+    return results
+
+
+def process_data_and_plot(data_string, title):
+    values = np.array(list(map(float, data_string.strip().split('\n'))))
+    fits = fit_trends([values])
+    fit = {name: result[0] for name, result in fits.items()}
+    render_trend(values, fit, title, 'Sentiment Score', os.path.join('plots', title + '.png'))
+    return fit['slope'], fit['intercept'], fit['r_squared'], fit['p_value'], fit['std_err']
+
+
+if __name__ == "__main__":
+    # Configuration
+    # With batch True every series in processed_folders is fitted, otherwise the data_str series below
+    batch = True
+    processed_folders = [r"worldnews\worldnews_processed_economics"]
+    # Processes used to render the plots, None uses every core
+    workers = None
+    data_str = """
 0.075778267
 0.038491042
 -0.016870137
@@ -67,43 +233,17 @@ data_str = """
 -0.016888173
 -0.079227015
 """
-title = "WorldNews Sentiment Score Trend"
-
-
-os.makedirs('plots', exist_ok=True)
-def process_data_and_plot(data_string):
-    weighted_monthly_std_values = list(map(float, data_string.strip().split('\n')))
-    X = np.arange(len(weighted_monthly_std_values)).reshape(-1, 1)
-    y = np.array(weighted_monthly_std_values)
-    model = LinearRegression()
-    model.fit(X, y)
-    trend_line = model.predict(X)
-    slope, intercept, r_value, p_value, std_err = linregress(X.flatten(), y)
-    
-
-    plt.figure(figsize=(14, 8))
-    plt.scatter(X, y, color='blue', label='Sentiment Score Values')
-    plt.plot(X, trend_line, color='red', label='Trend Line')
-    plt.title(title)
-    plt.xlabel('Time (Months)')
-    plt.ylabel('Sentiment Score')
-    plt.legend()
-    plt.grid(True)
-
-    stats_text = f'Slope: {slope:.5f}\nIntercept: {intercept:.5f}\nR-squared: {r_value ** 2:.5f}\nP-value: {p_value:.5f}\nStd Error: {std_err:.5f}'
-    plt.annotate(stats_text, xy=(0.05, 0.95), xycoords='axes fraction', 
-                 verticalalignment='top', fontsize=10, bbox=dict(boxstyle="round,pad=0.3", edgecolor='black', facecolor='white'))
-
-    plt.savefig(os.path.join('plots', title + '.png'), bbox_inches='tight')
-    plt.show()
-
-    return slope, intercept, r_value ** 2, p_value, std_err
-
-slope, intercept, r_squared, p_value, std_err = process_data_and_plot(data_str)
-
-print(f"Name: ", title )
-print(f"Slope: {slope}")
-print(f"Intercept: {intercept}")
-print(f"R-squared: {r_squared}")
-print(f"P-value: {p_value}")
-print(f"Standard Error: {std_err}")
\ No newline at end of file
+    title = "WorldNews Sentiment Score Trend"
+
+    os.makedirs('plots', exist_ok=True)
+    if batch:
+        regress_all(processed_folders, 'plots', workers=workers)
+    else:
+        slope, intercept, r_squared, p_value, std_err = process_data_and_plot(data_str, title)
+
+        print(f"Name: ", title )
+        print(f"Slope: {slope}")
+        print(f"Intercept: {intercept}")
+        print(f"R-squared: {r_squared}")
+        print(f"P-value: {p_value}")
+        print(f"Standard Error: {std_err}")
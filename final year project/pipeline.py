@@ -0,0 +1,317 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Default CPU share and memory estimate per stage kind, overridable under "resources" in the config
+DEFAULT_RESOURCES = {
+    'extract': {'cpus': 0.5, 'memory_gb': 1},
+    'analyze': {'cpus': 0.5, 'memory_gb': 4},
+    'plot': {'cpus': 1, 'memory_gb': 1},
+    'aggregate': {'cpus': 1, 'memory_gb': 1},
+    'regress': {'cpus': 1, 'memory_gb': 1},
+    'index': {'cpus': 1, 'memory_gb': 4},
+}
+
+
+def load_config(config_file):
+    with open(config_file, 'r') as handle:
+        config = json.load(handle)
+    config.setdefault('output_format', 'parquet')
+    config.setdefault('data_folder', '.')
+    config.setdefault('state_folder', '.pipeline')
+    config.setdefault('analysis', {})
+    config.setdefault('limits', {})
+    return config
+
+
+def raw_folder(config, subreddit, topic):
+    return os.path.join(config['data_folder'], subreddit, f"{subreddit}_raw_{topic}")
+
+
+def processed_folder(config, subreddit, topic):
+    return os.path.join(config['data_folder'], subreddit, f"{subreddit}_processed_{topic}")
+
+
+def index_folder(config, subreddit, topic):
+    return os.path.join(config['data_folder'], subreddit, f"{subreddit}_index_{topic}")
+
+
+def graphs_folder(config, subreddit, topic):
+    return os.path.join(config['data_folder'], 'graphs', f"{subreddit}_processed_{topic}_graphs")
+
+
+def path_signature(path):
+    """
+    Size and modification time of a file, or of every file under a folder, to detect changed inputs.
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [[os.path.basename(path), stat.st_size, stat.st_mtime_ns]]
+    signature = []
+    for root, folders, files in os.walk(path):
+        folders.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            stat = os.stat(file_path)
+            signature.append([os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def module_version(*module_names):
+    digest = hashlib.sha256()
+    for name in module_names:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py"), 'rb') as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+class Task:
+    """
+    One node of the pipeline DAG. run(**params) is executed in a worker process once every task in deps
+    has finished. The task is up to date when its inputs, params and code are unchanged since it last
+    succeeded and all of its outputs exist.
+    """
+
+    def __init__(self, name, kind, run, params, deps, inputs, outputs, modules):
+        self.name = name
+        self.kind = kind
+        self.run = run
+        self.params = params
+        self.deps = deps
+        self.inputs = inputs
+        self.outputs = outputs
+        self.modules = modules
+        self.cpus = 1
+        self.memory_gb = 0
+
+    def key(self):
+        # The worker count only depends on the resource limits and does not change the output
+        params = {name: value for name, value in self.params.items() if name != 'workers'}
+        parts = [params, [path_signature(path) for path in self.inputs if os.path.exists(path)], module_version(*self.modules)]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_current(self, state):
+        return state.get(self.name) == self.key() and all(os.path.exists(path) for path in self.outputs)
+
+
+def run_extract(input_file, topics, years, output_format, workers, checkpoint_path):
+    import gather_raw
+    gather_raw.setup_logging()
+    # A finished checkpoint would make the extraction a no-op, but the pipeline only reruns stale extractions
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as handle:
+            if json.load(handle).get('complete'):
+                os.remove(checkpoint_path)
+    if workers > 1:
+        gather_raw.process_file_parallel(input_file, topics, years, 'body', False, workers, output_format=output_format, checkpoint_path=checkpoint_path)
+    else:
+        gather_raw.process_file_multi(input_file, topics, years, 'body', False, output_format=output_format, checkpoint_path=checkpoint_path)
+
+
+def run_analyze(input_folder, output_folder, keywords, output_format, workers, analysis, subreddit, topic):
+    from analyze import analyze_reddit_comments_in_folder
+    analyze_reddit_comments_in_folder(input_folder, output_folder, None, keywords, output_format, analysis.get('export_excel', False), workers, 1,
+                                      analysis.get('granularity', 'month'), analysis.get('cache_folder'), analysis.get('min_score', 1),
+                                      analysis.get('threshold', 0.3), analysis.get('streaming', False), analysis.get('batch_rows', 100000), subreddit, topic)
+
+
+def run_plot(input_folder, output_folder, workers):
+    from graph import generate_graphs
+    generate_graphs(input_folder, output_folder, workers)
+
+
+def run_index(processed_folder, index_folder, kinds, output_format):
+    from entity_index import build_entity_indexes
+    build_entity_indexes(processed_folder, index_folder, kinds, output_format)
+
+
+def run_aggregate(processed_folders, output_file, output_format):
+    """
+    Collects the monthly aggregate tables of every subreddit and topic into one table.
+    """
+    from storage import list_partitions, write_partition
+    from aggregates import has_aggregates, read_aggregates
+    tables = []
+    for folder in processed_folders:
+        for year, _ in list_partitions(folder):
+            if has_aggregates(folder, year):
+                tables.append(read_aggregates(folder, year))
+    combined = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    write_partition(combined, output_file, output_format)
+
+
+def run_regress(processed_folders, output_folder, workers):
+    from linear_regression import regress_all
+    os.makedirs(output_folder, exist_ok=True)
+    regress_all(processed_folders, output_folder, workers=workers)
+
+
+def build_tasks(config):
+    """
+    The extract -> analyze -> plot / index / aggregate / regress DAG for every subreddit and topic in the config.
+    Each subreddit dump is read once for all topics.
+    """
+    years = list(range(config['start_year'], config['end_year'] + 1))
+    output_format = config['output_format']
+    state_folder = config['state_folder']
+    tasks = {}
+    analyze_tasks = []
+    for subreddit, dump_file in config['subreddits'].items():
+        topics = {topic: (raw_folder(config, subreddit, topic), keywords) for topic, keywords in config['topics'].items()}
+        extract_name = f"extract:{subreddit}"
+        tasks[extract_name] = Task(extract_name, 'extract', run_extract,
+                                   {'input_file': dump_file, 'topics': topics, 'years': years, 'output_format': output_format,
+                                    'checkpoint_path': os.path.join(state_folder, f"extract_{subreddit}.json")},
+                                   [], [dump_file], [raw_folder(config, subreddit, topic) for topic in topics],
+                                   ['gather_raw', 'keyword_matcher', 'storage', 'checkpoint'])
+        for topic, keywords in config['topics'].items():
+            analyze_name = f"analyze:{subreddit}/{topic}"
+            processed = processed_folder(config, subreddit, topic)
+            tasks[analyze_name] = Task(analyze_name, 'analyze', run_analyze,
+                                       {'input_folder': raw_folder(config, subreddit, topic), 'output_folder': processed, 'keywords': keywords,
+                                        'output_format': output_format, 'analysis': config['analysis'], 'subreddit': subreddit, 'topic': topic},
+                                       [extract_name], [raw_folder(config, subreddit, topic)], [processed],
+                                       ['analyze', 'text_preprocessing', 'scoring', 'emotion_index', 'grouped_stats', 'aggregates', 'schema', 'storage'])
+            analyze_tasks.append(tasks[analyze_name])
+            plot_name = f"plot:{subreddit}/{topic}"
+            tasks[plot_name] = Task(plot_name, 'plot', run_plot,
+                                    {'input_folder': processed, 'output_folder': graphs_folder(config, subreddit, topic)},
+                                    [analyze_name], [processed], [graphs_folder(config, subreddit, topic)], ['graph', 'aggregates', 'schema'])
+            if config.get('entity_indexes'):
+                index_name = f"index:{subreddit}/{topic}"
+                tasks[index_name] = Task(index_name, 'index', run_index,
+                                         {'processed_folder': processed, 'index_folder': index_folder(config, subreddit, topic),
+                                          'kinds': config['entity_indexes'], 'output_format': output_format},
+                                         [analyze_name], [processed], [index_folder(config, subreddit, topic)],
+                                         ['entity_index', 'grouped_stats', 'schema', 'storage'])
+    processed_folders = [task.params['output_folder'] for task in analyze_tasks]
+    deps = [task.name for task in analyze_tasks]
+    reports_folder = os.path.join(config['data_folder'], 'reports')
+    aggregate_file = os.path.join(reports_folder, 'monthly_aggregates')
+    tasks['aggregate'] = Task('aggregate', 'aggregate', run_aggregate,
+                              {'processed_folders': processed_folders, 'output_file': aggregate_file, 'output_format': config.get('aggregate_format', 'xlsx')},
+                              deps, processed_folders, [reports_folder], ['aggregates', 'storage'])
+    regression_folder = os.path.join(config['data_folder'], 'plots')
+    tasks['regress'] = Task('regress', 'regress', run_regress,
+                            {'processed_folders': processed_folders, 'output_folder': regression_folder},
+                            deps, processed_folders, [regression_folder], ['linear_regression', 'aggregates', 'schema'])
+
+    cpu_limit, _ = resource_limits(config)
+    resources = {kind: dict(values, **config.get('resources', {}).get(kind, {})) for kind, values in DEFAULT_RESOURCES.items()}
+    for task in tasks.values():
+        cpus = resources[task.kind]['cpus']
+        # Fractions are shares of the CPU limit, so two extractions or analyses can run side by side
+        task.cpus = max(1, int(cpus * cpu_limit)) if cpus < 1 else min(int(cpus), cpu_limit)
+        task.memory_gb = resources[task.kind]['memory_gb']
+        if task.kind not in ('aggregate', 'index'):
+            task.params['workers'] = task.cpus
+    return tasks
+
+
+def resource_limits(config):
+    cpus = config['limits'].get('cpus') or os.cpu_count() or 1
+    memory_gb = config['limits'].get('memory_gb')
+    if memory_gb is None and psutil is not None:
+        memory_gb = psutil.virtual_memory().total / 2**30 * 0.8
+    return cpus, memory_gb
+
+
+def read_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as handle:
+        return json.load(handle)
+
+
+def write_state(state, state_file):
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    with open(f"{state_file}.tmp", 'w') as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(f"{state_file}.tmp", state_file)
+
+
+def _execute(run, params):
+    from instrumentation import start_run
+    instrumentation = start_run(run.__name__)
+    run(**params)
+    return instrumentation.state()
+
+
+def run_pipeline(config, force=False):
+    """
+    Runs every stale task of the DAG. Tasks whose dependencies are done are started as soon as the CPU and
+    memory they need fit within the limits, at least one task always runs. A task is rerun when an
+    upstream task reran since its inputs are the upstream outputs.
+    """
+    tasks = build_tasks(config)
+    state_file = os.path.join(config['state_folder'], 'pipeline_state.json')
+    state = {} if force else read_state(state_file)
+    cpu_limit, memory_limit = resource_limits(config)
+    from instrumentation import get_instrumentation
+    instrumentation = get_instrumentation()
+
+    done = set()
+    failed = set()
+    running = {}
+    from warmup import worker_context
+    with ProcessPoolExecutor(max_workers=max(1, min(len(tasks), cpu_limit)), mp_context=worker_context()) as executor:
+        while len(done) + len(failed) < len(tasks):
+            for task in tasks.values():
+                if task.name in done or task.name in failed or task.name in running.values():
+                    continue
+                if any(dep in failed for dep in task.deps):
+                    print(f"Skipping {task.name}, a dependency failed")
+                    failed.add(task.name)
+                    continue
+                if not all(dep in done for dep in task.deps):
+                    continue
+                if task.is_current(state):
+                    print(f"{task.name} is up to date")
+                    done.add(task.name)
+                    continue
+                used_cpus = sum(tasks[name].cpus for name in running.values())
+                used_memory = sum(tasks[name].memory_gb for name in running.values())
+                fits = used_cpus + task.cpus <= cpu_limit and (memory_limit is None or used_memory + task.memory_gb <= memory_limit)
+                if running and not fits:
+                    continue
+                print(f"Starting {task.name} with {task.cpus} CPUs")
+                running[executor.submit(_execute, task.run, task.params)] = task.name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    instrumentation.merge(future.result())
+                except Exception as e:
+                    print(f"{name} failed: {e}")
+                    failed.add(name)
+                    continue
+                # The key is taken after the run so it covers the inputs the task actually read
+                state[name] = tasks[name].key()
+                write_state(state, state_file)
+                done.add(name)
+                print(f"Finished {name}")
+    if failed:
+        print(f"Failed tasks: {', '.join(sorted(failed))}")
+    return done, failed
+
+
+if __name__ == "__main__":
+    # Configuration
+    config_file = "pipeline.json"
+    # Rerun every task even when its outputs are up to date
+    force = False
+
+    from instrumentation import start_run
+    instrumentation = start_run("pipeline")
+    run_pipeline(load_config(config_file), force)
+    print(instrumentation.summary())
+    print(f"Run report saved: {instrumentation.write_report('logs')}")
@@ -0,0 +1,291 @@
+import os
+import math
+from collections import deque
+import numpy as np
+import pandas as pd
+from gather_raw import TopicRouter, iter_lines, read_blocks_zst, raw_row
+from storage import RAW_COLUMNS, write_partition
+from sketches import ReservoirSample, HyperLogLog, CountMinSketch, QuantileSketch, hash64
+from instrumentation import get_instrumentation, start_run
+from warmup import worker_context
+
+# Normal quantile of the two sided 95% intervals reported for the estimates
+Z_95 = 1.96
+SCORE_QUANTILES = [0.1, 0.5, 0.9]
+
+
+class MonthSketch:
+    """
+    Sketches of the comments of one topic in one month: the exact comment count, a uniform sample for
+    sentiment scoring, the distinct authors, how many comments mention each keyword and the comment
+    score quantiles.
+    """
+
+    def __init__(self, settings, seed):
+        self.comments = 0
+        self.sample = ReservoirSample(settings['sample_size'], seed)
+        self.authors = HyperLogLog(settings['precision'])
+        self.keywords = CountMinSketch(settings['width'], settings['depth'])
+        self.scores = QuantileSketch(settings['relative_accuracy'])
+
+    def add(self, obj, created, keywords):
+        self.comments += 1
+        self.sample.add(raw_row(obj, created))
+        author = obj.get('author')
+        if author and author != '[deleted]':
+            self.authors.add(author)
+        for keyword in keywords:
+            self.keywords.add(keyword)
+        score = obj.get('score')
+        if score is not None:
+            self.scores.add(float(score))
+
+    def merge(self, other):
+        self.comments += other.comments
+        self.sample.merge(other.sample)
+        self.authors.merge(other.authors)
+        self.keywords.merge(other.keywords)
+        self.scores.merge(other.scores)
+
+
+class QuickLook:
+    """
+    One pass summary of a dump per (topic, year, month). Summaries of separate blocks of the dump are
+    combined with merge, so blocks can be summarized in parallel.
+    """
+
+    def __init__(self, sample_size=1000, precision=12, width=1024, depth=4, relative_accuracy=0.01, seed=0, block=0):
+        self.settings = {'sample_size': sample_size, 'precision': precision, 'width': width, 'depth': depth,
+                         'relative_accuracy': relative_accuracy, 'seed': seed}
+        self.block = block
+        self.months = {}
+        self.lines = 0
+        self.errors = 0
+
+    def month(self, topic, year, month):
+        key = (topic, year, month)
+        if key not in self.months:
+            # Every block and month samples with its own random stream
+            seed = [self.settings['seed'], self.block, year, month, hash64(topic) % 2**32]
+            self.months[key] = MonthSketch(self.settings, seed)
+        return self.months[key]
+
+    def add_block(self, router, block):
+        for line in iter_lines(block):
+            self.lines += 1
+            try:
+                matched = router.match(line)
+            except Exception:
+                self.errors += 1
+                continue
+            if matched is None:
+                continue
+            obj, created, keywords, matched_topics = matched
+            for topic in matched_topics:
+                self.month(topic, created.year, created.month).add(obj, created, keywords)
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.errors += other.errors
+        for key, sketch in other.months.items():
+            if key in self.months:
+                self.months[key].merge(sketch)
+            else:
+                self.months[key] = sketch
+
+
+_worker_router = None
+_worker_settings = None
+
+
+def _init_worker(topics, years, field, exact_match, settings):
+    global _worker_router, _worker_settings
+    _worker_router = TopicRouter(topics, years, field, exact_match)
+    _worker_settings = settings
+
+
+def _sketch_block(block, index):
+    quicklook = QuickLook(**_worker_settings, block=index)
+    quicklook.add_block(_worker_router, block)
+    return quicklook
+
+
+def sketch_dump(input_file, topics, years, field='body', exact_match=False, workers=1, block_size=2**24, **settings):
+    """
+    Summarizes a dump in one streaming pass. topics maps each topic to its keywords, settings are
+    passed on to QuickLook. With workers > 1 the blocks are summarized in worker processes and merged.
+    """
+    topics = {topic: (None, keywords) for topic, keywords in topics.items()}
+    instrumentation = get_instrumentation()
+    quicklook = QuickLook(**settings)
+    if workers <= 1:
+        router = TopicRouter(topics, years, field, exact_match)
+        for block, _ in read_blocks_zst(input_file, block_size):
+            with instrumentation.stage('sketch'):
+                quicklook.add_block(router, block)
+        return quicklook
+    pending = deque()
+    with worker_context().Pool(workers, initializer=_init_worker, initargs=(topics, years, field, exact_match, settings)) as pool:
+        blocks = enumerate(read_blocks_zst(input_file, block_size))
+        while True:
+            for index, (block, _) in blocks:
+                pending.append(pool.apply_async(_sketch_block, (block, index + 1)))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            with instrumentation.stage('wait'):
+                block_quicklook = pending.popleft().get()
+            quicklook.merge(block_quicklook)
+    return quicklook
+
+
+def score_samples(quicklook, topics, workers=1, min_score=1):
+    """
+    Cleans and scores the sampled comments the way analyze.py does, keyword filter included, and returns
+    them with their topic, year and month.
+    """
+    from analyze import clean_comments, contains_keywords
+    from scoring import score_comments
+    frames = []
+    for topic, keywords in topics.items():
+        rows = []
+        keys = []
+        for (sketch_topic, year, month), sketch in quicklook.months.items():
+            if sketch_topic == topic:
+                rows.extend(sketch.sample.items)
+                keys.extend([(year, month)] * len(sketch.sample.items))
+        if not rows:
+            continue
+        df = pd.DataFrame(rows, columns=RAW_COLUMNS)
+        df['year'] = [year for year, _ in keys]
+        df['month'] = [month for _, month in keys]
+        df = clean_comments(df, min_score)
+        if keywords:
+            df = df[df['processed_body'].apply(lambda x: contains_keywords(x, keywords, preprocessed=True))]
+        if df.empty:
+            continue
+        df['sentiment_score'] = score_comments(df['processed_body'], workers=workers, emotion=False)['sentiment_score'].to_numpy()
+        df['topic'] = topic
+        frames.append(df[['topic', 'year', 'month', 'score', 'sentiment_score']])
+    if not frames:
+        return pd.DataFrame(columns=['topic', 'year', 'month', 'score', 'sentiment_score'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def sentiment_estimate(sentiments, weights, population):
+    """
+    Mean sentiment of a month from a uniform sample of it, with a 95% confidence interval that includes
+    the finite population correction, plus the sample's std and score weighted mean.
+    """
+    n = len(sentiments)
+    if not n:
+        return {'sentiment_mean': np.nan, 'sentiment_ci_low': np.nan, 'sentiment_ci_high': np.nan, 'sentiment_std': np.nan, 'weighted_sentiment_mean': np.nan}
+    mean = float(np.mean(sentiments))
+    std = float(np.std(sentiments, ddof=1)) if n > 1 else np.nan
+    correction = math.sqrt(max(population - n, 0) / (population - 1)) if population > 1 else 0.0
+    margin = Z_95 * std / math.sqrt(n) * correction if n > 1 else np.nan
+    return {
+        'sentiment_mean': mean,
+        'sentiment_ci_low': mean - margin,
+        'sentiment_ci_high': mean + margin,
+        'sentiment_std': std,
+        'weighted_sentiment_mean': float(np.average(sentiments, weights=weights)),
+    }
+
+
+def quicklook_report(quicklook, scored, topics, subreddit=None):
+    """
+    The estimates per topic and month with their error bounds, and the estimated keyword mention
+    counts per topic and month.
+    """
+    summary = []
+    keyword_rows = []
+    grouped = {key: group for key, group in scored.groupby(['topic', 'year', 'month'])}
+    for (topic, year, month), sketch in sorted(quicklook.months.items()):
+        sample = grouped.get((topic, year, month))
+        sampled = len(sketch.sample.items)
+        kept = 0 if sample is None else len(sample)
+        # The share of the sample that survives cleaning and the keyword filter estimates the analyzed count
+        analyzed = sketch.comments * kept / sampled if sampled else 0.0
+        authors = sketch.authors.estimate()
+        author_margin = Z_95 * sketch.authors.relative_error() * authors
+        row = {
+            'subreddit': subreddit,
+            'topic': topic,
+            'year': year,
+            'month': month,
+            'comments': sketch.comments,
+            'sample_size': sampled,
+            'sample_analyzed': kept,
+            'analyzed_comments': analyzed,
+            'unique_authors': authors,
+            'unique_authors_low': max(authors - author_margin, 0.0),
+            'unique_authors_high': authors + author_margin,
+        }
+        if sample is None:
+            row.update(sentiment_estimate([], [], 0))
+        else:
+            row.update(sentiment_estimate(sample['sentiment_score'].to_numpy(dtype=float), sample['score'].to_numpy(dtype=float), analyzed))
+        for q in SCORE_QUANTILES:
+            row[f"score_p{round(q * 100)}"] = sketch.scores.quantile(q)
+        row['score_relative_error'] = sketch.scores.relative_accuracy
+        summary.append(row)
+        error = sketch.keywords.error()
+        for keyword in dict.fromkeys(keyword.lower() for keyword in topics[topic]):
+            count = sketch.keywords.estimate(keyword)
+            keyword_rows.append({
+                'subreddit': subreddit,
+                'topic': topic,
+                'year': year,
+                'month': month,
+                'keyword': keyword,
+                'comments': count,
+                'comments_low': max(count - error, 0.0),
+                'confidence': sketch.keywords.confidence(),
+            })
+    return pd.DataFrame(summary), pd.DataFrame(keyword_rows)
+
+
+def quick_look(input_file, topics, years, output_folder, subreddit=None, output_format='csv', workers=1, min_score=1, **settings):
+    """
+    Estimates the monthly numbers of the full extract and analyze run from one pass over the dump and
+    a scored sample per month, and writes them to output_folder. Returns the paths written.
+    """
+    instrumentation = get_instrumentation()
+    quicklook = sketch_dump(input_file, topics, years, workers=workers, **settings)
+    instrumentation.count('lines_read', quicklook.lines)
+    instrumentation.count('errors', quicklook.errors)
+    with instrumentation.stage('score'):
+        scored = score_samples(quicklook, topics, workers, min_score)
+    instrumentation.count('rows_scored', len(scored))
+    summary, keywords = quicklook_report(quicklook, scored, topics, subreddit)
+    return (write_partition(summary, os.path.join(output_folder, 'quicklook_summary'), output_format),
+            write_partition(keywords, os.path.join(output_folder, 'quicklook_keywords'), output_format))
+
+
+if __name__ == "__main__":
+    # Configuration
+    input_file = r"zst_input\worldnews_comments.zst"
+    subreddit = "worldnews"
+    output_folder = "quicklook"
+    output_format = "csv"
+    years = list(range(2018, 2023))
+    topics = {
+        "economics": ['economy', 'inflation', 'recession', 'GDP', 'unemployment', 'markets', 'stocks', 'bonds', 'interest rates'],
+    }
+    workers = os.cpu_count() or 1
+    # Comments scored per topic and month, the sentiment intervals narrow with its square root
+    sample_size = 1000
+    # HyperLogLog registers are 2**precision bytes, count-min counters width x depth per topic and month
+    precision = 12
+    width = 1024
+    depth = 4
+    relative_accuracy = 0.01
+    seed = 0
+
+    instrumentation = start_run("quicklook")
+    for path in quick_look(input_file, topics, years, output_folder, subreddit, output_format, workers, sample_size=sample_size,
+                           precision=precision, width=width, depth=depth, relative_accuracy=relative_accuracy, seed=seed):
+        print(f"Report saved: {path}")
+    print(instrumentation.summary())
@@ -0,0 +1,86 @@
+import pandas as pd
+from storage import pa, read_partition, iter_partition_batches, partition_columns
+
+# Arrow backed strings keep the comment text in one contiguous buffer instead of a Python object per row
+TEXT_DTYPE = pd.StringDtype('pyarrow') if pa is not None else object
+
+# Column types of the raw and processed comment partitions, keyed by lowercased column name.
+# Standard deviation columns are matched by their _std suffix since their name depends on the granularity.
+COMMENT_SCHEMA = {
+    'score': 'int32',
+    'created_utc': 'datetime64[ns]',
+    'author': 'category',
+    'body': TEXT_DTYPE,
+    'comment': TEXT_DTYPE,
+    'sentiment_score': 'float32',
+    'primary_emotion': 'category',
+    'id': TEXT_DTYPE,
+    'comment_id': TEXT_DTYPE,
+    'link_id': 'category',
+    'thread_id': 'category',
+    'parent_id': TEXT_DTYPE,
+    'subreddit': 'category',
+}
+STD_DTYPE = 'float32'
+
+
+def column_dtype(column):
+    name = column.lower()
+    if name in COMMENT_SCHEMA:
+        return COMMENT_SCHEMA[name]
+    if name.endswith('_std'):
+        return STD_DTYPE
+    return None
+
+
+def apply_schema(df):
+    """
+    Converts the comment columns of df to their schema types in place and returns df. Scores that are
+    missing or not numbers become NaN and leave the column as float32 until those rows are dropped.
+    """
+    for column in df.columns:
+        dtype = column_dtype(column)
+        if dtype is None or df[column].dtype == dtype:
+            continue
+        if dtype == 'int32':
+            values = pd.to_numeric(df[column], errors='coerce')
+            df[column] = values.astype('int32' if values.notna().all() else 'float32')
+        elif dtype == 'datetime64[ns]':
+            df[column] = pd.to_datetime(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_comments(partition_path, columns=None):
+    """
+    read_partition with the comment schema applied.
+    """
+    return apply_schema(read_partition(partition_path, columns))
+
+
+def iter_comments(partition_path, batch_rows, columns=None):
+    for batch in iter_partition_batches(partition_path, batch_rows, columns):
+        yield apply_schema(batch)
+
+
+def std_period(partition_path):
+    """
+    The period name of a processed partition's standard deviation columns, 'Monthly' for
+    Weighted_Monthly_Std, or None when it has none.
+    """
+    for column in partition_columns(partition_path):
+        if column.startswith('Weighted_') and column.endswith('_Std'):
+            return column[len('Weighted_'):-len('_Std')]
+    return None
+
+
+def require_monthly_std(partition_path):
+    """
+    Monthly figures and regressions read from the comments need the monthly standard deviation columns,
+    output analyzed with another granularity only has them in its aggregate table.
+    """
+    period = std_period(partition_path)
+    if period != 'Monthly':
+        raise ValueError(f"{partition_path} has {period or 'no'} standard deviations instead of monthly ones and no monthly "
+                         f"aggregate table, analyze it again to write the table")
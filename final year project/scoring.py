@@ -0,0 +1,84 @@
+import pandas as pd
+from text_preprocessing import get_preprocessor
+from emotion_index import get_emotion_index
+
+
+def primary_emotion(text, threshold=0.3, preprocessed=False):
+    from nrclex import NRCLex
+    if not preprocessed:
+        text = ' '.join(get_preprocessor().tokenize(text))
+    # The original analysis preprocessed the processed text once more before the lexicon lookup
+    text = ' '.join(get_preprocessor().tokenize(text))
+    emotion = NRCLex(text)
+    total_emotion_freq = sum(freq for emotion, freq in emotion.affect_frequencies.items() if emotion not in ['positive', 'negative'])
+    emotions = {key: value for key, value in emotion.affect_frequencies.items() if key not in ['positive', 'negative']}
+    if emotions and total_emotion_freq > 0:
+        primary, score = max(emotions.items(), key=lambda item: item[1])
+        if score / total_emotion_freq >= threshold:
+            return primary
+    return "No emotion"
+
+def score_texts(texts, analyzer, threshold=0.3, sentiment=True, emotion=True):
+    sentiments = [analyzer.polarity_scores(text)['compound'] for text in texts] if sentiment else None
+    # The emotions are looked up in the preprocessed text preprocessed once more, as primary_emotion does.
+    # Stemming is not idempotent, so the second pass changes tokens such as 'accident' -> 'accid'
+    preprocessor = get_preprocessor()
+    emotions = get_emotion_index().primary_emotions([preprocessor.tokenize(text) for text in texts], threshold) if emotion else None
+    return sentiments, emotions
+
+_analyzer = None
+
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+def _init_worker():
+    # Workers forked from a warmed up parent already have everything loaded, spawned ones load it here
+    from warmup import warm_up
+    warm_up()
+
+def _score_chunk(args):
+    texts, threshold, sentiment, emotion = args
+    return score_texts(texts, get_analyzer(), threshold, sentiment, emotion)
+
+def create_pool(workers):
+    from warmup import warm_up, worker_context
+    warm_up()
+    return worker_context().Pool(workers, initializer=_init_worker)
+
+def _score_in_pool(pool, texts, chunk_size, threshold, sentiment, emotion):
+    sentiments = []
+    emotions = []
+    chunks = ((texts[start:start + chunk_size], threshold, sentiment, emotion) for start in range(0, len(texts), chunk_size))
+    for chunk_sentiments, chunk_emotions in pool.imap(_score_chunk, chunks):
+        sentiments.extend(chunk_sentiments or [])
+        emotions.extend(chunk_emotions or [])
+    return sentiments, emotions
+
+def score_comments(processed_bodies, analyzer=None, workers=1, chunk_size=5000, threshold=0.3, sentiment=True, emotion=True, pool=None):
+    """
+    Scores preprocessed comments with VADER and the NRC lexicon. With workers > 1 the comments are split
+    into chunks that are scored in a process pool, each worker builds its own analyzer once, and the chunks
+    are collected in order so the result is identical to the sequential path. The sentiment and emotion
+    flags select which of the two columns are computed and returned. A pool from create_pool can be
+    passed in to reuse the same workers across calls.
+    """
+    texts = processed_bodies.tolist()
+    if len(texts) <= chunk_size or (workers <= 1 and pool is None):
+        if sentiment and analyzer is None:
+            analyzer = get_analyzer()
+        sentiments, emotions = score_texts(texts, analyzer, threshold, sentiment, emotion)
+    elif pool is not None:
+        sentiments, emotions = _score_in_pool(pool, texts, chunk_size, threshold, sentiment, emotion)
+    else:
+        with create_pool(workers) as pool:
+            sentiments, emotions = _score_in_pool(pool, texts, chunk_size, threshold, sentiment, emotion)
+    columns = {}
+    if sentiment:
+        columns['sentiment_score'] = sentiments
+    if emotion:
+        columns['primary_emotion'] = emotions
+    return pd.DataFrame(columns, index=processed_bodies.index)
@@ -0,0 +1,186 @@
+import math
+import hashlib
+import numpy as np
+
+# Fixed size summaries of a stream for quick-look reports. Every sketch can be merged with another one of
+# the same settings, so a dump can be summarized in parallel blocks and the results combined, and every
+# sketch reports how far its estimates can be off.
+
+
+def hash64(value):
+    """
+    Stable 64 bit hash of a string, the same in every process unlike hash().
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+class ReservoirSample:
+    """
+    Uniform random sample of at most size items of a stream (Algorithm R). Merging two reservoirs draws
+    from each in proportion to the number of items it has seen, so the result is again a uniform sample
+    of both streams together.
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+            return
+        slot = self.rng.integers(self.seen)
+        if slot < self.size:
+            self.items[slot] = item
+
+    def merge(self, other):
+        total = self.seen + other.seen
+        if total <= self.size:
+            self.items.extend(other.items)
+        elif other.seen:
+            keep = min(self.size, total)
+            from_self = self.rng.hypergeometric(self.seen, other.seen, keep)
+            picked_self = self.rng.choice(len(self.items), from_self, replace=False)
+            picked_other = self.rng.choice(len(other.items), keep - from_self, replace=False)
+            self.items = [self.items[index] for index in picked_self] + [other.items[index] for index in picked_other]
+        self.seen = total
+
+
+class HyperLogLog:
+    """
+    Distinct count estimate with 2**precision one byte registers. The relative standard error is about
+    1.04 / sqrt(2**precision), 1.6% at the default precision.
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(2 ** precision)
+
+    def add(self, value):
+        hashed = hash64(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(np.maximum(np.frombuffer(self.registers, np.uint8), np.frombuffer(other.registers, np.uint8)).tobytes())
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def estimate(self):
+        registers = np.frombuffer(self.registers, np.uint8)
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(float)))
+        zeros = int(np.count_nonzero(registers == 0))
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+class CountMinSketch:
+    """
+    Frequency estimates of keys in a depth x width table of counters. An estimate is never below the true
+    count and, with probability 1 - exp(-depth), at most e / width times the total count above it.
+    """
+
+    def __init__(self, width=1024, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=8 * self.depth).digest()
+        return [int.from_bytes(digest[row * 8:row * 8 + 8], 'little') % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        self.table[np.arange(self.depth), self._columns(key)] += count
+        self.total += count
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches of different sizes")
+        self.table += other.table
+        self.total += other.total
+
+    def estimate(self, key):
+        return int(self.table[np.arange(self.depth), self._columns(key)].min())
+
+    def error(self):
+        """
+        The most an estimate exceeds the true count, with probability confidence().
+        """
+        return math.e / self.width * self.total
+
+    def confidence(self):
+        return 1 - math.exp(-self.depth)
+
+
+class QuantileSketch:
+    """
+    Quantiles with a relative error of at most relative_accuracy (DDSketch). Values are counted in
+    logarithmic buckets, so the sketch stays small whatever the range of the values.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value):
+        self.count += 1
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + 1
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge quantile sketches of different accuracy")
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # Negative values in increasing order are the buckets of their magnitude in decreasing order
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
@@ -0,0 +1,304 @@
+import os
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# pandas is imported by the functions that need it, so extraction workers that only write raw files start quickly
+
+# Partitions follow the existing folder layout, one file per year inside a subreddit/topic folder:
+# raw data as {raw_folder}/{year}/{year}.{ext}, processed data as {processed_folder}/{year}.{ext}.
+# When several formats exist for the same partition the first one listed here wins.
+EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'csv': '.csv',
+    'xlsx': '.xlsx',
+}
+
+# The comment, thread and parent ids and the subreddit are kept so comments can be indexed by author and thread
+RAW_COLUMNS = ["score", "created_utc", "author", "body", "id", "link_id", "parent_id", "subreddit"]
+
+
+def _require_arrow(fmt):
+    if pa is None:
+        raise ImportError(f"pyarrow is required to read or write the {fmt} format")
+
+
+def partition_file(partition_path, fmt):
+    return partition_path + EXTENSIONS[fmt]
+
+
+def find_partition(partition_path):
+    for fmt, extension in EXTENSIONS.items():
+        if os.path.exists(partition_path + extension):
+            return partition_path + extension, fmt
+    return None, None
+
+
+def list_partitions(folder):
+    """
+    Returns sorted (year, partition_path) pairs for the per-year files in a processed folder.
+    """
+    partitions = {}
+    for file in os.listdir(folder):
+        name, extension = os.path.splitext(file)
+        if extension in EXTENSIONS.values() and name.isdigit():
+            partitions[name] = os.path.join(folder, name)
+    return sorted(partitions.items())
+
+
+def read_partition(partition_path, columns=None):
+    path, fmt = find_partition(partition_path)
+    if path is None:
+        raise FileNotFoundError(f"No partition found for {partition_path}")
+    if fmt == 'parquet':
+        _require_arrow(fmt)
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if fmt == 'arrow':
+        _require_arrow(fmt)
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if fmt == 'csv':
+        import pandas as pd
+        return pd.read_csv(path, usecols=columns, low_memory=False)
+    import pandas as pd
+    return pd.read_excel(path, usecols=columns)
+
+
+def partition_columns(partition_path):
+    """
+    The column names of a partition, read from its schema or header without loading the rows.
+    """
+    path, fmt = find_partition(partition_path)
+    if path is None:
+        raise FileNotFoundError(f"No partition found for {partition_path}")
+    if fmt == 'parquet':
+        _require_arrow(fmt)
+        return pq.read_schema(path).names
+    if fmt == 'arrow':
+        _require_arrow(fmt)
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+    import pandas as pd
+    if fmt == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    return list(pd.read_excel(path, nrows=0).columns)
+
+
+def iter_partition_batches(partition_path, batch_rows, columns=None):
+    """
+    Yields a partition as DataFrames of at most batch_rows rows without loading the whole file.
+    Excel files cannot be streamed and are read in one go before being split.
+    """
+    path, fmt = find_partition(partition_path)
+    if path is None:
+        raise FileNotFoundError(f"No partition found for {partition_path}")
+    if fmt == 'parquet':
+        _require_arrow(fmt)
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == 'arrow':
+        _require_arrow(fmt)
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                table = pa.Table.from_batches([reader.get_batch(index)])
+                if columns is not None:
+                    table = table.select(columns)
+                for start in range(0, table.num_rows, batch_rows):
+                    yield table.slice(start, batch_rows).to_pandas()
+    elif fmt == 'csv':
+        import pandas as pd
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_rows, low_memory=False)
+    else:
+        import pandas as pd
+        df = pd.read_excel(path, usecols=columns)
+        for start in range(0, len(df), batch_rows):
+            yield df.iloc[start:start + batch_rows]
+
+
+class PartitionWriter:
+    """
+    Writes a partition one DataFrame batch at a time, the schema is taken from the first batch.
+    """
+
+    def __init__(self, partition_path, fmt):
+        if fmt == 'xlsx':
+            raise ValueError("xlsx partitions cannot be written incrementally")
+        self.path = partition_file(partition_path, fmt)
+        self.fmt = fmt
+        self.writer = None
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, df):
+        if self.fmt == 'csv':
+            df.to_csv(self.path, mode='a', header=not os.path.exists(self.path), index=False)
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            # Categorical columns get the smallest index type that fits the first batch, later batches can have more categories
+            self.schema = pa.schema([pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+                                     for field in table.schema], metadata=table.schema.metadata)
+            if self.fmt == 'parquet':
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if self.fmt != 'csv' and self.writer is not None:
+            self.writer.close()
+
+
+def write_partition(df, partition_path, fmt):
+    path = partition_file(partition_path, fmt)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if fmt == 'parquet':
+        _require_arrow(fmt)
+        df.to_parquet(path, index=False)
+    elif fmt == 'arrow':
+        _require_arrow(fmt)
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), path)
+    elif fmt == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
+
+
+class RawWriter:
+    """
+    Incremental writer for extracted comments. Rows are written next to the partition under a .partial name
+    and only replace it in close, so an interrupted run never leaves a half written file under the final
+    name. CSV gets its header once when the file is started, the columnar formats write every batch to its
+    own part file and merge the parts in close.
+
+    position() flushes the rows written so far and returns a point the writer can be reopened at with
+    resume: the size of the CSV file, or the number of part files. Anything written after it is dropped.
+    """
+
+    def __init__(self, partition_path, fmt='csv', columns=RAW_COLUMNS, batch_rows=100000, resume=None):
+        self.path = partition_file(partition_path, fmt)
+        self.partial_path = f"{self.path}.partial"
+        self.fmt = fmt
+        self.columns = columns
+        self.batch_rows = batch_rows
+        self.rows = []
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if resume and not os.path.exists(self.partial_path if fmt == 'csv' else self._part_path(resume - 1)):
+            raise FileNotFoundError(f"Cannot resume {self.path}, its partial output is missing")
+        if fmt == 'csv':
+            if resume:
+                self.handle = open(self.partial_path, 'r+', encoding='UTF-8', newline='')
+                self.handle.truncate(resume)
+                self.handle.seek(0, os.SEEK_END)
+            else:
+                self.handle = open(self.partial_path, 'w', encoding='UTF-8', newline='')
+            self.csv_writer = csv.writer(self.handle)
+            if not resume:
+                self.csv_writer.writerow(columns)
+        else:
+            _require_arrow(fmt)
+            self.schema = pa.schema([(column, pa.int64() if column == 'score' else pa.string()) for column in columns])
+            self.parts = resume or 0
+            self._remove_parts(self.parts)
+
+    def _part_path(self, index):
+        return f"{self.path}.part{index:05d}"
+
+    def _remove_parts(self, first):
+        folder = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.part'
+        indexes = [int(file[len(prefix):]) for file in os.listdir(folder) if file.startswith(prefix) and file[len(prefix):].isdigit()]
+        # Last part first, so parts are always removed from the end and a resume position stays usable
+        for index in sorted(indexes, reverse=True):
+            if index >= first:
+                os.remove(self._part_path(index))
+
+    def writerow(self, row):
+        if self.fmt == 'csv':
+            self.csv_writer.writerow(row)
+            return
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.fmt == 'csv':
+            self.handle.flush()
+            return
+        if self.rows:
+            columns = list(zip(*self.rows))
+            arrays = [pa.array(_column_values(values, field.type), type=field.type) for values, field in zip(columns, self.schema)]
+            part_path = self._part_path(self.parts)
+            _write_table(pa.Table.from_arrays(arrays, schema=self.schema), f"{part_path}.tmp", self.fmt)
+            os.replace(f"{part_path}.tmp", part_path)
+            self.parts += 1
+            self.rows = []
+
+    def position(self):
+        self.flush()
+        if self.fmt == 'csv':
+            os.fsync(self.handle.fileno())
+            return os.fstat(self.handle.fileno()).st_size
+        return self.parts
+
+    def close(self):
+        if self.fmt == 'csv':
+            self.handle.close()
+        else:
+            self.flush()
+            if self.fmt == 'parquet':
+                writer = pq.ParquetWriter(self.partial_path, self.schema)
+            else:
+                writer = pa.ipc.new_file(self.partial_path, self.schema)
+            for index in range(self.parts):
+                writer.write_table(_read_table(self._part_path(index), self.fmt))
+            writer.close()
+        os.replace(self.partial_path, self.path)
+        if self.fmt != 'csv':
+            # Removed after the rename, a close stopped before it can still be redone from the parts
+            self._remove_parts(0)
+
+    @staticmethod
+    def is_closed(partition_path, fmt, resume):
+        """
+        Whether a writer saved at position resume has already been closed: its output is under the final
+        name and nothing is left to merge. Closing again is then not needed and not possible.
+        """
+        path = partition_file(partition_path, fmt)
+        if not os.path.exists(path) or os.path.exists(f"{path}.partial"):
+            return False
+        return fmt == 'csv' or not resume or not os.path.exists(f"{path}.part{resume - 1:05d}")
+
+
+def _write_table(table, path, fmt):
+    if fmt == 'parquet':
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path, compression='uncompressed')
+
+
+def _read_table(path, fmt):
+    if fmt == 'parquet':
+        return pq.read_table(path)
+    return feather.read_table(path)
+
+
+def _column_values(values, arrow_type):
+    if arrow_type == pa.int64():
+        return [_to_int(value) for value in values]
+    return [None if value is None else str(value) for value in values]
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,70 @@
+import json
+import random
+import calendar
+import zstandard
+
+# Filler vocabulary for generated comments, mixed with sentiment and emotion words so the scoring stages do real work
+WORDS = ['the', 'a', 'and', 'of', 'to', 'in', 'is', 'that', 'it', 'for', 'on', 'with', 'as', 'this', 'was', 'people',
+         'government', 'country', 'news', 'world', 'think', 'just', 'like', 'really', 'would', 'could', 'year', 'time',
+         'good', 'great', 'bad', 'terrible', 'happy', 'angry', 'afraid', 'hope', 'trust', 'love', 'hate', 'crisis',
+         'war', 'peace', 'win', 'lose', 'surprise', 'sad', 'disgusting', 'wonderful', 'fear', 'policy', 'vote', 'report']
+DEFAULT_KEYWORDS = ['economy', 'inflation', 'recession', 'unemployment', 'markets', 'trade', 'interest rates']
+
+
+def synthetic_comment(rng, index, keywords, keyword_density, years, subreddit, words_per_comment):
+    year = rng.choice(years)
+    start = calendar.timegm((year, 1, 1, 0, 0, 0))
+    end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+    words = rng.choices(WORDS, k=rng.randint(1, words_per_comment * 2))
+    if keywords and rng.random() < keyword_density:
+        words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+    body = ' '.join(words).capitalize() + rng.choice(['.', '!', '?', ''])
+    if rng.random() < 0.02:
+        body = rng.choice(['[deleted]', '[removed]'])
+    thread = rng.randrange(max(index // 50, 1))
+    return {
+        'author': f"user_{rng.randrange(10000)}",
+        'body': body,
+        'score': rng.randint(-20, 200),
+        'created_utc': rng.randrange(start, end),
+        'subreddit': subreddit,
+        'id': f"c{index:x}",
+        'link_id': f"t3_{thread:x}",
+        'parent_id': f"t3_{thread:x}" if rng.random() < 0.5 else f"t1_c{rng.randrange(max(index, 1)):x}",
+    }
+
+
+def generate_dump(output_file, lines=None, size_mb=None, keyword_density=0.1, years=(2018, 2019, 2020, 2021, 2022),
+                  keywords=DEFAULT_KEYWORDS, subreddit='worldnews', words_per_comment=25, seed=0, level=3):
+    """
+    Writes a zstd compressed NDJSON dump in the layout of the Reddit comment dumps. Stops after lines
+    comments or once size_mb megabytes of uncompressed JSON are written, whichever is set. keyword_density
+    is the share of comments containing one of keywords, created_utc is spread uniformly over years.
+    Returns the number of lines and uncompressed bytes written.
+    """
+    if lines is None and size_mb is None:
+        raise ValueError("Set lines or size_mb")
+    rng = random.Random(seed)
+    years = list(years)
+    max_bytes = size_mb * 2**20 if size_mb is not None else None
+    line_count = 0
+    byte_count = 0
+    with open(output_file, 'wb') as handle:
+        with zstandard.ZstdCompressor(level=level).stream_writer(handle) as writer:
+            while (lines is None or line_count < lines) and (max_bytes is None or byte_count < max_bytes):
+                line = json.dumps(synthetic_comment(rng, line_count, keywords, keyword_density, years, subreddit, words_per_comment)).encode() + b"\n"
+                writer.write(line)
+                line_count += 1
+                byte_count += len(line)
+    return line_count, byte_count
+
+
+if __name__ == "__main__":
+    # Configuration
+    output_file = r"zst_input\synthetic_comments.zst"
+    size_mb = 100
+    keyword_density = 0.1
+    years = range(2018, 2023)
+
+    line_count, byte_count = generate_dump(output_file, size_mb=size_mb, keyword_density=keyword_density, years=years)
+    print(f"Wrote {line_count} comments ({byte_count / 2**20:.1f} MB uncompressed) to {output_file}")
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def treebank_tokenizer(monkeypatch):
+    # Punctuation is stripped before tokenizing, so the Treebank tokenizer word_tokenize uses per sentence
+    # gives the same tokens without the punkt sentence model
+    import nltk.tokenize
+    from nltk.tokenize import TreebankWordTokenizer
+    import text_preprocessing
+    monkeypatch.setattr(nltk.tokenize, 'word_tokenize', TreebankWordTokenizer().tokenize)
+    monkeypatch.setattr(text_preprocessing, '_preprocessor', None)
+
+
+@pytest.fixture(scope='session')
+def analyzer():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
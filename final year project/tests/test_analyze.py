@@ -0,0 +1,62 @@
+import os
+import sys
+import random
+from datetime import datetime
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyze
+from aggregates import read_aggregates
+from cache import ResultCache
+from instrumentation import start_run
+from storage import RAW_COLUMNS, partition_file, read_partition, write_partition
+from synthetic_dump import synthetic_comment
+
+KEYWORDS = ['trade', 'market']
+pytestmark = pytest.mark.usefixtures('treebank_tokenizer')
+
+
+@pytest.fixture
+def raw_year(tmp_path):
+    rng = random.Random(0)
+    rows = []
+    for index in range(600):
+        comment = synthetic_comment(rng, index, ['trade', 'markets', 'economy'], 0.5, [2020], 'worldnews', 15)
+        created = datetime.utcfromtimestamp(comment['created_utc'])
+        rows.append([comment['score'], created.strftime("%Y-%m-%d"), comment['author'], comment['body'],
+                     comment['id'], comment['link_id'], comment['parent_id'], comment['subreddit']])
+    partition = str(tmp_path / 'raw' / '2020' / '2020')
+    write_partition(pd.DataFrame(rows, columns=RAW_COLUMNS), partition, 'csv')
+    return partition
+
+
+def test_package_upgrade_reruns_a_cached_year(raw_year, tmp_path, analyzer, monkeypatch):
+    output = str(tmp_path / 'processed' / '2020')
+    cache = ResultCache(str(tmp_path / 'cache'))
+    analyze.analyze_year(raw_year, output, analyzer, KEYWORDS, cache=cache)
+    skipped = start_run('analyze')
+    analyze.analyze_year(raw_year, output, analyzer, KEYWORDS, cache=cache)
+    assert skipped.counters.get('years_skipped') == 1
+
+    versions = analyze.package_versions
+    monkeypatch.setattr(analyze, 'package_versions', lambda *packages: dict(versions(*packages), nltk='0'))
+    rerun = start_run('analyze')
+    analyze.analyze_year(raw_year, output, analyzer, KEYWORDS, cache=cache)
+    assert rerun.counters.get('years_analyzed') == 1
+
+
+def test_streaming_matches_in_memory_analysis(raw_year, tmp_path, analyzer):
+    memory = tmp_path / 'memory'
+    streamed = tmp_path / 'streamed'
+    analyze.analyze_year(raw_year, str(memory / '2020'), analyzer, KEYWORDS, subreddit='worldnews', topic='economics')
+    # Batches much smaller than the year, so the moments are merged across batches and the output written in pieces
+    analyze.analyze_year_streaming(raw_year, str(streamed / '2020'), analyzer, KEYWORDS, batch_rows=100, subreddit='worldnews', topic='economics')
+
+    expected = read_partition(str(memory / '2020'))
+    result = read_partition(str(streamed / '2020'))
+    assert len(expected) > 100
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_exact=False, rtol=1e-9, check_categorical=False)
+    pd.testing.assert_frame_equal(read_aggregates(str(streamed), '2020'), read_aggregates(str(memory), '2020'), check_exact=False, rtol=1e-9)
+    assert not os.path.exists(partition_file(str(streamed / '2020') + '.scored', 'parquet'))
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ResultCache
+
+
+def stage_files(root, stage):
+    return sorted(file for file in os.listdir(os.path.join(root, stage)) if file.endswith('.pkl'))
+
+
+def test_cached_result_is_reused(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    calls = []
+    key = cache.key('stage', 1)
+    assert cache.cached('stage', key, lambda: calls.append(1) or 'first') == 'first'
+    assert cache.cached('stage', key, lambda: calls.append(1) or 'second') == 'first'
+    assert len(calls) == 1
+
+
+def test_only_latest_result_per_source_is_kept(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    root = str(tmp_path)
+    first, second, other = cache.key('stage', 1), cache.key('stage', 2), cache.key('stage', 3)
+    cache.cached('stage', first, lambda: 'first', source='2019.csv')
+    cache.cached('stage', other, lambda: 'other', source='2020.csv')
+    cache.cached('stage', second, lambda: 'second', source='2019.csv')
+    assert stage_files(root, 'stage') == sorted([f"{second}.pkl", f"{other}.pkl"])
+    # Going back to an earlier configuration recomputes it and drops the one it replaces
+    assert cache.cached('stage', first, lambda: 'again', source='2019.csv') == 'again'
+    assert stage_files(root, 'stage') == sorted([f"{first}.pkl", f"{other}.pkl"])
+
+
+def test_results_without_source_are_not_pruned(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    for value in range(3):
+        cache.cached('stage', cache.key('stage', value), lambda: value)
+    assert len(stage_files(str(tmp_path), 'stage')) == 3
+
+
+def test_package_versions_track_installed_packages():
+    from cache import package_versions
+    versions = package_versions('pandas', 'no-such-package-here')
+    assert versions['pandas'] == __import__('pandas').__version__
+    assert versions['no-such-package-here'] is None
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gather_raw
+from checkpoint import ExtractionCheckpoint
+from storage import RawWriter, read_partition
+from synthetic_dump import generate_dump
+
+YEARS = [2019, 2020]
+KEYWORDS = {'economy': ['economy', 'inflation'], 'trade': ['trade', 'markets']}
+
+
+@pytest.fixture(scope='module')
+def dump(tmp_path_factory):
+    path = tmp_path_factory.mktemp('dump') / 'comments.zst'
+    generate_dump(str(path), lines=3000, years=YEARS, keyword_density=0.5)
+    return str(path)
+
+
+def extract(dump, output_folder, fmt, checkpoint_path=None):
+    topics = {topic: (os.path.join(output_folder, topic), keywords) for topic, keywords in KEYWORDS.items()}
+    gather_raw.process_file_multi(dump, topics, YEARS, 'body', False, output_format=fmt, checkpoint_path=checkpoint_path,
+                                  checkpoint_lines=500, block_size=2**14)
+    return topics
+
+
+def read_outputs(output_folder):
+    outputs = {}
+    for topic in KEYWORDS:
+        for year in YEARS:
+            folder = os.path.join(output_folder, topic, str(year))
+            # Nothing may be left under a temporary name once the extraction is complete
+            assert sorted(os.listdir(folder)) in ([f"{year}.csv"], [f"{year}.parquet"])
+            outputs[(topic, year)] = read_partition(os.path.join(folder, str(year)))
+    return outputs
+
+
+def assert_same_outputs(output_folder, reference_folder):
+    outputs = read_outputs(output_folder)
+    for key, reference in read_outputs(reference_folder).items():
+        pd.testing.assert_frame_equal(outputs[key], reference)
+
+
+def stop_once(monkeypatch, owner, name, should_stop):
+    """
+    Makes owner.name raise KeyboardInterrupt the first time should_stop(*args, **kwargs) is true.
+    """
+    original = getattr(owner, name)
+    stopped = []
+
+    def wrapper(*args, **kwargs):
+        if not stopped and should_stop(*args, **kwargs):
+            stopped.append(True)
+            raise KeyboardInterrupt
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, wrapper)
+    return stopped
+
+
+@pytest.fixture(params=['csv', 'parquet'])
+def fmt(request):
+    return request.param
+
+
+@pytest.fixture
+def reference(dump, fmt, tmp_path):
+    folder = str(tmp_path / 'reference')
+    extract(dump, folder, fmt)
+    return folder
+
+
+def resume_after_stop(dump, fmt, tmp_path, monkeypatch, owner, name, should_stop):
+    output_folder = str(tmp_path / 'output')
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    with monkeypatch.context() as patch:
+        stopped = stop_once(patch, owner, name, should_stop)
+        with pytest.raises(KeyboardInterrupt):
+            extract(dump, output_folder, fmt, checkpoint_path)
+    assert stopped
+    extract(dump, output_folder, fmt, checkpoint_path)
+    with open(checkpoint_path, 'r') as handle:
+        assert json.load(handle)['complete']
+    return output_folder
+
+
+def test_uninterrupted_run_matches_plain_run(dump, fmt, tmp_path, reference):
+    output_folder = str(tmp_path / 'output')
+    extract(dump, output_folder, fmt, str(tmp_path / 'checkpoint.json'))
+    assert_same_outputs(output_folder, reference)
+
+
+def test_resume_after_stop_while_reading(dump, fmt, tmp_path, monkeypatch, reference):
+    calls = []
+    output_folder = resume_after_stop(dump, fmt, tmp_path, monkeypatch, gather_raw, 'write_block',
+                                      lambda *args: calls.append(True) or len(calls) == 8)
+    assert_same_outputs(output_folder, reference)
+
+
+def test_resume_after_stop_between_close_and_final_save(dump, fmt, tmp_path, monkeypatch, reference):
+    output_folder = resume_after_stop(dump, fmt, tmp_path, monkeypatch, ExtractionCheckpoint, 'save',
+                                      lambda self, *args, **kwargs: kwargs.get('complete', args[5] if len(args) > 5 else False))
+    assert_same_outputs(output_folder, reference)
+
+
+def test_resume_after_stop_while_closing_writers(dump, fmt, tmp_path, monkeypatch, reference):
+    closed = []
+    output_folder = resume_after_stop(dump, fmt, tmp_path, monkeypatch, RawWriter, 'close',
+                                      lambda self: closed.append(True) or len(closed) == 3)
+    assert_same_outputs(output_folder, reference)
+
+
+def test_resume_after_stop_while_removing_parts(dump, tmp_path, monkeypatch):
+    reference = str(tmp_path / 'reference')
+    extract(dump, reference, 'parquet')
+    output_folder = resume_after_stop(dump, 'parquet', tmp_path, monkeypatch, RawWriter, '_remove_parts',
+                                      lambda self, first: first == 0)
+    assert_same_outputs(output_folder, reference)
+
+
+@pytest.mark.parametrize('block_size', [64, 2**14])
+def test_blocks_rebuild_the_dump_line_for_line(dump, block_size):
+    import zstandard
+    with open(dump, 'rb') as file_handle:
+        data = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle).read()
+    expected = [line.strip() for line in data.split(b"\n") if line.strip()]
+    # 64 bytes is shorter than most comments, so the buffer has to grow to hold a whole line
+    blocks = [block for block, _ in gather_raw.read_blocks_zst(dump, block_size)]
+    assert b"".join(blocks) == data
+    assert all(block.endswith(b"\n") for block in blocks)
+    assert [line for block in blocks for line in gather_raw.iter_lines(block)] == expected
+    resumed = b"".join(block for block, _ in gather_raw.read_blocks_zst(dump, block_size, len(blocks[0]) + len(blocks[1])))
+    assert resumed == data[len(blocks[0]) + len(blocks[1]):]
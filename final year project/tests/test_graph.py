@@ -0,0 +1,68 @@
+import os
+import sys
+import numpy as np
+import pytest
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import graph
+import linear_regression
+from aggregates import monthly_aggregates, write_aggregates
+from instrumentation import start_run
+from storage import write_partition
+
+
+def write_year(processed_folder, year, comments):
+    rng = np.random.default_rng(year)
+    created = pd.to_datetime(rng.integers(pd.Timestamp(f"{year}-01-01").value, pd.Timestamp(f"{year}-12-31").value, comments))
+    df = pd.DataFrame({
+        'created_utc': created,
+        'sentiment_score': rng.uniform(-1, 1, comments).astype('float32'),
+        'score': rng.integers(1, 50, comments),
+        'primary_emotion': rng.choice(['joy', 'fear', 'No emotion'], comments),
+    })
+    output = df.rename(columns={'created_utc': 'Created_UTC', 'sentiment_score': 'Sentiment_Score', 'score': 'Score', 'primary_emotion': 'Primary_Emotion'})
+    write_partition(output, os.path.join(processed_folder, str(year)), 'parquet')
+    write_aggregates(monthly_aggregates(df, 'worldnews', 'economics'), processed_folder, str(year), 'parquet')
+
+
+def test_second_run_skips_every_figure(tmp_path):
+    processed_folder = str(tmp_path / 'processed')
+    output_folder = str(tmp_path / 'graphs')
+    write_year(processed_folder, 2019, 200)
+    # No comment of 2020 passed the filters
+    write_year(processed_folder, 2020, 0)
+    write_year(processed_folder, 2021, 200)
+
+    first = start_run('graph')
+    graph.generate_graphs(processed_folder, output_folder, workers=1)
+    rendered = first.counters['figures_rendered']
+    assert not os.path.exists(os.path.join(output_folder, '2020_weighted_monthly_std.png'))
+    assert not os.path.exists(os.path.join(output_folder, 'emotion_pie', '2020_emotion_pie.png'))
+
+    second = start_run('graph')
+    graph.generate_graphs(processed_folder, output_folder, workers=1)
+    assert second.counters.get('figures_rendered', 0) == 0
+    assert second.counters.get('years_summarized', 0) == 0
+    assert second.counters['figures_skipped'] == rendered
+
+
+def test_pie_after_an_empty_year_compares_with_the_last_year_with_comments(tmp_path):
+    processed_folder = str(tmp_path / 'processed')
+    for year, comments in ((2019, 200), (2020, 0), (2021, 200)):
+        write_year(processed_folder, year, comments)
+    partitions = [(year, partition) for year, partition in graph.list_partitions(processed_folder) if graph.has_comments(partition)]
+    inputs = graph.figure_inputs(partitions, 'graphs')
+    assert inputs[os.path.join('graphs', 'emotion_pie', '2021_emotion_pie.png')] == ['2019', '2021']
+
+
+def test_weekly_output_without_aggregates_is_rejected(tmp_path):
+    processed_folder = str(tmp_path / 'processed')
+    df = pd.DataFrame({'Created_UTC': pd.to_datetime(['2020-01-05', '2020-02-07']), 'Sentiment_Score': [0.1, -0.2],
+                       'Unweighted_Weekly_Std': [0.0, 0.0], 'Weighted_Weekly_Std': [0.0, 0.0], 'Primary_Emotion': ['joy', 'fear']})
+    write_partition(df, os.path.join(processed_folder, '2020'), 'parquet')
+    with pytest.raises(ValueError, match='Weekly standard deviations'):
+        graph.summarize_year('2020', os.path.join(processed_folder, '2020'))
+    with pytest.raises(ValueError, match='Weekly standard deviations'):
+        linear_regression.monthly_table(processed_folder)
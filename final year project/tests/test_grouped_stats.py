@@ -0,0 +1,65 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grouped_stats import add_group_keys, group_stats, attach_group_stats, MomentAccumulator
+
+
+def weighted_std(values, weights):
+    # The per-group apply analyze used before grouped_stats
+    average = np.average(values, weights=weights)
+    variance = np.average((values-average)**2, weights=weights)
+    return np.sqrt(variance)
+
+
+@pytest.fixture
+def comments():
+    rng = np.random.default_rng(0)
+    size = 400
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 365 * 2, size), unit='D')
+    df = pd.DataFrame({
+        'created_utc': dates,
+        'sentiment_score': rng.uniform(-1, 1, size),
+        'score': rng.integers(1, 50, size),
+    })
+    # A month with a single comment has no unweighted std
+    single = pd.DataFrame({'created_utc': [pd.Timestamp('2022-03-05')], 'sentiment_score': [0.4], 'score': [3]})
+    df = pd.concat([df, single], ignore_index=True)
+    add_group_keys(df)
+    return df
+
+
+def reference(df):
+    grouped = df.groupby(['year', 'month'])
+    return pd.DataFrame({
+        'unweighted_std': grouped['sentiment_score'].std(),
+        'weighted_std': grouped[['sentiment_score', 'score']].apply(lambda x: weighted_std(x['sentiment_score'], x['score'])),
+    })
+
+
+def test_group_stats_matches_pandas_and_weighted_std(comments):
+    stats = group_stats(comments, ['year', 'month'])
+    expected = reference(comments)
+    pd.testing.assert_series_equal(stats['unweighted_std'], expected['unweighted_std'], check_names=False)
+    pd.testing.assert_series_equal(stats['weighted_std'], expected['weighted_std'], check_names=False)
+    assert stats['unweighted_std'].isna().sum() == 1
+
+
+def test_attach_group_stats_broadcasts_per_row(comments):
+    expected = comments[['year', 'month']].merge(reference(comments).reset_index(), on=['year', 'month'], how='left')
+    attach_group_stats(comments, ['year', 'month'])
+    np.testing.assert_allclose(comments['unweighted_std'], expected['unweighted_std'], atol=1e-12)
+    np.testing.assert_allclose(comments['weighted_std'], expected['weighted_std'], atol=1e-12)
+
+
+def test_accumulator_batches_match_group_stats(comments):
+    accumulator = MomentAccumulator(['year', 'month'])
+    for start in range(0, len(comments), 37):
+        accumulator.update(comments.iloc[start:start + 37])
+    result = accumulator.result()
+    expected = group_stats(comments, ['year', 'month'])
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, rtol=1e-9)
@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gather_raw import TopicRouter, get_json_loads
+from storage import RawWriter, read_partition
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+def test_parsers_agree_on_unpaired_surrogates(use_orjson):
+    loads = get_json_loads(use_orjson)
+    assert loads(b'{"body": "a \\ud800 b", "score": 1}') == {'body': 'a � b', 'score': 1}
+    # Paired surrogates are one character and are left alone
+    assert loads(b'{"body": "\\ud83d\\ude00"}') == {'body': '\U0001f600'}
+    with pytest.raises(ValueError):
+        loads(b'{"body": ')
+
+
+@pytest.mark.parametrize('use_orjson', [True, False])
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_comment_with_unpaired_surrogate_is_written(tmp_path, use_orjson, fmt):
+    router = TopicRouter({'economics': (None, ['trade'])}, [2020], 'body', False, use_orjson=use_orjson)
+    line = b'{"created_utc": 1590000000, "author": "a", "score": 3, "body": "trade \\udc00"}'
+    _, _, row = router.route(line)
+    writer = RawWriter(str(tmp_path / '2020'), fmt)
+    writer.writerow(row)
+    writer.close()
+    assert read_partition(str(tmp_path / '2020'))['body'].tolist() == ['trade �']
@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_matcher import KeywordMatcher
+from gather_raw import TopicRouter
+from synthetic_dump import synthetic_comment
+
+
+def test_find_all_returns_listed_keywords_for_case_variants():
+    matcher = KeywordMatcher(['stocks', 'Trade'])
+    assert matcher.find_all('ſtocks and TRADE') == {'stocks', 'trade'}
+    assert KeywordMatcher(['stocks'], exact_match=True).find_all('ſTOCKS') == {'stocks'}
+
+
+def test_find_all_keeps_prefix_keywords_of_case_variants():
+    matcher = KeywordMatcher(['stock', 'stocks'], whole_word=True)
+    assert matcher.find_all('ſtocks') == {'stocks'}
+    assert KeywordMatcher(['stock', 'stocks']).find_all('ſtocks') == {'stock', 'stocks'}
+
+
+def test_router_keeps_comment_with_case_variant_keyword():
+    router = TopicRouter({'economics': (None, ['stocks', 'trade'])}, [2020], 'body', False, prefilter=False, use_orjson=False)
+    line = '{"created_utc": 1590000000, "author": "a", "score": 3, "body": "\\u017ftocks and trade"}'
+    year, topics, _ = router.route(line)
+    assert (year, topics) == (2020, ['economics'])
+
+
+def router_lines():
+    rng = random.Random(0)
+    comments = [synthetic_comment(rng, index, ['stocks', 'trade', 'interest rates'], 0.3, [2019, 2020, 2021], 'worldnews', 10)
+                for index in range(300)]
+    bodies = ['ſtocks are up', 'STOCKS', 'Interest Rates', 'stoc\u006bs', 'TRADE talks', 'ıllegal trade', 'nothing here',
+              '\U0001f600 stocks', '\u212a is not a keyword']
+    comments += [{'author': 'a', 'score': 1, 'created_utc': 1590000000 + index, 'body': body} for index, body in enumerate(bodies)]
+    lines = []
+    for comment in comments:
+        # Written both escaped, as the dumps do, and as raw UTF-8
+        lines.append(json.dumps(comment).encode())
+        lines.append(json.dumps(comment, ensure_ascii=False).encode('utf-8'))
+    return lines
+
+
+@pytest.mark.parametrize('exact_match', [False, True])
+def test_prefilter_keeps_every_comment_the_matcher_keeps(exact_match):
+    topics = {'economics': (None, ['stocks', 'trade', 'interest rates']), 'markets': (None, ['Stocks'])}
+    routed = {}
+    for prefilter in (True, False):
+        router = TopicRouter(topics, [2020, 2021], 'body', exact_match, prefilter=prefilter, use_orjson=False)
+        routed[prefilter] = [router.route(line) for line in router_lines()]
+    assert routed[True] == routed[False]
+    assert any(result is not None for result in routed[False])
+
+
+def test_exact_token_matches_whole_tokens_only():
+    matcher = KeywordMatcher(['Trade', 'tech sector', 'stock'], exact_token=True)
+    assert matcher.find_all('free trade and stocks') == {'trade'}
+    assert matcher.find_all(['tech', 'sector', 'STOCK']) == {'stock'}
+    assert not matcher.search('trading stocks in the tech sector')
@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scipy import stats
+from linear_regression import fit_trends
+
+
+def linregress(values):
+    # Fitted the way the per-series loop did, against the month numbers of the values that are present
+    values = np.asarray(values, dtype=float)
+    months = np.arange(len(values))
+    present = ~np.isnan(values)
+    return stats.linregress(months[present], values[present])
+
+
+def test_fit_trends_matches_linregress():
+    rng = np.random.default_rng(0)
+    series = [
+        rng.normal(0.1, 0.05, 48) + np.linspace(0, 0.2, 48),
+        # Shorter series are NaN padded to the longest one inside fit_trends
+        rng.normal(0.0, 0.1, 12),
+        -np.linspace(0, 1, 7) + rng.normal(0, 0.01, 7),
+        rng.normal(0.3, 0.2, 30),
+    ]
+    gap = rng.normal(0.2, 0.1, 24)
+    gap[[3, 10, 11]] = np.nan
+    series.append(gap)
+    fit = fit_trends(series)
+    for row, values in enumerate(series):
+        expected = linregress(values)
+        assert fit['slope'][row] == pytest.approx(expected.slope, rel=1e-9)
+        assert fit['intercept'][row] == pytest.approx(expected.intercept, rel=1e-9)
+        assert fit['r_squared'][row] == pytest.approx(expected.rvalue ** 2, rel=1e-9)
+        assert fit['p_value'][row] == pytest.approx(expected.pvalue, rel=1e-6, abs=1e-300)
+        assert fit['std_err'][row] == pytest.approx(expected.stderr, rel=1e-9)
+
+
+def test_fit_trends_leaves_short_series_unfitted():
+    fit = fit_trends([[0.1, 0.2], [0.1, 0.3, 0.2], [0.5, 0.5, 0.5, 0.5]])
+    assert np.isnan(fit['slope'][0])
+    assert fit['slope'][1] == pytest.approx(linregress([0.1, 0.3, 0.2]).slope)
+    # A flat series has a zero slope and no correlation, as linregress reports it
+    assert fit['slope'][2] == 0
+    assert fit['r_squared'][2] == 0
@@ -0,0 +1,93 @@
+import os
+import re
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nltk.tokenize
+
+TEXTS = [
+    "The accidental absentee ballots terrified the voters!",
+    "Accidentally, the economy is doing terribly: inflation and unemployment rose.",
+    "I love this, what a wonderful and joyful surprise https://example.com @someone",
+    "Generously generous generations of abandoned, abandoning people feel angry and afraid.",
+    "Trade wars cannot help, they're gonna hurt markets and stocks.",
+    "",
+]
+KEYWORDS = ['accident', 'accid', 'absent', 'absente', 'economi', 'trade', 'stock', 'gener']
+pytestmark = pytest.mark.usefixtures('treebank_tokenizer')
+
+
+def old_preprocess_text(text):
+    # preprocess_text of the original analyze.py
+    from nltk.stem import PorterStemmer
+    from nltk.corpus import stopwords
+    text = str(text)
+    text = re.sub(r"http\S+|www\S+|https\S+|@\w+", '', text)
+    text = re.sub(r"[^\w\s]", '', text)
+    stop_words = set(stopwords.words('english'))
+    word_tokens = nltk.tokenize.word_tokenize(text.lower())
+    filtered_text = [word for word in word_tokens if word not in stop_words]
+    ps = PorterStemmer()
+    return ' '.join(ps.stem(word) for word in filtered_text)
+
+
+def old_contains_keywords(text, keywords):
+    word_tokens = nltk.tokenize.word_tokenize(old_preprocess_text(text).lower())
+    return any(keyword.lower() in word_tokens for keyword in keywords)
+
+
+def old_primary_emotion(text, threshold=0.3):
+    from nrclex import NRCLex
+    text = old_preprocess_text(text)
+    emotion = NRCLex(text)
+    total_emotion_freq = sum(freq for emotion, freq in emotion.affect_frequencies.items() if emotion not in ['positive', 'negative'])
+    emotions = {key: value for key, value in emotion.affect_frequencies.items() if key not in ['positive', 'negative']}
+    if emotions and total_emotion_freq > 0:
+        primary, score = max(emotions.items(), key=lambda item: item[1])
+        if score / total_emotion_freq >= threshold:
+            return primary
+    return "No emotion"
+
+
+def processed_bodies():
+    from analyze import clean_comments
+    df = pd.DataFrame({'body': TEXTS, 'score': 1, 'author': 'a', 'created_utc': '2020-01-01'})
+    return clean_comments(df)['processed_body']
+
+
+def test_processed_body_is_stemmed_once():
+    assert processed_bodies().tolist() == [old_preprocess_text(text) for text in TEXTS]
+
+
+def test_keyword_filter_matches_old_double_pass():
+    from analyze import contains_keywords
+    for processed in processed_bodies():
+        for keyword in KEYWORDS:
+            assert contains_keywords(processed, [keyword], preprocessed=True) == old_contains_keywords(processed, [keyword]), (processed, keyword)
+    # Stemming twice turns 'accidental' into 'accid', the single pass stem 'accident' is no longer a token
+    assert not contains_keywords('accident', ['accident'], preprocessed=True)
+
+
+def test_emotion_lookup_matches_old_double_pass():
+    from emotion_index import get_emotion_index
+    from scoring import score_comments
+    processed = processed_bodies()
+    index = get_emotion_index()
+    expected = index.primary_emotions([old_preprocess_text(text).split() for text in processed])
+    assert score_comments(processed, sentiment=False)['primary_emotion'].tolist() == expected
+    # The second pass matters for these texts, scoring the single pass tokens gives other emotions
+    assert index.primary_emotions([text.split() for text in processed]) != expected
+
+
+def test_primary_emotion_matches_old_double_pass():
+    from textblob.exceptions import MissingCorpusError
+    from scoring import primary_emotion
+    processed = processed_bodies()
+    try:
+        expected = [old_primary_emotion(text) for text in processed]
+    except MissingCorpusError:
+        pytest.skip("NRCLex needs the TextBlob corpora")
+    assert [primary_emotion(text, preprocessed=True) for text in processed] == expected
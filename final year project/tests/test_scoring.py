@@ -0,0 +1,36 @@
+import os
+import sys
+import random
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scoring import score_comments, create_pool
+from synthetic_dump import synthetic_comment
+from text_preprocessing import get_preprocessor
+
+pytestmark = pytest.mark.usefixtures('treebank_tokenizer')
+
+
+@pytest.fixture
+def processed_bodies():
+    rng = random.Random(0)
+    bodies = [synthetic_comment(rng, index, ['trade'], 0.3, [2020], 'worldnews', 15)['body'] for index in range(700)]
+    # A shuffled index checks that the chunks come back in order and keep their labels
+    index = rng.sample(range(10000), len(bodies))
+    return get_preprocessor().tokenize_series(pd.Series(bodies, index=index)).str.join(' ')
+
+
+def test_pool_scores_equal_sequential_scores(processed_bodies, analyzer):
+    sequential = score_comments(processed_bodies, analyzer, workers=1)
+    parallel = score_comments(processed_bodies, analyzer, workers=2, chunk_size=100)
+    pd.testing.assert_frame_equal(parallel, sequential)
+    assert sequential['primary_emotion'].nunique() > 1
+
+
+def test_reused_pool_scores_equal_sequential_scores(processed_bodies, analyzer):
+    sequential = score_comments(processed_bodies, analyzer, workers=1, emotion=False)
+    with create_pool(2) as pool:
+        parallel = score_comments(processed_bodies, analyzer, chunk_size=64, emotion=False, pool=pool)
+    pd.testing.assert_frame_equal(parallel, sequential)
@@ -0,0 +1,57 @@
+import re
+from functools import lru_cache
+import pandas as pd
+
+URL_PATTERN = r"http\S+|www\S+|https\S+|@\w+"
+PUNCTUATION_PATTERN = r"[^\w\s]"
+
+
+class TextPreprocessor:
+    """
+    Cleans, tokenizes, removes stopwords and stems comments. The stopword set and stemmer are built
+    once, and stems are kept in an LRU cache since most tokens in a corpus are repeats of a small vocabulary.
+    nltk takes seconds to import, so it is only loaded when the first preprocessor is created.
+    """
+
+    def __init__(self, stem_cache_size=2**18):
+        from nltk.tokenize import word_tokenize
+        from nltk.stem import PorterStemmer
+        from nltk.corpus import stopwords
+        self.word_tokenize = word_tokenize
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+        self.url_pattern = re.compile(URL_PATTERN)
+        self.punctuation_pattern = re.compile(PUNCTUATION_PATTERN)
+
+    def clean(self, text):
+        text = self.url_pattern.sub('', str(text))
+        return self.punctuation_pattern.sub('', text).lower()
+
+    def tokens_from_clean(self, text):
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(word) for word in self.word_tokenize(text) if word not in stop_words]
+
+    def tokenize(self, text):
+        return self.tokens_from_clean(self.clean(text))
+
+    def tokenize_series(self, texts):
+        """
+        Tokenizes a whole column, the regex cleanup runs column-wise before tokenizing each row.
+        """
+        cleaned = (texts.astype(str)
+                   .str.replace(URL_PATTERN, '', regex=True)
+                   .str.replace(PUNCTUATION_PATTERN, '', regex=True)
+                   .str.lower())
+        return pd.Series([self.tokens_from_clean(text) for text in cleaned], index=texts.index, dtype=object)
+
+
+_preprocessor = None
+
+
+def get_preprocessor():
+    global _preprocessor
+    if _preprocessor is None:
+        _preprocessor = TextPreprocessor()
+    return _preprocessor
@@ -1,32 +1,38 @@
 import os
 import pandas as pd
+from storage import list_partitions
+from schema import read_comments, require_monthly_std
+from aggregates import has_aggregates, read_aggregates, monthly_measure
 
-# Configuration
-output_file = r"output.xlsx"
-column = "Sentiment_Score"
-input_folder = r"worldnews\worldnews_processed_economics"
-
-def process_file(filepath):
-    df = pd.read_excel(filepath)
-    df['Created_UTC'] = pd.to_datetime(df['Created_UTC'])
+def process_file(partition, column):
+    processed_folder, year = os.path.split(partition)
+    if has_aggregates(processed_folder, year):
+        aggregates = read_aggregates(processed_folder, year)
+        return pd.DataFrame({'Year': aggregates['year'], 'Month': aggregates['month'], column: monthly_measure(aggregates, column)})
+    if column.endswith('_Monthly_Std'):
+        require_monthly_std(partition)
+    df = read_comments(partition, columns=['Created_UTC', column])
     df['Year'] = df['Created_UTC'].dt.year
     df['Month'] = df['Created_UTC'].dt.month
     monthly_yearly_avg = df.groupby(['Year', 'Month'])[column].mean().reset_index()
     return monthly_yearly_avg
 
-def process_subfolder(subfolder_path):
+def process_subfolder(subfolder_path, column):
     all_sentiment_scores = []
-    for filename in os.listdir(subfolder_path):
-        if filename.endswith('.xlsx'):
-            filepath = os.path.join(subfolder_path, filename)
-            monthly_yearly_avg = process_file(filepath)
-            all_sentiment_scores.append(monthly_yearly_avg)
+    for _, partition in list_partitions(subfolder_path):
+        monthly_yearly_avg = process_file(partition, column)
+        all_sentiment_scores.append(monthly_yearly_avg)
     total_avg = pd.concat(all_sentiment_scores).groupby(['Year', 'Month']).mean().reset_index()
     return total_avg
 
-def save_data():
-    processed_data = process_subfolder(input_folder)
+def save_data(input_folder, output_file, column):
+    processed_data = process_subfolder(input_folder, column)
     processed_data.to_excel(output_file, index=False)
 
 if __name__ == "__main__":
-    save_data()
\ No newline at end of file
+    # Configuration
+    output_file = r"output.xlsx"
+    column = "Sentiment_Score"
+    input_folder = r"worldnews\worldnews_processed_economics"
+
+    save_data(input_folder, output_file, column)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import sys
+import multiprocessing
+
+# Importing nltk, vaderSentiment and nrclex and building the lexicons takes seconds, so the modules that use
+# them only load them on first use. warm_up does all of it once in a parent process before its workers are
+# started, worker_context then forks the workers from that parent so they start with everything loaded.
+
+
+def warm_up(preprocess=True, emotion=True, sentiment=True):
+    """
+    Builds the shared preprocessor, emotion index and sentiment analyzer. Each is only built once per
+    process, so calling this again is cheap.
+    """
+    if preprocess:
+        from text_preprocessing import get_preprocessor
+        get_preprocessor()
+    if emotion:
+        from emotion_index import get_emotion_index
+        get_emotion_index()
+    if sentiment:
+        from scoring import get_analyzer
+        get_analyzer()
+
+
+def worker_context():
+    """
+    The multiprocessing context for worker pools. On Linux workers are forked, so they are copies of the
+    warmed up parent and start instantly. Elsewhere fork is not available or not safe and the default
+    start method is used, the workers then load what they need in their initializer.
+    """
+    if sys.platform.startswith('linux'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()